@@ -4,14 +4,112 @@ join = os.path.join
 QUEUE = "short-serial"
 WALLCLOCK = "00:30"
 
+# Batch submission: estimated seconds to scan a dataset, plus per file and per GB of
+# data, for each scanning mode. Jobs are packed to fill this fraction of the wallclock.
+BATCH_COST_MODEL = {
+    'quick': {'dataset': 5., 'file': 0.5, 'gb': 0.},
+    'estimate': {'dataset': 5., 'file': 0.5, 'gb': 5.},
+    'full': {'dataset': 10., 'file': 1., 'gb': 60.},
+}
+BATCH_WALLCLOCK_FILL = 0.8
+
+# Scheduler command templates, see lib.batch.TemplateExecutor
+BATCH_TEMPLATES = {
+    'lsf': 'bsub -q {queue} -W {wallclock} -J {name} -o {stdout} -e {stderr} {command}',
+    'slurm': 'sbatch -p {queue} -t {wallclock}:00 -J {name} -o {stdout} -e {stderr} --wrap {quoted_command}',
+}
+
 DIR_GROUPING_LEVEL = 4
 CONCERN_THRESHOLD = 0.2
 
+# Extraction engine used for each scanning mode: 'header' reads NetCDF headers directly
+# with netCDF4 while 'xarray' opens all files with xarray.open_mfdataset
+ENGINES = {
+    'quick': 'header',
+    'estimate': 'header',
+    'full': 'xarray'
+}
+
+# Cache facts extracted from each file so rescans only read new or changed files
+# (only used by the 'header' engine)
+USE_FILE_CACHE = True
+
+# Maximum number of datasets waiting between each stage of the scanning pipeline
+# (discovered but not yet extracted, and extracted but not yet written)
+PIPELINE_QUEUE_SIZE = 100
+
+# Register backend: 'json' writes one file per dataset under JSON_OUTPUT_PATH,
+# 'sqlite' writes every dataset to the database at SQLITE_REGISTER_PATH
+REGISTER_BACKEND = 'json'
+REGISTER_BATCH_SIZE = 100
+SQLITE_TIMEOUT = 60
+
+# Write JSON register records without indentation (smaller and faster to write and read)
+COMPACT_JSON = False
+
+# Number of threads used to read register records concurrently, and to write each
+# batch of JSON register records
+LOAD_THREADS = 16
+WRITE_THREADS = 8
+
+# Number of directories listed concurrently when discovering datasets, and how long
+# (in seconds) a cached directory listing is trusted before its mtime is checked again.
+# By default every listing is checked, as directories created while a listing is trusted
+# are missed by discovery: only set this if the archive is known not to change meanwhile.
+DISCOVERY_THREADS = 16
+DISCOVERY_INDEX_TRUST_SECONDS = 0
+
+# Number of files the xarray engine opens at once, reading this many bytes from the start
+# of each concurrently to pull its header into the file system cache (the netCDF library
+# itself is only called from one thread at a time)
+OPEN_CONCURRENCY = 8
+OPEN_PREFETCH_BYTES = 1024 ** 2
+
+# How the xarray engine combines files: 'filename' concatenates them in the order of the
+# time ranges in their names (falling back to 'by_coords' if names have no time range),
+# 'by_coords' orders them by comparing their coordinates
+COMBINE = 'filename'
+
+# Maximum number of bytes of data values held in memory at once by each scan process during
+# a full scan, shared equally between the files read at once (see FILE_WORKERS)
+MEMORY_BUDGET = 256 * 1024 ** 2
+
+# Maximum number of bytes in each dask chunk of the variable opened by the xarray engine.
+# Chunks are whole on-disk chunks of each file (see lib.chunks.plan_chunks).
+CHUNK_MEMORY_BUDGET = 64 * 1024 ** 2
+
+# Estimate mode: number of files sampled per dataset and of blocks (whole on-disk chunks
+# along the leading dimension, or single time steps if unchunked) sampled per file, the
+# confidence of the reported error bound, and the seed that makes samples reproducible
+ESTIMATE_FILES = 4
+ESTIMATE_BLOCKS = 8
+ESTIMATE_CONFIDENCE = 0.95
+ESTIMATE_SEED = 0
+
+# Full mode: quantiles of the data values reported in the character, estimated with a
+# mergeable sketch to within this relative accuracy
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+# Full mode: number of files of a dataset read at once, in threads. Scans with more than
+# one worker process (scan.py --workers) read the files of each dataset one at a time.
+FILE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Scans sharing a selection through lease files (scan.py --coordinate): a lease that has
+# not been renewed for this many seconds belongs to a scan that died, and may be reclaimed
+LEASE_SECONDS = 600
+
+# Append the timings and bytes read of each phase of every scan to METRICS_PATH
+# (they are always recorded in the scan_metadata of the character)
+WRITE_METRICS = False
+
 # Output path templates
 _base_path = './outputs'
 BASE_LOG_DIR = join(_base_path, 'logs')
 BATCH_OUTPUT_PATH = join(BASE_LOG_DIR, 'batch-outputs/{grouped_ds_id}')
+BATCH_JOB_PATH = join(BASE_LOG_DIR, 'batch-jobs/{job_name}')
 JSON_OUTPUT_PATH = join(_base_path, 'register/{grouped_ds_id}.json')
+SQLITE_REGISTER_PATH = join(_base_path, 'register.sqlite')
 
 SUCCESS_PATH = join(BASE_LOG_DIR, 'success/{grouped_ds_id}.log')
 NO_FILES_PATH = join(BASE_LOG_DIR, 'failure/no_files/{grouped_ds_id}.log')
@@ -20,3 +118,9 @@ WRITE_ERROR_PATH = join(BASE_LOG_DIR, 'failure/write_error/{grouped_ds_id}.log')
 
 FIX_PATH = join(_base_path, 'fixes/{grouped_ds_id}.json')
 
+FILE_CACHE_PATH = join(_base_path, 'cache/{grouped_ds_id}.json')
+DISCOVERY_INDEX_PATH = join(_base_path, 'cache/directory-index.json')
+STATE_MANIFEST_PATH = join(_base_path, 'state/{project}-{backend}.jsonl')
+METRICS_PATH = join(_base_path, 'metrics/{project}.jsonl')
+LEASE_PATH = join(_base_path, 'leases/{run}/{grouped_ds_id}')
+
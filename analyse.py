@@ -1,15 +1,17 @@
 import argparse
-import collections
-import json
+
+import pandas as pd
 
 import SETTINGS
 from lib import options, utils
+from lib.register import backends, get_register
 
 
 
 def _get_arg_parser():
     parser = argparse.ArgumentParser()
     project_options = options.known_projects
+    register_backends = backends
 
     parser.add_argument(
         "project",
@@ -25,8 +27,31 @@ def _get_arg_parser():
         nargs=1,
         type=str,
         default=None,
-        required=True,
-        help='List of comma-separated dataset identifiers'
+        required=False,
+        help='List of comma-separated dataset identifiers, OR @<file> to read them from a file '
+             '(one or more per line), OR - to read them from standard input'
+    )
+
+    parser.add_argument(
+        "-f",
+        "--facets",
+        nargs=1,
+        type=str,
+        default=None,
+        required=False,
+        help='Select registered datasets by facet pattern, formatted as: x=hello,y=2*,z=bye'
+    )
+
+    parser.add_argument(
+        "-r",
+        "--register",
+        nargs=1,
+        type=str,
+        default=[SETTINGS.REGISTER_BACKEND],
+        required=False,
+        choices=register_backends,
+        help=f'Register backend to read from, must be one of: {register_backends}. '
+             f'Defaults to {SETTINGS.REGISTER_BACKEND}.'
     )
 
     return parser
@@ -36,10 +61,15 @@ def parse_args():
     parser = _get_arg_parser()
     args = parser.parse_args()
 
+    if not (args.dataset_ids or args.facets):
+        parser.error('one of the arguments -d/--dataset-ids -f/--facets is required')
+
     project = args.project[0]
-    ds_ids = args.dataset_ids[0].split(',')
+    ds_ids = utils.iter_arg_items(args.dataset_ids[0]) if args.dataset_ids else None
+    facets = dict([_.split('=') for _ in args.facets[0].split(',')]) if args.facets else None
+    backend = args.register[0]
 
-    return project, ds_ids
+    return project, ds_ids, facets, backend
 
 
 def _lookup(item, *keys):
@@ -54,58 +84,94 @@ def _lookup(item, *keys):
     return item
         
 
-def analyse_characteristic(records, *keys):
-    
-    results = {}
-    count = 0
+# Characteristics compared across datasets, as key paths into each record
+CHARACTERISTICS = [
+    ('data', 'rank'),
+    ('coordinates', 'time', 'calendar'),
+]
 
-    for ds_id, rec in records.items():
-        
-        result = _lookup(rec, *keys)
-        results.setdefault(result, [])
-        results[result].append(ds_id)
-        count += 1
 
-    print(f'\n[INFO] Testing: {keys} - found {len(results)} varieties')
-    for key in sorted(results):
+def _freeze(value):
+    # Lists (e.g. shapes) must be hashable to be grouped
+    return tuple(_freeze(_) for _ in value) if isinstance(value, list) else value
 
-        ds_ids = results[key]
-        print(f'\t{keys} == {key}:   {len(ds_ids)}')
-        count_ratio = float(len(ds_ids)) / count
 
-        if count_ratio < SETTINGS.CONCERN_THRESHOLD:
-            print(f'\t[WARN] SUGGEST FIX OF {keys} ON:\n\t\t' + '\n\t\t'.join(ds_ids))
-    
+def analyse_characteristics(table, characteristics=CHARACTERISTICS):
+    """
+    Groups and counts the values of every characteristic in `table` in one pass and
+    reports the datasets holding values shared by fewer than SETTINGS.CONCERN_THRESHOLD
+    of all datasets.
 
-def analyse_datasets(project, ds_ids):
-    "Compares a set of dataset identifiers"
-    records = load_records(ds_ids)
+    :param table: pandas DataFrame as returned by `load_records`.
+    :param characteristics: sequence of key paths, matching the columns of `table`.
+    """
+    count = len(table)
 
-    analyse_characteristic(records, 'data', 'rank')
-    analyse_characteristic(records, 'coordinates', 'time', 'calendar')
+    if count == 0:
+        print('[WARN] No datasets to analyse')
+        return
 
+    columns = dict(zip(table.columns, characteristics))
 
-def load_records(ds_ids):
+    values = table.melt(var_name='characteristic', value_name='value', ignore_index=False)
+    counts = values.groupby(['characteristic', 'value'], dropna=False, sort=False).size()
 
-    records = collections.OrderedDict()
+    for column, keys in columns.items():
+        results = counts.loc[column]
 
-    for ds_id in ds_ids:
+        print(f'\n[INFO] Testing: {keys} - found {len(results)} varieties')
+        for key in sorted(results.index):
 
-        grouped_ds_id = utils.get_grouped_ds_id(ds_id)
+            n_ds_ids = results[key]
+            print(f'\t{keys} == {key}:   {n_ds_ids}')
+            count_ratio = float(n_ds_ids) / count
 
-        json_path = SETTINGS.JSON_OUTPUT_PATH.format(**vars())
+            if count_ratio < SETTINGS.CONCERN_THRESHOLD:
+                ds_ids = table.index[table[column] == key]
+                print(f'\t[WARN] SUGGEST FIX OF {keys} ON:\n\t\t' + '\n\t\t'.join(ds_ids))
 
-        with open(json_path) as reader:
-            records[ds_id] = json.load(reader)
-        
 
-    return records
+def analyse_datasets(project, ds_ids=None, facets=None, backend=None):
+    "Compares a set of dataset identifiers, or the registered datasets matching `facets`"
+    register = get_register(project, backend)
+
+    if ds_ids is None:
+        ds_ids = register.select(facets or {})
+
+    table = load_records(ds_ids, register)
+    analyse_characteristics(table)
+
+
+def load_records(ds_ids, register, characteristics=CHARACTERISTICS):
+    """
+    Loads the register records of `ds_ids` into a table with one row per dataset
+    and one column per characteristic. Only the characteristics are kept, so the
+    full records never need to be held in memory together.
+
+    :param ds_ids: sequence of dataset identifiers (DSIDs).
+    :param register: register to read records from.
+    :param characteristics: sequence of key paths to extract from each record.
+    :return: pandas DataFrame indexed by DSID.
+    """
+    index = []
+    rows = []
+
+    for ds_id, record in register.get_many(ds_ids):
+
+        if record is None:
+            raise Exception(f'Dataset not found in register {register}: {ds_id}')
+
+        index.append(ds_id)
+        rows.append([_freeze(_lookup(record, *keys)) for keys in characteristics])
+
+    columns = ['.'.join(keys) for keys in characteristics]
+    return pd.DataFrame(rows, index=pd.Index(index, name='ds_id'), columns=columns, dtype=object)
     
 
 def main():
     
-    project, ds_ids = parse_args()
-    analyse_datasets(project, ds_ids)
+    project, ds_ids, facets, backend = parse_args()
+    analyse_datasets(project, ds_ids, facets, backend)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""
+Takes the same dataset selection arguments as scan.py, packs the selected datasets
+into batch jobs by estimated cost and submits each job to run scan.py.
+"""
+
+import scan
+import SETTINGS
+from lib import batch
+
+
+def _get_arg_parser():
+    """
+    Extends the scan.py argument parser with batch submission arguments.
+
+    :return: argparse.ArgumentParser
+    """
+    parser = scan._get_arg_parser()
+    executor_options = ['local'] + list(SETTINGS.BATCH_TEMPLATES)
+
+    parser.add_argument(
+        "-x",
+        "--executor",
+        nargs=1,
+        type=str,
+        default=["lsf"],
+        required=False,
+        choices=executor_options,
+        help=f'How to submit jobs, must be one of: {executor_options}. Defaults to lsf.'
+    )
+
+    parser.add_argument(
+        "-q",
+        "--queue",
+        nargs=1,
+        type=str,
+        default=[SETTINGS.QUEUE],
+        required=False,
+        help=f'Batch queue to submit to. Defaults to {SETTINGS.QUEUE}.'
+    )
+
+    parser.add_argument(
+        "-W",
+        "--wallclock",
+        nargs=1,
+        type=str,
+        default=[SETTINGS.WALLCLOCK],
+        required=False,
+        help=f'Wallclock limit per job as HH:MM. Defaults to {SETTINGS.WALLCLOCK}.'
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help='Print the packed jobs without submitting them.'
+    )
+
+    return parser
+
+
+def main():
+    """
+    Runs script if called on command line
+    """
+    args = _get_arg_parser().parse_args()
+
+    project = args.project[0]
+    backend = args.register[0]
+
+    ds_paths = scan.select_dataset_paths(project, ds_ids=scan._to_items(args.dataset_ids),
+                                         paths=scan._to_items(args.paths), facets=scan._to_dict(args.facets),
+                                         exclude=scan._to_list(args.exclude), backend=backend,
+                                         from_register=args.from_register, only_failed=args.only_failed)
+
+    batch.submit_datasets(project, args.mode[0], args.location[0], ds_paths,
+                          batch.get_executor(args.executor[0]), queue=args.queue[0],
+                          wallclock=args.wallclock[0], backend=backend, workers=args.workers[0],
+                          coordinate=args.coordinate[0] if args.coordinate else None, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Generates synthetic CMIP5-like datasets to benchmark extraction against.
+
+A dataset is a directory of monthly NetCDF files of one variable, named as in the
+archive (e.g. "tas_Amon_BENCH_historical_r1i1p1_185001-185912.nc"), with values
+drawn from a seeded random generator so that every run reads the same data.
+"""
+
+import os
+
+import cftime
+import numpy as np
+from netCDF4 import Dataset
+
+
+# Facets of the synthetic datasets, as a CMIP5 DSID without the variable
+DS_ID_PREFIX = 'cmip5.output1.BENCH.BENCH-ESM.historical.mon.atmos.Amon.r1i1p1.latest'
+START_YEAR = 1850
+
+
+def get_ds_id(var_id='tas'):
+    return f'{DS_ID_PREFIX}.{var_id}'
+
+
+def _write_file(path, var_id, first_month, n_times, nlat, nlon, dtype, chunks, calendar, rng):
+    units = f'days since {START_YEAR}-01-01 00:00:00'
+    dates = [cftime.datetime(START_YEAR + month // 12, month % 12 + 1, 15, calendar=calendar)
+             for month in range(first_month, first_month + n_times)]
+
+    with Dataset(path, 'w', format='NETCDF4') as nc:
+        nc.project_id = 'CMIP5'
+        nc.frequency = 'mon'
+        nc.institute_id = 'BENCH'
+        nc.model_id = 'BENCH-ESM'
+
+        nc.createDimension('time', None)
+        times = nc.createVariable('time', 'f8', ('time',))
+        times.units = units
+        times.calendar = calendar
+        times.standard_name = 'time'
+        times.axis = 'T'
+        times[:] = cftime.date2num(dates, units, calendar)
+
+        nc.createDimension('lat', nlat)
+        lat = nc.createVariable('lat', 'f8', ('lat',))
+        lat.standard_name = 'latitude'
+        lat.units = 'degrees_north'
+        lat[:] = np.linspace(-90, 90, nlat)
+
+        nc.createDimension('lon', nlon)
+        lon = nc.createVariable('lon', 'f8', ('lon',))
+        lon.standard_name = 'longitude'
+        lon.units = 'degrees_east'
+        lon[:] = np.arange(nlon) * (360. / nlon)
+
+        var = nc.createVariable(var_id, dtype, ('time', 'lat', 'lon'), fill_value=1.e20,
+                                chunksizes=chunks)
+        var.units = 'K'
+        var.standard_name = 'air_temperature'
+
+        # Written a year at a time to bound memory
+        for start in range(0, n_times, 12):
+            stop = min(start + 12, n_times)
+            var[start:stop] = rng.normal(280., 10., size=(stop - start, nlat, nlon)).astype(dtype)
+
+
+def write_dataset(ds_dir, var_id='tas', n_files=1, n_times=12, nlat=145, nlon=192, dtype='f4',
+                  chunks=None, calendar='360_day', seed=0):
+    """
+    Writes a synthetic dataset of `n_files` consecutive files to `ds_dir`.
+
+    :param ds_dir: (string) directory to write the files to, created if needed.
+    :param var_id: (string) variable identifier.
+    :param n_files: number of files.
+    :param n_times: number of monthly time steps in each file.
+    :param nlat: number of latitudes.
+    :param nlon: number of longitudes.
+    :param dtype: numpy data type of the variable, e.g. 'f4' or 'f8'.
+    :param chunks: list of chunk sizes of the variable along (time, lat, lon), OR None
+                   for the netCDF library's default chunking (time is unlimited, so
+                   the variable is always chunked).
+    :param calendar: CF calendar of the time coordinate, e.g. '360_day' or 'noleap'.
+    :param seed: seed of the random values.
+    :return: sorted list of the paths of the files written.
+    """
+    os.makedirs(ds_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+
+    for i in range(n_files):
+        first_month = i * n_times
+        last_month = first_month + n_times - 1
+        time_range = (f'{START_YEAR + first_month // 12}{first_month % 12 + 1:02d}-'
+                      f'{START_YEAR + last_month // 12}{last_month % 12 + 1:02d}')
+
+        path = os.path.join(ds_dir, f'{var_id}_Amon_BENCH-ESM_historical_r1i1p1_{time_range}.nc')
+        _write_file(path, var_id, first_month, n_times, nlat, nlon, dtype, chunks, calendar, rng)
+        paths.append(path)
+
+    return paths
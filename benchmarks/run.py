@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks extraction and scanning on synthetic datasets.
+
+Run from the top of the repository:
+
+    python -m benchmarks.run [-c <cases>] [-t <targets>] [-n <repeat>] [--save]
+
+Each case (see CASES) is a synthetic dataset, generated once under the data directory
+and regenerated if its parameters change. Each target (see TARGETS) is run on each
+case in a fresh process, recording the fastest of the repeated runs and the peak
+resident memory used above that of the process before the run started, or the peak
+of any child process it started if larger.
+
+Results are compared with the baselines stored in baselines.json, and any that are
+slower or use more memory than the baseline by more than the tolerance are reported
+as regressions. Baselines depend on the machine, so save them on the machine the
+benchmarks are compared on. The stored baselines were recorded on a Linux machine with
+one CPU (an Intel Xeon), so with SETTINGS.FILE_WORKERS of 1.
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.generate import get_ds_id, write_dataset
+
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'character-benchmarks')
+
+# Parameters of each synthetic dataset, see `benchmarks.generate.write_dataset`
+CASES = {
+    'many-files': {'n_files': 60, 'n_times': 12, 'nlat': 73, 'nlon': 96, 'dtype': 'f4',
+                   'chunks': None, 'calendar': '360_day'},
+    'cmip-grid': {'n_files': 4, 'n_times': 240, 'nlat': 145, 'nlon': 192, 'dtype': 'f4',
+                  'chunks': [1, 145, 192], 'calendar': '365_day'},
+    'fine-grid-f8': {'n_files': 2, 'n_times': 48, 'nlat': 360, 'nlon': 720, 'dtype': 'f8',
+                     'chunks': [12, 360, 720], 'calendar': 'standard'},
+    'long-noleap': {'n_files': 10, 'n_times': 120, 'nlat': 73, 'nlon': 96, 'dtype': 'f4',
+                    'chunks': [30, 73, 96], 'calendar': 'noleap'},
+}
+
+# What is run on each case: ('extract', <engine>, <mode>) runs `extract_character`
+# on the files, ('scan', None, <mode>) runs `scan.scan_dataset` on the dataset
+TARGETS = {
+    'extract-header-quick': ('extract', 'header', 'quick'),
+    'extract-header-estimate': ('extract', 'header', 'estimate'),
+    'extract-header-full': ('extract', 'header', 'full'),
+    'extract-xarray-quick': ('extract', 'xarray', 'quick'),
+    'extract-xarray-full': ('extract', 'xarray', 'full'),
+    'scan-quick': ('scan', None, 'quick'),
+    'scan-full': ('scan', None, 'full'),
+}
+
+# Differences below these are never regressions, however small the baseline
+MIN_SECONDS = 0.05
+MIN_PEAK_MB = 5.
+
+
+def _get_arg_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks extraction on synthetic datasets.')
+
+    parser.add_argument(
+        "-c",
+        "--cases",
+        nargs=1,
+        type=str,
+        default=[','.join(CASES)],
+        required=False,
+        help=f'Comma-separated cases to run, from: {list(CASES)}. Defaults to all.'
+    )
+
+    parser.add_argument(
+        "-t",
+        "--targets",
+        nargs=1,
+        type=str,
+        default=[','.join(TARGETS)],
+        required=False,
+        help=f'Comma-separated targets to run, from: {list(TARGETS)}. Defaults to all.'
+    )
+
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        nargs=1,
+        type=int,
+        default=[3],
+        required=False,
+        help='Number of times each target is run on each case, keeping the fastest. Defaults to 3.'
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        nargs=1,
+        type=float,
+        default=[0.25],
+        required=False,
+        help='Fraction by which a result may exceed its baseline before it is a regression. '
+             'Defaults to 0.25.'
+    )
+
+    parser.add_argument(
+        "--data-dir",
+        nargs=1,
+        type=str,
+        default=[DATA_DIR],
+        required=False,
+        help=f'Directory the synthetic datasets are generated in. Defaults to {DATA_DIR}.'
+    )
+
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help='Save the results as the new baselines.'
+    )
+
+    return parser
+
+
+def prepare_case(data_dir, name, params):
+    """
+    Generates the dataset of case `name` under `data_dir`, unless it already exists
+    with the same parameters.
+
+    :return: (string) base directory of the CMIP5 archive holding the dataset.
+    """
+    base_dir = os.path.join(os.path.abspath(data_dir), name, 'badc/cmip5/data')
+    ds_dir = os.path.join(base_dir, *get_ds_id().split('.'))
+    params_path = os.path.join(data_dir, name, 'params.json')
+
+    if os.path.exists(params_path):
+        with open(params_path) as reader:
+            if json.load(reader) == params:
+                return base_dir
+
+        shutil.rmtree(ds_dir)
+
+    print(f'[INFO] Generating dataset for case: {name}')
+    write_dataset(ds_dir, **params)
+
+    with open(params_path, 'w') as writer:
+        json.dump(params, writer)
+
+    return base_dir
+
+
+def _read_status_mb(field):
+    with open('/proc/self/status') as reader:
+        for line in reader:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1]) / 1024.
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak resident memory of the process to its current resident memory, so
+    that memory used while importing is not counted. Returns the current resident
+    memory in MB, OR None if the peak cannot be reset (e.g. not on Linux).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as writer:
+            writer.write('5')
+
+        return _read_status_mb('VmRSS')
+    except OSError:
+        return None
+
+
+def _get_peak_rss_mb():
+    try:
+        return _read_status_mb('VmHWM')
+    except OSError:
+        import resource
+
+        # ru_maxrss is in kilobytes on Linux and cannot be reset
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _get_children_peak_rss_mb():
+    """
+    Returns the largest peak resident memory in MB of any child process of this process
+    that has finished (e.g. the workers of a pool), OR 0 if it is not known.
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0.
+
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.
+
+
+def _run_target(base_dir, target, output_dir):
+    """
+    Runs `target` on the dataset under `base_dir`, writing any outputs to `output_dir`.
+    Meant to run in a fresh process, as it redirects the project and output paths.
+
+    :return: dictionary of {'seconds': <float>, 'peak_mb': <float>}
+    """
+    import SETTINGS
+    import scan
+    from lib import options, utils
+    from lib.character import extract_character
+
+    kind, engine, mode = TARGETS[target]
+
+    options.project_base_dirs['cmip5'] = base_dir
+    ds_id = get_ds_id()
+    ds_path = utils.switch_ds('cmip5', ds_id)
+    files = sorted(glob.glob(f'{ds_path}/*.nc'))
+
+    base_path = SETTINGS._base_path
+    for name, value in vars(SETTINGS).copy().items():
+        if isinstance(value, str) and value.startswith(base_path):
+            setattr(SETTINGS, name, value.replace(base_path, output_dir, 1))
+
+    start_rss = _reset_peak_rss()
+    if start_rss is None:
+        start_rss = _get_peak_rss_mb()
+
+    start = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if kind == 'extract':
+            extract_character(files, 'ceda', var_id='tas', mode=mode, engine=engine)
+        elif not scan.scan_dataset('cmip5', ds_id, ds_path, mode, 'ceda'):
+            raise RuntimeError(f'Scan failed: {ds_id}')
+
+    seconds = time.perf_counter() - start
+
+    # Child processes do not share the memory of this one, so their peak is counted whole
+    return {
+        'seconds': seconds,
+        'peak_mb': max(0., _get_peak_rss_mb() - start_rss, _get_children_peak_rss_mb())
+    }
+
+
+def run_target(base_dir, target, repeat=3):
+    """
+    Runs `target` on the dataset under `base_dir` `repeat` times, each in a fresh process.
+
+    :return: dictionary of {'seconds': <fastest>, 'peak_mb': <smallest>}
+    """
+    runs = []
+    context = multiprocessing.get_context('spawn')
+
+    for _ in range(repeat):
+        output_dir = tempfile.mkdtemp(prefix='character-benchmark-')
+
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(_run_target, base_dir, target, output_dir).result())
+        finally:
+            shutil.rmtree(output_dir)
+
+    return {
+        'seconds': round(min(run['seconds'] for run in runs), 4),
+        'peak_mb': round(min(run['peak_mb'] for run in runs), 1)
+    }
+
+
+def run_benchmarks(cases, targets, repeat=3, data_dir=DATA_DIR):
+    """
+    Runs each of `targets` on each of `cases`.
+
+    :param cases: dictionary of {<case name>: <parameters of `write_dataset`>}
+    :param targets: list of names of targets from TARGETS.
+    :return: dictionary of {"<case>/<target>": {'seconds': <float>, 'peak_mb': <float>}}
+    """
+    results = {}
+
+    for name, params in cases.items():
+        base_dir = prepare_case(data_dir, name, params)
+
+        for target in targets:
+            result = run_target(base_dir, target, repeat=repeat)
+            results[f'{name}/{target}'] = result
+            print(f'[INFO] {name}/{target}: {result["seconds"]:.3f}s, peak {result["peak_mb"]:.1f}MB')
+
+    return results
+
+
+def find_regressions(results, baselines, tolerance=0.25):
+    """
+    Compares `results` with `baselines` (both as returned by `run_benchmarks`).
+
+    :return: list of (<name>, <'seconds' or 'peak_mb'>, <baseline>, <result>) for every
+             result exceeding its baseline by more than `tolerance` (a fraction).
+    """
+    regressions = []
+
+    for name, result in results.items():
+        baseline = baselines.get(name)
+
+        if baseline is None:
+            continue
+
+        for key, minimum in (('seconds', MIN_SECONDS), ('peak_mb', MIN_PEAK_MB)):
+            if result[key] > baseline[key] * (1 + tolerance) + minimum:
+                regressions.append((name, key, baseline[key], result[key]))
+
+    return regressions
+
+
+def load_baselines(baselines_path=BASELINES_PATH):
+    if not os.path.exists(baselines_path):
+        return {}
+
+    with open(baselines_path) as reader:
+        return json.load(reader)
+
+
+def save_baselines(results, baselines_path=BASELINES_PATH):
+    """
+    Updates the baselines stored at `baselines_path` with `results`.
+    """
+    baselines = load_baselines(baselines_path)
+    baselines.update(results)
+
+    with open(baselines_path, 'w') as writer:
+        json.dump(dict(sorted(baselines.items())), writer, indent=4)
+        writer.write('\n')
+
+
+def main():
+    args = _get_arg_parser().parse_args()
+    case_names = args.cases[0].split(',')
+    targets = args.targets[0].split(',')
+
+    for name in case_names:
+        if name not in CASES:
+            raise ValueError(f'Unknown case: {name}, must be one of: {list(CASES)}')
+
+    for target in targets:
+        if target not in TARGETS:
+            raise ValueError(f'Unknown target: {target}, must be one of: {list(TARGETS)}')
+
+    results = run_benchmarks({name: CASES[name] for name in case_names}, targets,
+                             repeat=args.repeat[0], data_dir=args.data_dir[0])
+
+    if args.save:
+        save_baselines(results)
+        print(f'[INFO] Saved baselines to: {BASELINES_PATH}')
+        return
+
+    regressions = find_regressions(results, load_baselines(), tolerance=args.tolerance[0])
+
+    for name, key, baseline, result in regressions:
+        print(f'[WARN] Regression in {name}: {key} was {baseline}, now {result}')
+
+    print(f'[INFO] {len(results)} benchmarks run, {len(regressions)} regressions')
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Rewrites the scan-state manifest of a project with only the latest entry for each
+dataset (see `lib.state.StateManifest.compact`). Safe to run while scans are running.
+"""
+
+import argparse
+
+import SETTINGS
+from lib import options
+from lib.register import backends
+from lib.state import get_state
+
+
+def _get_arg_parser():
+    parser = argparse.ArgumentParser()
+    project_options = options.known_projects
+    register_backends = backends
+
+    parser.add_argument(
+        "project",
+        nargs=1,
+        type=str,
+        choices=project_options,
+        help=f'Project ID, must be one of: {project_options}'
+    )
+
+    parser.add_argument(
+        "-r",
+        "--register",
+        nargs=1,
+        type=str,
+        default=[SETTINGS.REGISTER_BACKEND],
+        required=False,
+        choices=register_backends,
+        help=f'Register backend whose manifest to compact, must be one of: {register_backends}. '
+             f'Defaults to {SETTINGS.REGISTER_BACKEND}.'
+    )
+
+    return parser
+
+
+def main():
+    args = _get_arg_parser().parse_args()
+    manifest = get_state(args.project[0], args.register[0])
+
+    manifest.compact()
+    print(f'[INFO] Compacted state manifest: {manifest}')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,210 @@
+"""
+Packs datasets into batch jobs by estimated cost and submits them.
+
+The cost of scanning a dataset is estimated from the number and total size of its
+NetCDF files (using `stat` only) with the cost model in SETTINGS.BATCH_COST_MODEL.
+Datasets are packed largest first into as few jobs as fit the wallclock limit, and
+each job is handed to an executor:
+
+ - TemplateExecutor: formats a scheduler command line (e.g. LSF or SLURM) from a template.
+ - LocalExecutor: runs each job as a local subprocess (for testing).
+"""
+
+import os
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import SETTINGS
+
+
+def wallclock_to_seconds(wallclock):
+    """
+    Converts a wallclock limit formatted as "HH:MM" into seconds.
+    """
+    hours, minutes = wallclock.split(':')
+    return (int(hours) * 60 + int(minutes)) * 60
+
+
+def estimate_cost(ds_path, mode):
+    """
+    Estimates the cost of scanning the dataset at `ds_path` without opening any files.
+
+    :param ds_path: directory containing the dataset's NetCDF files.
+    :param mode: Scanning mode: one of quick, estimate or full.
+    :return: dictionary of {'files': <file count>, 'bytes': <total bytes>, 'seconds': <estimated seconds>}
+    """
+    n_files = n_bytes = 0
+
+    try:
+        with os.scandir(ds_path) as entries:
+            for entry in entries:
+                if entry.name.endswith('.nc') and entry.is_file():
+                    n_files += 1
+                    n_bytes += entry.stat().st_size
+    except FileNotFoundError:
+        pass
+
+    model = SETTINGS.BATCH_COST_MODEL[mode]
+    seconds = model['dataset'] + n_files * model['file'] + n_bytes / 1024 ** 3 * model['gb']
+
+    return {'files': n_files, 'bytes': n_bytes, 'seconds': seconds}
+
+
+def pack_jobs(costs, capacity):
+    """
+    Packs datasets into jobs using first-fit decreasing: datasets are taken largest first
+    and each is put in the first job with enough capacity left, or a new job.
+    A dataset larger than `capacity` gets a job of its own.
+
+    :param costs: dictionary of {<ds_id>: <estimated seconds>}
+    :param capacity: (float) seconds available per job.
+    :return: list of jobs as dictionaries of {'ds_ids': <list of DSIDs>, 'seconds': <total seconds>}
+    """
+    jobs = []
+
+    for ds_id, seconds in sorted(costs.items(), key=lambda item: (-item[1], item[0])):
+
+        if seconds > capacity:
+            print(f'[WARN] Estimated cost of {ds_id} ({seconds:.0f}s) exceeds the job wallclock')
+
+        for job in jobs:
+            if job['seconds'] + seconds <= capacity:
+                break
+        else:
+            job = {'ds_ids': [], 'seconds': 0.}
+            jobs.append(job)
+
+        job['ds_ids'].append(ds_id)
+        job['seconds'] += seconds
+
+    return jobs
+
+
+class LocalExecutor(object):
+    """
+    Runs each job immediately as a local subprocess, writing its stdout and stderr
+    to the job's log files.
+    """
+
+    def submit(self, job):
+        with open(job['stdout'], 'w') as stdout, open(job['stderr'], 'w') as stderr:
+            result = subprocess.run(job['command'], stdout=stdout, stderr=stderr)
+
+        return result.returncode
+
+
+class TemplateExecutor(object):
+
+    def __init__(self, template):
+        """
+        Submits jobs by running a scheduler command built from `template`. The template
+        is formatted with shell-quoted job fields: name, queue, wallclock, stdout, stderr,
+        command (the scan command as separate arguments) and quoted_command (the scan
+        command as a single argument).
+
+        :param template: (string) scheduler command template, e.g. from SETTINGS.BATCH_TEMPLATES.
+        """
+        self.template = template
+
+    def get_command(self, job):
+        fields = {key: shlex.quote(str(job[key])) for key in ('name', 'queue', 'wallclock', 'stdout', 'stderr')}
+
+        # shlex.join is only available from Python 3.8
+        fields['command'] = ' '.join(shlex.quote(arg) for arg in job['command'])
+        fields['quoted_command'] = shlex.quote(fields['command'])
+
+        return shlex.split(self.template.format(**fields))
+
+    def submit(self, job):
+        return subprocess.run(self.get_command(job), check=True).returncode
+
+
+def get_executor(name):
+    """
+    Returns an executor: 'local' or the name of a template in SETTINGS.BATCH_TEMPLATES.
+    """
+    if name == 'local':
+        return LocalExecutor()
+
+    return TemplateExecutor(SETTINGS.BATCH_TEMPLATES[name])
+
+
+def _get_scan_command(project, mode, location, ds_ids_path, backend=None, workers=1, coordinate=None):
+    # The DSIDs are read from a file, as a job may hold too many for a command line
+    command = [sys.executable, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scan.py')),
+               '-l', location, '-m', mode, '-d', f'@{ds_ids_path}', '-w', str(workers)]
+
+    if backend:
+        command += ['-r', backend]
+
+    if coordinate:
+        command += ['--coordinate', coordinate]
+
+    return command + [project]
+
+
+def submit_datasets(project, mode, location, ds_paths, executor, queue=None, wallclock=None,
+                    backend=None, workers=1, coordinate=None, dry_run=False):
+    """
+    Estimates the cost of each dataset, packs the datasets into jobs that fit the
+    wallclock limit and submits each job with `executor`.
+
+    :param project: top-level project.
+    :param mode: Scanning mode: one of quick, estimate or full.
+    :param location: location of scan.
+    :param ds_paths: dictionary of {<ds_id>: <ds_path>}
+    :param executor: executor with a `submit(job)` method, see `get_executor`.
+    :param queue: batch queue, defaults to SETTINGS.QUEUE.
+    :param wallclock: wallclock limit per job as "HH:MM", defaults to SETTINGS.WALLCLOCK.
+    :param backend: register backend passed on to scan.py, OR None.
+    :param workers: number of worker processes passed on to scan.py. The estimated cost of
+                    a job is divided by this number when packing.
+    :param coordinate: (string) run name passed on to scan.py, so that the jobs share their
+                       datasets through lease files with any other scan of the same run, OR None.
+    :param dry_run: if True, print the jobs without submitting them.
+    :return: list of job dictionaries.
+    """
+    queue = queue or SETTINGS.QUEUE
+    wallclock = wallclock or SETTINGS.WALLCLOCK
+    capacity = wallclock_to_seconds(wallclock) * SETTINGS.BATCH_WALLCLOCK_FILL * workers
+
+    with ThreadPoolExecutor(max_workers=SETTINGS.DISCOVERY_THREADS) as pool:
+        estimates = pool.map(lambda ds_path: estimate_cost(ds_path, mode), ds_paths.values())
+        costs = dict(zip(ds_paths.keys(), [_['seconds'] for _ in estimates]))
+
+    jobs = pack_jobs(costs, capacity)
+    timestamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+
+    print(f'[INFO] Packed {len(costs)} datasets into {len(jobs)} jobs')
+
+    for i, job in enumerate(jobs):
+        job_name = f'{project}-{mode}-{timestamp}-{i:04d}'
+        job_dir = SETTINGS.BATCH_JOB_PATH.format(job_name=job_name)
+
+        if not os.path.isdir(job_dir):
+            os.makedirs(job_dir)
+
+        ds_ids_path = os.path.abspath(os.path.join(job_dir, 'ds_ids.txt'))
+
+        with open(ds_ids_path, 'w') as writer:
+            writer.write('\n'.join(job['ds_ids']) + '\n')
+
+        job.update({
+            'name': job_name,
+            'queue': queue,
+            'wallclock': wallclock,
+            'stdout': os.path.join(job_dir, 'stdout.log'),
+            'stderr': os.path.join(job_dir, 'stderr.log'),
+            'command': _get_scan_command(project, mode, location, ds_ids_path, backend, workers, coordinate)
+        })
+
+        print(f'[INFO] Job {job_name}: {len(job["ds_ids"])} datasets, '
+              f'estimated {job["seconds"] / workers:.0f}s')
+
+        if not dry_run:
+            executor.submit(job)
+
+    return jobs
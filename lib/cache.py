@@ -0,0 +1,96 @@
+import json
+import os
+
+import numpy as np
+
+from lib import options
+from lib.writer import write_atomic
+
+
+# Version of the content of file facts: entries of other versions are re-read
+FACTS_VERSION = 4
+
+
+def _to_json_default(value):
+    # Attributes may hold numpy arrays or scalars that json cannot serialise
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class FileFactsCache(object):
+
+    def __init__(self, cache_path):
+        """
+        Persistent cache of the facts extracted from each file of one dataset, stored
+        as a JSON file at `cache_path`. An entry is keyed by file path and is only
+        reused while the file's size and modification time are unchanged, and only
+        for the same variable and a mode no more complete than the one it was read in.
+
+        :param cache_path: (string) path of the JSON cache file.
+        """
+        self._cache_path = cache_path
+        self._entries = self._load()
+        self._signatures = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        if not os.path.exists(self._cache_path):
+            return {}
+
+        try:
+            with open(self._cache_path) as reader:
+                return json.load(reader)
+        except (OSError, ValueError) as exc:
+            print(f'[WARN] Ignoring unreadable file cache: {self._cache_path}: {exc}')
+            return {}
+
+    @staticmethod
+    def _get_signature(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def get(self, path, var_id, mode):
+        """
+        Returns the cached facts for `path`, or None if there is no valid entry.
+        """
+        signature = self._signatures[path] = self._get_signature(path)
+        entry = self._entries.get(path)
+
+        if (entry and entry.get('version') == FACTS_VERSION
+                and entry['signature'] == signature and entry['var_id'] == var_id
+                and options.modes.index(entry['mode']) >= options.modes.index(mode)):
+            self.hits += 1
+            return entry['facts']
+
+        self.misses += 1
+        return None
+
+    def put(self, path, var_id, mode, facts):
+        """
+        Stores the facts for `path`, using the file signature taken when `get`
+        was called so that a file modified while it was read is re-read next time.
+        """
+        signature = self._signatures.get(path) or self._get_signature(path)
+
+        self._entries[path] = {
+            'version': FACTS_VERSION,
+            'signature': signature,
+            'var_id': var_id,
+            'mode': mode,
+            'facts': facts
+        }
+
+    def save(self):
+        """
+        Writes the cache, dropping entries for files that were not looked up this
+        time (e.g. files that have been retracted from the dataset).
+        """
+        entries = {path: entry for path, entry in self._entries.items() if path in self._signatures}
+
+        write_atomic(self._cache_path, json.dumps(entries, default=_to_json_default))
+        print(f'[INFO] File cache: {self.hits} hits, {self.misses} misses')
@@ -1,7 +1,20 @@
+import contextlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cftime
 import xarray as xr
 import numpy as np
 from datetime import datetime
 
+import SETTINGS
+from lib.chunks import distinct_chunk_info, get_chunk_info, plan_chunks
+from lib.metrics import get_phase
+from lib.stats import (Summary, count_blocks, iter_sample_slabs, iter_slabs, min_max, outside_fraction_bound,
+                       slab_size)
+
 
 # NOTE THESE ARE COMMON WITH clisops - need to merge!!!
 def get_coord_by_attr(dset, attr, value):
@@ -36,6 +49,53 @@ def get_coord_type(coord):
             return ctype
 
 
+# Attributes that xarray moves into `encoding` when decoding times
+TIME_ENCODING_ATTRS = ('units', 'calendar')
+
+
+def is_time_units(units):
+    return isinstance(units, str) and ' since ' in units
+
+
+def decode_time_range(mn, mx, units, calendar):
+    """
+    Decodes the raw numeric min and max of a time axis, in the same way as xarray
+    decodes it with `use_cftime=True`.
+
+    :return: tuple of (min, max, calendar), with min and max formatted as strings.
+    """
+    dates = cftime.num2date([mn, mx], units, calendar, only_use_cftime_datetimes=True)
+    return tuple(_.strftime('%Y-%m-%dT%H:%M:%S') for _ in dates) + (dates[0].calendar,)
+
+
+def _strip_time_encoding(attrs):
+    if is_time_units(attrs.get('units')):
+        return {k: v for k, v in attrs.items() if k not in TIME_ENCODING_ATTRS}
+
+    return attrs
+
+
+def get_min_max(values, index=None):
+    """
+    Returns the min and max of a coordinate and whether it is monotonic. If `index`
+    (the pandas Index built by xarray for a dimension coordinate) is monotonic, which
+    pandas checks once and caches, only the endpoints of `values` are read.
+
+    :param values: numpy array of coordinate values.
+    :param index: pandas Index of the coordinate, OR None.
+    :return: tuple of (min, max, monotonic) where monotonic is one of
+             'increasing', 'decreasing' or 'unordered'.
+    """
+    if index is not None and len(index) > 0:
+        if index.is_monotonic_increasing:
+            return values[0], values[-1], 'increasing'
+
+        if index.is_monotonic_decreasing:
+            return values[-1], values[0], 'decreasing'
+
+    return values.min(), values.max(), 'unordered'
+
+
 def get_coords(da):
     """
     E.g.:  ds.['tasmax'].coords.keys()
@@ -47,6 +107,10 @@ def get_coords(da):
 
     NOTE: the '*' means it is an INDEX - which means it is a full coordinate variable in NC terms
 
+    Time coordinates may be decoded, or raw numbers with `units` and `calendar` attributes
+    (opened with `decode_times=False`), in which case only the min and max are decoded.
+    Monotonic coordinates are recorded as such and only their endpoints are compared.
+
     Returns a dictionary of coordinate info.
     """
     coords = {}
@@ -60,9 +124,13 @@ def get_coords(da):
         name = coord_type or coord.name
         data = coord.values
 
-        mn, mx = data.min(), data.max()
+        mn, mx, monotonic = get_min_max(data, da.indexes.get(coord_id))
+        calendar = None
 
-        if coord_type == 'time':
+        if coord_type == 'time' and is_time_units(coord.attrs.get('units')):
+            mn, mx, calendar = decode_time_range(mn, mx, coord.attrs['units'],
+                                                 coord.attrs.get('calendar', 'standard'))
+        elif coord_type == 'time':
             if type(mn) == np.datetime64:
                 mn, mx = [str(_).split('.')[0] for _ in (mn, mx)]
             else:
@@ -74,16 +142,19 @@ def get_coords(da):
             'id': name,
             'min': mn,
             'max': mx,
-            'length': len(data)
+            'length': len(data),
+            'monotonic': monotonic
         }
 
         if coord_type == 'time':
-            if type(data[0]) == np.datetime64:
+            if calendar:
+                coords[name]['calendar'] = calendar
+            elif type(data[0]) == np.datetime64:
                 coords[name]['calendar'] = 'standard'
             else:
                 coords[name]['calendar'] = data[0].calendar
 
-        coords[name].update(coord.attrs)
+        coords[name].update(_strip_time_encoding(coord.attrs))
 
     return coords
 
@@ -105,7 +176,7 @@ def _copy_dict_for_json(dct):
 
 
 def get_variable_metadata(da):
-    d = _copy_dict_for_json(da.attrs)
+    d = _copy_dict_for_json(_strip_time_encoding(da.attrs))
     d['var_id'] = da.name
 
     # Encode _FillValue as string because representation may be strange
@@ -121,17 +192,120 @@ def get_global_attrs(ds, expected_attrs=None):
     return d
 
 
-def get_data_info(da, mode):
+def get_sample_info(values_read, n_values, blocks_read):
+    """
+    Describes how much of the data an estimate of the min and max was based on.
+
+    :param values_read: (int) number of data values read.
+    :param n_values: (int) total number of data values.
+    :param blocks_read: (int) number of blocks sampled, see `lib.stats.iter_sample_slabs`.
+    :return: dictionary of {'fraction_read', 'blocks_read', 'confidence', 'fraction_outside'},
+             where 'fraction_outside' is the largest fraction of blocks (at the given
+             confidence) that may hold values above the estimated max, and likewise
+             below the estimated min.
+    """
+    confidence = SETTINGS.ESTIMATE_CONFIDENCE
+    complete = values_read >= n_values
+
+    return {
+        'fraction_read': values_read / n_values if n_values else 1.,
+        'blocks_read': blocks_read,
+        'confidence': confidence,
+        'fraction_outside': 0. if complete else outside_fraction_bound(blocks_read, confidence)
+    }
+
+
+def _get_block_length(chunksizes):
+    # Sample whole on-disk chunks along the leading dimension, or single indices if not chunked
+    return chunksizes[0] if chunksizes else 1
+
+
+def get_file_result(path, stats):
+    """
+    Returns the results of a full scan of one file, as kept in the `files` list of the
+    data section of a character so that an extreme value can be traced to its file.
+
+    :param path: (string) path of the file.
+    :param stats: dictionary of the file's statistics, from `lib.stats.Summary.to_dict`.
+    """
+    return {
+        'file': os.path.basename(path),
+        'min': stats['min'],
+        'max': stats['max'],
+        'count': stats['count'],
+        'nan_count': stats['nan_count']
+    }
+
+
+def _summarise(da, memory_budget):
+    summary = Summary(SETTINGS.SKETCH_RELATIVE_ACCURACY)
+
+    for index in iter_slabs(da.shape, da.dtype.itemsize, memory_budget):
+        summary.add(da[index].values)
+
+    return summary
+
+
+def get_data_info(da, mode, memory_budget=None, file_arrays=None):
+    """
+    Returns a dictionary describing the data array. In full mode the (lazily loaded)
+    array is read one slab at a time, so that no more than `memory_budget` bytes of
+    values are held in memory at once, and summarised in the same pass: see
+    `lib.stats.Summary`. Fill values are masked as NaN by xarray, so are counted in
+    nan_count. In estimate mode the min and max are estimated from a stratified sample
+    of blocks along the leading dimension.
+
+    :param da: Xarray DataArray.
+    :param mode: Scanning mode: one of quick, estimate or full.
+    :param memory_budget: (int) bytes to read at a time, defaults to SETTINGS.MEMORY_BUDGET.
+    :param file_arrays: dictionary of {<path>: <DataArray>} of the part of `da` in each file,
+                        OR None. If given, in full mode each file is summarised separately,
+                        SETTINGS.FILE_WORKERS at a time with an equal share of `memory_budget`,
+                        and the results of each file are listed under 'files'.
+    :return: dictionary of data info.
+    """
+    memory_budget = memory_budget or SETTINGS.MEMORY_BUDGET
+    sample = stats = files = None
+
+    if mode == 'full' and file_arrays:
+        paths = sorted(file_arrays, key=os.path.basename)
+        workers = max(1, min(SETTINGS.FILE_WORKERS, len(paths)))
+        file_budget = memory_budget // workers
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(lambda path: _summarise(file_arrays[path], file_budget), paths))
+
+        summary = Summary(SETTINGS.SKETCH_RELATIVE_ACCURACY)
+
+        for file_summary in summaries:
+            summary.merge(file_summary)
+
+        files = [get_file_result(path, _.to_dict()) for path, _ in zip(paths, summaries)]
+
+    elif mode == 'full':
+        summary = _summarise(da, memory_budget)
+
     if mode == 'full':
-        data = da.values
-        mx = float(data.max())
-        mn = float(data.min())
+        stats = summary.get_info(SETTINGS.QUANTILES)
+        mn, mx = stats.pop('min'), stats.pop('max')
+
+    elif mode == 'estimate':
+        n_blocks = SETTINGS.ESTIMATE_FILES * SETTINGS.ESTIMATE_BLOCKS
+        block_length = _get_block_length(da.encoding.get('chunksizes'))
+        rng = np.random.default_rng(SETTINGS.ESTIMATE_SEED)
+
+        indices = list(iter_sample_slabs(da.shape, da.dtype.itemsize, memory_budget, n_blocks, rng,
+                                         block_length))
+        mn, mx = min_max(da[index].values for index in indices)
+
+        blocks_read = min(n_blocks, count_blocks(da.shape, block_length))
+        sample = get_sample_info(sum(slab_size(_, da.shape) for _ in indices), da.size, blocks_read)
 
     else:
         mx = None
         mn = None
 
-    return {
+    info = {
         'min': mn,
         'max': mx,
         'shape': list(da.shape),
@@ -139,6 +313,17 @@ def get_data_info(da, mode):
         'coord_names': [_ for _ in da.coords.keys()]
     }
 
+    if stats is not None:
+        info.update(stats)
+
+    if files is not None:
+        info['files'] = files
+
+    if sample is not None:
+        info['sample'] = sample
+
+    return info
+
 
 def get_scan_metadata(mode, location):
 
@@ -149,39 +334,250 @@ def get_scan_metadata(mode, location):
     }
 
 
+def rebase_times(ds, reference, lock=None):
+    """
+    Converts the raw values of every variable in `ds` with time units to whole
+    microseconds since the origin of the units of the first file, held in `reference`,
+    so that the values of all files are comparable (and exact). Only the origin and
+    one step of each file's units are decoded, rather than every time value.
+
+    :param ds: Xarray Dataset opened with `decode_times=False`.
+    :param reference: dictionary shared by all files, of {<calendar>: <units>}.
+    :param lock: threading.Lock guarding `reference`, OR None.
+    :return: Xarray Dataset.
+    """
+    for name, var in list(ds.variables.items()):
+        units = var.attrs.get('units')
+
+        if not is_time_units(units):
+            continue
+
+        calendar = var.attrs.get('calendar', 'standard')
+
+        with lock or contextlib.nullcontext():
+            reference_units = reference.setdefault(calendar, f'microseconds since {units.split(" since ", 1)[1]}')
+
+        origin, step = cftime.date2num(cftime.num2date([0, 1], units, calendar), reference_units, calendar)
+        values = np.round(var.values.astype('f8') * (step - origin)).astype('i8') + int(origin)
+
+        rebased = var.copy(data=values)
+        rebased.attrs['units'] = reference_units
+        ds[name] = rebased
+
+    return ds
+
+
+# Time range at the end of CMIP/CORDEX file names, e.g. "tas_Amon_HadGEM2-ES_historical_r1i1p1_185912-188411.nc"
+FILENAME_TIME_RANGE = re.compile(r'_(\d{4,14})-(\d{4,14})(?:-clim)?\.nc$')
+
+
+def order_files_by_name(files):
+    """
+    Orders files by the time range in their names.
+
+    :param files: list of file paths.
+    :return: list of file paths in time order, OR None if any name has no time range,
+             the ranges are not all at the same precision, or any of them overlap.
+    """
+    ranges = []
+
+    for path in files:
+        match = FILENAME_TIME_RANGE.search(os.path.basename(path))
+
+        if not match:
+            return None
+
+        ranges.append((match.group(1), match.group(2), path))
+
+    if len(set(len(start) for start, end, path in ranges) | set(len(end) for start, end, path in ranges)) > 1:
+        return None
+
+    ranges.sort()
+
+    for (start, end, path), (next_start, next_end, next_path) in zip(ranges[:-1], ranges[1:]):
+        if next_start <= end:
+            return None
+
+    return [path for start, end, path in ranges]
+
+
+def _get_time_dim(ds):
+    for name in ds.dims:
+        if name in ds.coords and (ds[name].attrs.get('standard_name') == 'time' or ds[name].attrs.get('axis') == 'T'):
+            return name
+
+
+def combine_datasets(datasets, ordered=False):
+    """
+    Combines the datasets opened from each file of a dataset, as `xr.open_mfdataset` would.
+
+    If `ordered` the datasets are already in time order, so they are concatenated
+    along the time dimension without comparing any other coordinates across files,
+    which are taken from the first. If there is no time dimension, or the combined
+    time axis turns out not to be increasing, they are combined by coordinates instead.
+
+    :param datasets: list of Xarray Datasets.
+    :param ordered: (bool) whether the datasets are known to be in time order.
+    :return: Xarray Dataset.
+    """
+    time_dim = _get_time_dim(datasets[0]) if ordered else None
+
+    if time_dim:
+        ds = xr.combine_nested(datasets, concat_dim=time_dim, data_vars='minimal', coords='minimal',
+                               compat='override', combine_attrs='override')
+
+        if ds.indexes[time_dim].is_monotonic_increasing:
+            return ds
+
+        print('[WARN] Files ordered by name are not in time order, combining by coordinates instead')
+
+    return xr.combine_by_coords(datasets, combine_attrs='override')
+
+
+# The netCDF-C and HDF5 libraries are not thread-safe, and xarray does not hold its
+# own lock around every call it makes while opening a file
+_NETCDF_LOCK = threading.Lock()
+
+
 class CharacterExtractor(object):
 
-    def __init__(self, files, location, var_id, mode, expected_attrs=None):
+    def __init__(self, files, location, var_id, mode, expected_attrs=None, metrics=None):
         """
         Open files as an Xarray MultiFile Dataset and extract character as a dictionary.
         Takes a dataset and extracts characteristics from it.
 
         :param files: List of data files.
         :param var_id: (string) The variable chosen as an argument at the command line.
+        :param metrics: (ScanMetrics) timings of each phase of extraction, OR None.
         """
         self._files = files
         self._var_id = var_id
         self._mode = mode
         self._location = location
         self._expected_attrs = expected_attrs
+        self._phase = get_phase(metrics)
+        self._chunks = {}
+        self._datasets = {}
         self._extract()
 
-    def _extract(self):
-        ds = xr.open_mfdataset(self._files, use_cftime=True, combine='by_coords')
-        print('[WARN] NEED TO CHECK NUMBER OF VARS/DOMAINS RETURNED HERE')
-        print('[WARN] DOES NOT CHECK YET WHETHER WE MIGHT GET 2 DOMAINS/VARIABLES BACK FROM MULTI-FILE OPEN')
-        # Get content by variable
+    def _plan_chunks(self, path, ds):
+        """
+        Plans the dask chunks of the variable in a file opened from `path`, as whole
+        on-disk chunks of at most SETTINGS.CHUNK_MEMORY_BUDGET bytes of decoded values.
+
+        :return: dictionary of {<dimension>: <chunk size>}
+        """
         da = ds[self._var_id]
+        disk_chunks = da.encoding.get('chunksizes')
+        chunks = plan_chunks(da.shape, da.dtype.itemsize, disk_chunks, SETTINGS.CHUNK_MEMORY_BUDGET)
+        self._chunks[path] = get_chunk_info(disk_chunks, chunks)
 
-        self.character = {
-            "scan_metadata": get_scan_metadata(self._mode, self._location),
-            "variable": get_variable_metadata(da),
-            "coordinates": get_coords(da),
-            "global_attrs": get_global_attrs(ds, self._expected_attrs),
-            "data": get_data_info(da, self._mode)
-        }
+        return dict(zip(da.dims, chunks))
+
+    def _open_file(self, path, preprocess):
+        # Reading the start of the file first pulls its header into the file system cache
+        # concurrently, while the netCDF library calls are made one file at a time
+        with open(path, 'rb') as reader:
+            reader.read(SETTINGS.OPEN_PREFETCH_BYTES)
+
+        with _NETCDF_LOCK:
+            ds = xr.open_dataset(path, decode_times=False)
+            return preprocess(ds.chunk(self._plan_chunks(path, ds)))
+
+    def _open(self):
+        """
+        Opens the files without decoding times, which would turn every time value into
+        a cftime object. Instead the raw times of each file are converted to common units,
+        so that the files are combined in the right order.
+
+        Files are opened concurrently, at most SETTINGS.OPEN_CONCURRENCY at a time. If
+        SETTINGS.COMBINE is 'filename' and every file name ends in a time range, the files
+        are concatenated in that order, otherwise they are combined by coordinates.
+        """
+        reference = {}
+        lock = threading.Lock()
+        preprocess = lambda ds: rebase_times(ds, reference, lock)
+
+        ordered_files = order_files_by_name(self._files) if SETTINGS.COMBINE == 'filename' else None
+        files = ordered_files or self._files
+
+        with ThreadPoolExecutor(max_workers=max(1, min(SETTINGS.OPEN_CONCURRENCY, len(files)))) as executor:
+            datasets = list(executor.map(lambda path: self._open_file(path, preprocess), files))
+
+        try:
+            ds = combine_datasets(datasets, ordered=ordered_files is not None)
+        except Exception:
+            for dataset in datasets:
+                dataset.close()
+            raise
+
+        ds.set_close(lambda: [dataset.close() for dataset in datasets])
+        self._datasets = dict(zip(files, datasets))
+        return ds
+
+    def _extract(self):
+        with self._phase('open'):
+            ds = self._open()
+
+        with ds:
+            print('[WARN] NEED TO CHECK NUMBER OF VARS/DOMAINS RETURNED HERE')
+            print('[WARN] DOES NOT CHECK YET WHETHER WE MIGHT GET 2 DOMAINS/VARIABLES BACK FROM MULTI-FILE OPEN')
+            # Get content by variable
+            da = ds[self._var_id]
+
+            with self._phase('coords'):
+                coords = get_coords(da)
+
+            with self._phase('data'):
+                file_arrays = {path: dataset[self._var_id] for path, dataset in self._datasets.items()}
+                data = get_data_info(da, self._mode, file_arrays=file_arrays)
+
+            self.character = {
+                "scan_metadata": dict(get_scan_metadata(self._mode, self._location),
+                                      chunks=distinct_chunk_info([self._chunks[path] for path in self._files])),
+                "variable": get_variable_metadata(da),
+                "coordinates": coords,
+                "global_attrs": get_global_attrs(ds, self._expected_attrs),
+                "data": data
+            }
+
+
+def _get_extractor_class(engine):
+    # Imported here because the header engine reuses helpers from this module
+    from lib.header import HeaderCharacterExtractor
+
+    extractors = {
+        'xarray': CharacterExtractor,
+        'header': HeaderCharacterExtractor
+    }
+
+    return extractors[engine]
+
+
+def extract_character(files, location, var_id, mode='full', expected_attrs=None, engine=None,
+                      cache=None, metrics=None):
+    """
+    Extracts the character of a set of files using the given extraction engine.
+
+    :param engine: (string) either 'xarray' or 'header'. Defaults to the engine
+                   set for the `mode` in SETTINGS.ENGINES. If a non-xarray engine
+                   fails the extraction is retried with xarray.
+    :param cache: (FileFactsCache) per-file cache used by the header engine, OR None.
+    :param metrics: (ScanMetrics) timings of each phase of extraction, OR None.
+    :return: dictionary of character.
+    """
+    engine = engine or SETTINGS.ENGINES[mode]
+    extractor_class = _get_extractor_class(engine)
+    kwargs = {'cache': cache} if engine == 'header' else {}
+
+    try:
+        ce = extractor_class(files, location, var_id, mode, expected_attrs=expected_attrs,
+                             metrics=metrics, **kwargs)
+    except Exception as exc:
+        if engine == 'xarray':
+            raise
 
+        print(f'[WARN] {engine} engine failed, falling back to xarray. Exception was: {exc}')
+        ce = CharacterExtractor(files, location, var_id, mode, expected_attrs=expected_attrs, metrics=metrics)
 
-def extract_character(files, location, var_id, mode='full', expected_attrs=None):
-    ce = CharacterExtractor(files, location, var_id, mode, expected_attrs=expected_attrs)
     return ce.character
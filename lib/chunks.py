@@ -0,0 +1,81 @@
+"""
+Plans the chunks that data variables are read in.
+
+Reading a NetCDF4/HDF5 variable in pieces that cut through its on-disk chunks means
+the chunks that are cut are read (and decompressed) once for every piece that touches
+them. The planner aligns the pieces to whole on-disk chunks and makes them as large as
+a memory budget allows, growing them along the trailing dimensions first so that each
+piece covers as much contiguous storage as possible.
+"""
+
+import numpy as np
+
+
+def plan_chunks(shape, itemsize, disk_chunks, memory_budget):
+    """
+    Chooses the chunk size of each dimension of an array of `shape`. Each is a whole
+    number of on-disk chunks (or the full length of the dimension) and a chunk holds
+    no more than `memory_budget` bytes, unless a single on-disk chunk is already over
+    budget, in which case chunks are single on-disk chunks.
+
+    :param shape: (tuple) shape of the array.
+    :param itemsize: (int) number of bytes per array element.
+    :param disk_chunks: (sequence) on-disk chunk sizes, OR None for contiguous storage,
+                        which can be read in pieces of any size.
+    :param memory_budget: (int) maximum number of bytes in a chunk.
+    :return: tuple of chunk sizes, one per dimension.
+    """
+    if disk_chunks is None:
+        disk_chunks = [1] * len(shape)
+
+    chunks = [min(size, length) if length else 1 for size, length in zip(disk_chunks, shape)]
+    budget = memory_budget // itemsize
+
+    for i in reversed(range(len(shape))):
+        other = int(np.prod(chunks[:i] + chunks[i + 1:]))
+        n_disk_chunks = max(1, budget // (other * chunks[i]))
+        chunks[i] = min(shape[i], chunks[i] * n_disk_chunks) if shape[i] else 1
+
+    return tuple(int(_) for _ in chunks)
+
+
+def iter_chunks(shape, chunks):
+    """
+    Splits an array of `shape` into a grid of `chunks`.
+
+    :param shape: (tuple) shape of the array.
+    :param chunks: (tuple) chunk size of each dimension, as returned by `plan_chunks`.
+    :return: generator of tuples of slices, one tuple per chunk, in C order.
+    """
+    if not shape:
+        yield ()
+        return
+
+    for start in range(0, shape[0], chunks[0]):
+        for index in iter_chunks(shape[1:], chunks[1:]):
+            yield (slice(start, min(start + chunks[0], shape[0])),) + index
+
+
+def get_chunk_info(disk_chunks, chunks):
+    """
+    Returns the on-disk chunk sizes of a variable and the chunk sizes it is read in,
+    for the scan metadata.
+    """
+    return {
+        'disk': list(disk_chunks) if disk_chunks is not None else None,
+        'read': list(chunks)
+    }
+
+
+def distinct_chunk_info(chunk_infos):
+    """
+    Returns the chunk info (see `get_chunk_info`) shared by every file of a dataset,
+    OR a list of each distinct chunk info if they differ between files.
+    """
+    distinct = []
+
+    for info in chunk_infos:
+        if info not in distinct:
+            distinct.append(info)
+
+    return distinct[0] if len(distinct) == 1 else distinct
@@ -0,0 +1,202 @@
+"""
+Discovery of dataset directories matching a set of facet patterns.
+
+Instead of expanding a full glob pattern (e.g. /badc/cmip5/data/cmip5/output1/*/*/rcp45/...)
+the facet hierarchy is walked one level at a time: the directories of each level are
+listed concurrently, and only the children matching that level's facet pattern are
+descended into. Matching directories are yielded as soon as they are found, so that
+scanning can start before discovery has finished.
+
+Directory listings are kept in a persistent `DirectoryIndex`, invalidated by the
+directory's modification time, so that repeated scans resolve patterns from the index.
+
+Exclude patterns are regular expressions searched for in each directory path, with a
+trailing '/'. A directory that matches is pruned along with everything beneath it.
+"""
+
+import fnmatch
+import glob
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import SETTINGS
+from lib.writer import write_atomic
+
+
+class DirectoryIndex(object):
+
+    def __init__(self, index_path=None, trust_seconds=None):
+        """
+        Index of the sub-directories of each directory listed during discovery.
+
+        A cached listing is reused only if the directory's mtime is unchanged (one `stat`
+        instead of a full listing), or without touching the directory at all if it was
+        checked less than `trust_seconds` ago, in which case directories made since are
+        missed.
+
+        :param index_path: (string) JSON file to persist the index to, OR None to keep it in memory.
+        :param trust_seconds: (int) defaults to SETTINGS.DISCOVERY_INDEX_TRUST_SECONDS.
+        """
+        self._index_path = index_path
+        self._trust_seconds = SETTINGS.DISCOVERY_INDEX_TRUST_SECONDS if trust_seconds is None else trust_seconds
+        self._entries = self._load()
+        self._lock = threading.Lock()
+        self._changed = False
+
+    def _load(self):
+        if not self._index_path or not os.path.exists(self._index_path):
+            return {}
+
+        try:
+            with open(self._index_path) as reader:
+                return json.load(reader)
+        except (OSError, ValueError) as exc:
+            print(f'[WARN] Ignoring unreadable directory index: {self._index_path}: {exc}')
+            return {}
+
+    def list_subdirs(self, path):
+        """
+        Returns a sorted list of the names of the sub-directories of `path`.
+        """
+        now = time.time()
+        entry = self._entries.get(path)
+
+        if entry and now - entry['checked'] < self._trust_seconds:
+            return entry['subdirs']
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            self._set(path, None)
+            return []
+
+        if entry and entry['mtime'] == mtime:
+            subdirs = entry['subdirs']
+        else:
+            with os.scandir(path) as entries:
+                subdirs = sorted([_.name for _ in entries if _.is_dir()])
+
+        self._set(path, {'mtime': mtime, 'checked': now, 'subdirs': subdirs})
+        return subdirs
+
+    def _set(self, path, entry):
+        with self._lock:
+            if entry is None:
+                self._entries.pop(path, None)
+            else:
+                self._entries[path] = entry
+
+            self._changed = True
+
+    def save(self):
+        if not self._index_path or not self._changed:
+            return
+
+        # Written while locked, as threads saving at once would share the temporary file
+        with self._lock:
+            write_atomic(self._index_path, json.dumps(self._entries, separators=(',', ':')))
+            self._changed = False
+
+
+def compile_exclude(exclude):
+    """
+    Compiles a list of regular expressions into a single pattern matching any of them.
+
+    :param exclude: list of regular expressions, OR None.
+    :return: compiled regular expression, OR None if there is nothing to exclude.
+    """
+    if not exclude:
+        return None
+
+    return re.compile('|'.join([f'(?:{_})' for _ in exclude]))
+
+
+def is_excluded(exclude, path, base_dir):
+    """
+    Returns True if `path`, or any of its parent directories below `base_dir`,
+    matches the compiled `exclude` pattern.
+    """
+    if exclude is None:
+        return False
+
+    parts = path[len(base_dir):].strip('/').split('/')
+
+    for i in range(1, len(parts) + 1):
+        if exclude.search(os.path.join(base_dir, *parts[:i]) + '/'):
+            return True
+
+    return False
+
+
+def _match_children(index, path, pattern):
+    """
+    Returns the paths of the sub-directories of `path` matching `pattern`, using
+    the same rules as `glob`: hidden names only match patterns starting with '.'.
+    """
+    if not glob.has_magic(pattern):
+        child = os.path.join(path, pattern)
+        return [child] if os.path.isdir(child) else []
+
+    names = index.list_subdirs(path)
+
+    if not pattern.startswith('.'):
+        names = [_ for _ in names if not _.startswith('.')]
+
+    return [os.path.join(path, _) for _ in fnmatch.filter(names, pattern)]
+
+
+def iter_dataset_paths(base_dir, patterns, index=None, threads=None, exclude=None):
+    """
+    Generator that walks the directory tree under `base_dir` one level per pattern and
+    yields the directories that match all of the `patterns` as soon as each is found.
+
+    The tree is walked depth first, in sorted order at each level, but the directories
+    of a level are listed concurrently so that listing the siblings of a directory
+    overlaps with descending into it. Directories matching `exclude` are pruned before
+    they are listed.
+
+    :param base_dir: (string) the directory to start from.
+    :param patterns: sequence of glob patterns, one per directory level.
+    :param index: (DirectoryIndex) defaults to the index persisted at SETTINGS.DISCOVERY_INDEX_PATH.
+    :param threads: (int) number of directories to list at once, defaults to SETTINGS.DISCOVERY_THREADS.
+    :param exclude: compiled regular expression from `compile_exclude`, OR None.
+    :return: generator of directory paths.
+    """
+    save_index = index is None
+    index = index or DirectoryIndex(SETTINGS.DISCOVERY_INDEX_PATH)
+
+    if not os.path.isdir(base_dir):
+        return
+
+    def match_children(path, pattern):
+        return [child for child in _match_children(index, path, pattern)
+                if not (exclude and exclude.search(child + '/'))]
+
+    with ThreadPoolExecutor(max_workers=threads or SETTINGS.DISCOVERY_THREADS) as executor:
+
+        def walk(paths, level):
+            if level == len(patterns):
+                yield from paths
+                return
+
+            futures = [executor.submit(match_children, path, patterns[level]) for path in paths]
+
+            for future in futures:
+                yield from walk(future.result(), level + 1)
+
+        yield from walk([base_dir.rstrip('/')], 0)
+
+    if save_index:
+        index.save()
+
+
+def find_dataset_paths(base_dir, patterns, index=None, threads=None, exclude=None):
+    """
+    Returns a sorted list of the directories under `base_dir` that match all of the
+    `patterns`, one per directory level (see `iter_dataset_paths`).
+    """
+    return sorted(iter_dataset_paths(base_dir, patterns, index=index, threads=threads, exclude=exclude))
@@ -0,0 +1,563 @@
+"""
+Header-only extraction engine.
+
+Builds the same character as `lib.character.CharacterExtractor` in quick mode but
+reads the NetCDF headers and 1-D coordinate variables of each file directly with
+netCDF4, instead of decoding, aligning and combining every file with
+`xarray.open_mfdataset`.
+
+Each file is reduced to a small dictionary of "file facts" and the facts of all
+files are then merged into the dataset character. In full mode the facts also
+hold the min and max of the file's data, found by reading it slab by slab, so
+file facts can be cached and reused while the file is unchanged. The min and max
+of each file are kept in the character so that an extreme value can be traced to
+its file.
+
+In full mode files are read in a pool of threads. The netCDF-C and HDF5 libraries
+are not thread-safe, so the threads take turns to read a slab under
+`lib.character._NETCDF_LOCK`, but netCDF4 releases the GIL while it reads, so
+other threads decode and summarise their slabs meanwhile. Threads are therefore
+enough, without the cost of pickling facts back from worker processes.
+
+In estimate mode only a stratified sample of the files is read, and of each of
+those only a stratified sample of blocks of on-disk chunks.
+"""
+
+import hashlib
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+
+import cftime
+import netCDF4
+import numpy as np
+
+import SETTINGS
+from lib.character import (_NETCDF_LOCK, TIME_ENCODING_ATTRS, _copy_dict_for_json, _get_block_length,
+                           get_file_result, get_sample_info, get_scan_metadata, is_time_units)
+from lib.chunks import distinct_chunk_info, get_chunk_info, iter_chunks, plan_chunks
+from lib.metrics import get_phase
+from lib.stats import (Summary, count_blocks, iter_sample_slabs, min_max, slab_size,
+                       stratified_sample)
+
+
+# Attributes that xarray moves into `encoding` when decoding a variable,
+# so they never appear in the character
+ENCODING_ATTRS = ('_FillValue', 'missing_value', 'scale_factor', 'add_offset', '_Unsigned', 'coordinates')
+
+
+def _get_coord_type(attrs):
+    for ctype in ('time', 'latitude', 'longitude'):
+        if attrs.get('standard_name', None) == ctype:
+            return ctype
+
+
+def _get_decoded_attrs(variable):
+    """
+    Returns the attributes of a netCDF4 variable as xarray would present them
+    after CF decoding.
+    """
+    attrs = {name: variable.getncattr(name) for name in variable.ncattrs()}
+    drop = ENCODING_ATTRS
+
+    if is_time_units(attrs.get('units')):
+        drop += TIME_ENCODING_ATTRS
+
+    return _copy_dict_for_json({k: v for k, v in attrs.items() if k not in drop})
+
+
+def _get_coord_names(nc, variable):
+    """
+    Returns the names of the coordinates that xarray would attach to `variable`:
+    dimension coordinates plus any variable named in a `coordinates` attribute,
+    limited to those whose dimensions are a subset of the variable's dimensions.
+    Names are returned in file order.
+    """
+    aux_names = set()
+
+    for var in nc.variables.values():
+        if 'coordinates' in var.ncattrs():
+            aux_names.update(var.getncattr('coordinates').split())
+
+    dims = set(variable.dimensions)
+    coord_names = []
+
+    for name, var in nc.variables.items():
+        is_coord = name in nc.dimensions and var.dimensions == (name,)
+
+        if (is_coord or name in aux_names) and set(var.dimensions) <= dims:
+            coord_names.append(name)
+
+    return coord_names
+
+
+def _get_monotonic(values):
+    steps = np.diff(values)
+
+    if (steps >= 0).all():
+        return 'increasing'
+
+    if (steps <= 0).all():
+        return 'decreasing'
+
+    return 'unordered'
+
+
+def _get_coord_facts(coord_var):
+    values = coord_var[:]
+    attrs = {name: coord_var.getncattr(name) for name in coord_var.ncattrs()}
+
+    facts = {
+        'attrs': _get_decoded_attrs(coord_var),
+        'length': len(values),
+        'min': values.min().item(),
+        'max': values.max().item(),
+        'monotonic': _get_monotonic(values),
+        'digest': hashlib.sha1(np.ma.getdata(values).tobytes()).hexdigest()
+    }
+
+    if is_time_units(attrs.get('units')):
+        facts['units'] = attrs['units']
+        facts['calendar'] = attrs.get('calendar', 'standard')
+
+    return facts
+
+
+def _get_decoded_dtype(dtype, scale_factor, add_offset, has_fill):
+    """
+    Returns the dtype that xarray decodes values of `dtype` to, OR None if they are
+    left as they are (see `xarray.coding.variables._choose_float_dtype`).
+    """
+    if scale_factor is not None or add_offset is not None:
+        scale_type = np.dtype(type(scale_factor)) if scale_factor is not None else None
+        offset_type = np.dtype(type(add_offset)) if add_offset is not None else None
+
+        # Packed as CF describes, with a scale factor and offset of the same float type
+        if scale_type is not None and scale_type == offset_type and scale_type.kind == 'f':
+            return np.dtype('f8') if dtype.kind in 'iu' and dtype.itemsize == 4 else scale_type
+
+        # An offset alone may be too large for the precision of a float32
+        if offset_type is not None or scale_type.kind != 'f':
+            return np.dtype('f8')
+
+        return scale_type
+
+    if not has_fill or dtype.kind == 'f':
+        return None
+
+    return np.dtype('f4') if dtype.itemsize <= 2 else np.dtype('f8')
+
+
+def _get_unsigned_dtype(dtype, attrs):
+    # The _Unsigned attribute gives the signedness of integers stored in a netCDF-3 file
+    unsigned = str(attrs.get('_Unsigned', '')).lower()
+
+    if unsigned == 'true' and dtype.kind == 'i':
+        return np.dtype(f'u{dtype.itemsize}')
+    if unsigned == 'false' and dtype.kind == 'u':
+        return np.dtype(f'i{dtype.itemsize}')
+
+    return None
+
+
+def _as_scalar(value):
+    return np.asarray(value).item() if np.ndim(value) > 0 else value
+
+
+def _iter_decoded_slabs(variable, indices):
+    """
+    Reads the slabs of a netCDF4 variable selected by each of `indices`, reinterpreting
+    `_Unsigned` integers, masking fill and missing values as NaN and applying any scale
+    factor and offset, in the same way and in the same dtype as xarray decodes it.
+
+    :return: generator of decoded slabs.
+    """
+    with _NETCDF_LOCK:
+        attrs = {name: variable.getncattr(name) for name in variable.ncattrs()}
+        variable.set_auto_maskandscale(False)
+        dtype = variable.dtype
+
+    unsigned_dtype = _get_unsigned_dtype(dtype, attrs)
+    fill_values = [np.atleast_1d(attrs[key]) for key in ('_FillValue', 'missing_value') if key in attrs]
+
+    if unsigned_dtype is not None:
+        fill_values = [values.astype(dtype).view(unsigned_dtype) for values in fill_values]
+        dtype = unsigned_dtype
+
+    scale_factor = _as_scalar(attrs.get('scale_factor', None))
+    add_offset = _as_scalar(attrs.get('add_offset', None))
+    decoded_dtype = _get_decoded_dtype(dtype, scale_factor, add_offset, bool(fill_values))
+
+    for index in indices:
+        # Only the read holds the lock, so other files are decoded and summarised meanwhile
+        with _NETCDF_LOCK:
+            data = variable[index]
+
+        if unsigned_dtype is not None:
+            data = data.view(unsigned_dtype)
+
+        mask = np.zeros(data.shape, dtype=bool)
+
+        for values in fill_values:
+            for fill_value in values:
+                mask |= np.isnan(data) if np.isnan(fill_value) else (data == fill_value)
+
+        if decoded_dtype is not None:
+            data = data.astype(decoded_dtype)
+        elif mask.any():
+            data = data.copy()
+
+        if mask.any():
+            data[mask] = np.nan
+
+        # In place, so the values stay in the decoded dtype
+        if scale_factor is not None:
+            data *= scale_factor
+        if add_offset is not None:
+            data += add_offset
+
+        yield data
+
+
+def _get_chunksizes(variable):
+    chunking = variable.chunking()
+    return None if chunking == 'contiguous' else chunking
+
+
+def _get_sample_rng(path):
+    # Seeded by file name so that the same blocks are sampled from a file on every scan
+    return np.random.default_rng([SETTINGS.ESTIMATE_SEED, zlib.crc32(os.path.basename(path).encode())])
+
+
+def get_file_facts(path, var_id, mode='quick', memory_budget=None):
+    """
+    Reads the header and 1-D coordinate variables of a single NetCDF file and
+    returns the facts needed to build a dataset character. In full mode the data
+    values are also read and summarised in the 'stats' fact (see `lib.stats.Summary`),
+    in chunks aligned to the on-disk chunks (see `lib.chunks.plan_chunks`). In
+    estimate mode the min and max are estimated from a sample of the data, described
+    by the 'sample' fact.
+
+    :param path: (string) path to a NetCDF file.
+    :param var_id: (string) the variable to characterise.
+    :param mode: Scanning mode: one of quick, estimate or full.
+    :param memory_budget: (int) bytes to read at a time, defaults to SETTINGS.MEMORY_BUDGET.
+    :return: dictionary of file facts.
+    """
+    with _NETCDF_LOCK:
+        nc = netCDF4.Dataset(path)
+
+    try:
+        with _NETCDF_LOCK:
+            variable = nc.variables[var_id]
+
+            var_metadata = _get_decoded_attrs(variable)
+            var_metadata['var_id'] = var_id
+            fill_value = variable.getncattr('_FillValue') if '_FillValue' in variable.ncattrs() else 'NOT_DEFINED'
+            var_metadata['_FillValue'] = str(fill_value)
+
+            coords = {}
+
+            for dim in variable.dimensions:
+                if dim in nc.variables and nc.variables[dim].dimensions == (dim,):
+                    coords[dim] = _get_coord_facts(nc.variables[dim])
+
+            facts = {
+                'path': path,
+                'global_attrs': _copy_dict_for_json({name: nc.getncattr(name) for name in nc.ncattrs()}),
+                'variable': var_metadata,
+                'dims': list(variable.dimensions),
+                'shape': list(variable.shape),
+                'coord_names': _get_coord_names(nc, variable),
+                'coords': coords,
+                'min': None,
+                'max': None
+            }
+
+            shape, itemsize = variable.shape, variable.dtype.itemsize
+            disk_chunks = _get_chunksizes(variable)
+
+        memory_budget = memory_budget or SETTINGS.MEMORY_BUDGET
+        chunks = plan_chunks(shape, itemsize, disk_chunks, memory_budget)
+        facts['chunks'] = get_chunk_info(disk_chunks, chunks)
+
+        if mode == 'full':
+            summary = Summary(SETTINGS.SKETCH_RELATIVE_ACCURACY)
+
+            for data in _iter_decoded_slabs(variable, iter_chunks(shape, chunks)):
+                summary.add(data)
+
+            facts['min'], facts['max'] = summary.min, summary.max
+            facts['stats'] = summary.to_dict()
+
+        elif mode == 'estimate':
+            block_length = _get_block_length(disk_chunks)
+            indices = list(iter_sample_slabs(shape, itemsize, memory_budget, SETTINGS.ESTIMATE_BLOCKS,
+                                             _get_sample_rng(path), block_length))
+
+            facts['min'], facts['max'] = min_max(_iter_decoded_slabs(variable, indices))
+            facts['sample'] = {
+                'values': sum(slab_size(_, shape) for _ in indices),
+                'blocks': min(SETTINGS.ESTIMATE_BLOCKS, count_blocks(shape, block_length))
+            }
+
+        return facts
+    finally:
+        with _NETCDF_LOCK:
+            nc.close()
+
+
+def _decode_time(value, coord_facts):
+    return cftime.num2date(value, coord_facts['units'], coord_facts['calendar'],
+                           only_use_cftime_datetimes=True)
+
+
+def _get_time_start(facts):
+    for coord_facts in facts['coords'].values():
+        if 'units' in coord_facts:
+            return _decode_time(coord_facts['min'], coord_facts)
+
+
+def _sort_by_time(all_facts):
+    """
+    Sorts file facts by the start of their time axis, mirroring the order that
+    `combine='by_coords'` would give the files.
+    """
+    starts = [_get_time_start(facts) for facts in all_facts]
+
+    if None in starts:
+        return list(all_facts)
+
+    return [facts for _, facts in sorted(zip(starts, all_facts), key=lambda pair: pair[0])]
+
+
+def _merge_monotonic(all_coord_facts, decode):
+    """
+    Returns whether a coordinate concatenated from each file's part, in order, is
+    monotonic: every part must be monotonic in the same direction, and continue
+    from the end of the part before it.
+    """
+    parts = [facts for facts in all_coord_facts if facts['length'] > 1]
+    directions = set(facts['monotonic'] for facts in parts) or {'increasing'}
+
+    if len(directions) > 1 or 'unordered' in directions:
+        return 'unordered'
+
+    direction = directions.pop()
+
+    for before, after in zip(all_coord_facts[:-1], all_coord_facts[1:]):
+        if direction == 'increasing' and decode(before['max'], before) > decode(after['min'], after):
+            return 'unordered'
+        if direction == 'decreasing' and decode(before['min'], before) < decode(after['max'], after):
+            return 'unordered'
+
+    return direction
+
+
+def _merge_coord(name, all_coord_facts):
+    """
+    Merges the facts of one dimension coordinate across files. If the coordinate
+    values are identical in every file they are taken from the first file, otherwise
+    the files are assumed to be concatenated along this dimension.
+    """
+    first = all_coord_facts[0]
+    concatenated = len(set(facts['digest'] for facts in all_coord_facts)) > 1
+    length = sum(facts['length'] for facts in all_coord_facts) if concatenated else first['length']
+
+    coord_type = _get_coord_type(first['attrs'])
+    name = coord_type or name
+
+    decode = _decode_time if 'units' in first else lambda value, facts: value
+    monotonic = _merge_monotonic(all_coord_facts, decode) if concatenated else first['monotonic']
+
+    if 'units' in first:
+        mn = min(_decode_time(facts['min'], facts) for facts in all_coord_facts)
+        mx = max(_decode_time(facts['max'], facts) for facts in all_coord_facts)
+        calendar = mn.calendar
+        mn, mx = [_.strftime('%Y-%m-%dT%H:%M:%S') for _ in (mn, mx)]
+    else:
+        mn = float(min(facts['min'] for facts in all_coord_facts))
+        mx = float(max(facts['max'] for facts in all_coord_facts))
+
+    info = {
+        'id': name,
+        'min': mn,
+        'max': mx,
+        'length': length,
+        'monotonic': monotonic
+    }
+
+    if coord_type == 'time':
+        info['calendar'] = calendar
+
+    info.update(first['attrs'])
+    return name, info
+
+
+def _merge_samples(all_facts):
+    """
+    Sums the values and blocks read from each file in estimate mode. Files read in
+    full mode (e.g. found in the file cache) count as read in full.
+    """
+    values_read = blocks_read = n_values = 0
+
+    for facts in all_facts:
+        size = int(np.prod(facts['shape']))
+        n_values += size
+
+        if 'sample' in facts:
+            values_read += facts['sample']['values']
+            blocks_read += facts['sample']['blocks']
+        elif facts['max'] is not None:
+            values_read += size
+            blocks_read += count_blocks(facts['shape'])
+
+    return get_sample_info(values_read, n_values, blocks_read)
+
+
+def merge_file_facts(all_facts, mode='quick'):
+    """
+    Merges the facts of each file in a dataset into the `variable`, `coordinates`,
+    `global_attrs` and `data` sections of a character.
+
+    :param all_facts: list of file facts, as returned by `get_file_facts`.
+    :param mode: Scanning mode: one of quick, estimate or full.
+    :return: dictionary of character sections.
+    """
+    all_facts = _sort_by_time(all_facts)
+    first = all_facts[0]
+
+    mn = mx = stats = None
+
+    if mode == 'full':
+        summary = Summary(SETTINGS.SKETCH_RELATIVE_ACCURACY)
+
+        for facts in all_facts:
+            summary.merge(Summary.from_dict(facts['stats']))
+
+        stats = summary.get_info(SETTINGS.QUANTILES)
+        mn, mx = stats.pop('min'), stats.pop('max')
+
+    elif mode == 'estimate':
+        partials = [(facts['min'], facts['max']) for facts in all_facts if facts['max'] is not None]
+        mn, mx = min_max([np.array(partials, dtype='f8')])
+
+    coords = {}
+    shape = []
+
+    for i, dim in enumerate(first['dims']):
+
+        if dim in first['coords']:
+            name, info = _merge_coord(dim, [facts['coords'][dim] for facts in all_facts])
+            coords[name] = info
+            shape.append(info['length'])
+        else:
+            shape.append(first['shape'][i])
+
+    data = {
+        'min': mn,
+        'max': mx,
+        'shape': shape,
+        'rank': len(shape),
+        'coord_names': first['coord_names']
+    }
+
+    if stats is not None:
+        data.update(stats)
+        data['files'] = [get_file_result(facts['path'], facts['stats'])
+                         for facts in sorted(all_facts, key=lambda facts: os.path.basename(facts['path']))]
+
+    if mode == 'estimate':
+        data['sample'] = _merge_samples(all_facts)
+
+    return {
+        'variable': first['variable'],
+        'coordinates': coords,
+        'global_attrs': first['global_attrs'],
+        'data': data
+    }
+
+
+class HeaderCharacterExtractor(object):
+
+    def __init__(self, files, location, var_id, mode, expected_attrs=None, cache=None, metrics=None):
+        """
+        Read the headers and coordinate variables of each file with netCDF4 and
+        extract character as a dictionary.
+
+        :param files: List of data files.
+        :param var_id: (string) The variable chosen as an argument at the command line.
+        :param cache: (FileFactsCache) cache of file facts from previous scans, OR None.
+        :param metrics: (ScanMetrics) timings of each phase of extraction, OR None.
+        """
+        self._files = files
+        self._var_id = var_id
+        self._mode = mode
+        self._location = location
+        self._expected_attrs = expected_attrs
+        self._cache = cache
+        self._phase = get_phase(metrics)
+        self._extract()
+
+    def _get_file_modes(self):
+        """
+        Returns a dictionary of {<path>: <mode>} to read each file in. In estimate mode
+        a stratified sample of SETTINGS.ESTIMATE_FILES files (in file name order) is
+        sampled and only the headers of the others are read.
+        """
+        if self._mode != 'estimate':
+            return {path: self._mode for path in self._files}
+
+        files = sorted(self._files)
+        rng = np.random.default_rng(SETTINGS.ESTIMATE_SEED)
+        sampled = set(files[i] for i in stratified_sample(len(files), SETTINGS.ESTIMATE_FILES, rng))
+
+        return {path: 'estimate' if path in sampled else 'quick' for path in files}
+
+    def _get_all_facts(self, file_modes):
+        """
+        Returns the facts of each file, from the cache where still valid. In full mode
+        the other files are read in a pool of up to SETTINGS.FILE_WORKERS threads, which
+        take turns to read from the netCDF library and summarise their data meanwhile,
+        each with an equal share of SETTINGS.MEMORY_BUDGET.
+        """
+        all_facts = {}
+
+        if self._cache is not None:
+            for path in self._files:
+                all_facts[path] = self._cache.get(path, self._var_id, file_modes[path])
+
+        to_read = [path for path in self._files if all_facts.get(path) is None]
+        modes = [file_modes[path] for path in to_read]
+        workers = min(SETTINGS.FILE_WORKERS, len(to_read)) if self._mode == 'full' else 1
+
+        if workers > 1:
+            budgets = repeat(SETTINGS.MEMORY_BUDGET // workers)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                read = list(executor.map(get_file_facts, to_read, repeat(self._var_id), modes, budgets))
+        else:
+            read = map(get_file_facts, to_read, repeat(self._var_id), modes)
+
+        for path, mode, facts in zip(to_read, modes, read):
+            all_facts[path] = facts
+
+            if self._cache is not None:
+                self._cache.put(path, self._var_id, mode, facts)
+
+        return [all_facts[path] for path in self._files]
+
+    def _extract(self):
+        file_modes = self._get_file_modes()
+
+        with self._phase('files'):
+            all_facts = self._get_all_facts(file_modes)
+
+            if self._cache is not None:
+                self._cache.save()
+
+        with self._phase('merge'):
+            self.character = {"scan_metadata": get_scan_metadata(self._mode, self._location)}
+            self.character["scan_metadata"]["chunks"] = distinct_chunk_info([facts['chunks'] for facts in all_facts])
+            self.character.update(merge_file_facts(all_facts, self._mode))
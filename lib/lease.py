@@ -0,0 +1,211 @@
+"""
+Leases that share the datasets of one scan selection between several scans (e.g. one
+per batch node) without a central service, using files on the shared output directory.
+
+Scans sharing a selection are started with the same run name. Before a scan extracts a
+dataset it claims it by creating a lease file with O_EXCL, which only one scan can do:
+
+    <SETTINGS.LEASE_PATH>.lease.<generation>
+
+The scan renews its leases (by touching them) while it holds them, and once the outcome
+of a dataset has been written it creates a done marker and removes the lease:
+
+    <SETTINGS.LEASE_PATH>.done
+
+A lease that has not been renewed for SETTINGS.LEASE_SECONDS belongs to a scan that has
+died (or hung). It is reclaimed by creating the next generation, again with O_EXCL, so
+only one scan can take it over, and the scan that held the older generation will find
+it is no longer the holder (see `Leases.holds`) and does not write its outcome.
+
+Lease ages are compared with the clock of the machine reading them, so the clocks of
+the nodes must agree to well within SETTINGS.LEASE_SECONDS.
+"""
+
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import SETTINGS
+from lib import utils
+from lib.writer import make_dirs, write_atomic
+
+
+class Leases(object):
+
+    def __init__(self, run, lease_seconds=None):
+        """
+        The leases held by this process on the datasets of `run`.
+
+        :param run: (string) name shared by the scans working through one selection.
+        :param lease_seconds: (float) seconds after which a lease that has not been renewed
+                              can be reclaimed, defaults to SETTINGS.LEASE_SECONDS.
+        """
+        self.run = run
+        self.lease_seconds = lease_seconds or SETTINGS.LEASE_SECONDS
+        # Unique to this instance, as generations are reused once a dataset has no lease
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+        # Generation of the lease held on each DSID
+        self._held = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._renewer = None
+
+    def _prefix(self, ds_id):
+        return SETTINGS.LEASE_PATH.format(run=self.run, grouped_ds_id=utils.get_grouped_ds_id(ds_id))
+
+    def _lease_path(self, ds_id, generation):
+        return f'{self._prefix(ds_id)}.lease.{generation}'
+
+    def _done_path(self, ds_id):
+        return f'{self._prefix(ds_id)}.done'
+
+    def _generations(self, ds_id):
+        prefix = f'{self._prefix(ds_id)}.lease.'
+        generations = [_[len(prefix):] for _ in glob.glob(glob.escape(prefix) + '*')]
+        return sorted(int(_) for _ in generations if _.isdigit())
+
+    def is_done(self, ds_id):
+        return os.path.exists(self._done_path(ds_id))
+
+    def _is_expired(self, ds_id, generation):
+        try:
+            mtime = os.stat(self._lease_path(ds_id, generation)).st_mtime
+        except FileNotFoundError:
+            # Released since it was listed
+            return True
+
+        return time.time() - mtime > self.lease_seconds
+
+    def claim(self, ds_id):
+        """
+        Claims `ds_id` for this process.
+
+        :return: True if this process now holds the lease, False if the dataset is done
+                 or its lease is held by another scan.
+        """
+        if self.is_done(ds_id):
+            return False
+
+        generations = self._generations(ds_id)
+        generation = 0
+
+        if generations:
+            if not self._is_expired(ds_id, generations[-1]):
+                return False
+
+            generation = generations[-1] + 1
+
+        lease_path = self._lease_path(ds_id, generation)
+        make_dirs(lease_path)
+
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, 'w') as writer:
+            writer.write(json.dumps({'owner': self.owner, 'time': time.time()}))
+
+        # Give up if the dataset was finished, or a newer lease appeared, while claiming
+        if self.is_done(ds_id) or self._generations(ds_id)[-1] != generation:
+            os.remove(lease_path)
+            return False
+
+        if generations:
+            print(f'[WARN] Reclaimed expired lease on: {ds_id}')
+
+            for old in generations:
+                self._remove(ds_id, old)
+
+        with self._lock:
+            self._held[ds_id] = generation
+
+        return True
+
+    def holds(self, ds_id):
+        """
+        Returns True if this process still holds the lease on `ds_id`, i.e. it has not
+        been reclaimed by another scan after expiring.
+        """
+        with self._lock:
+            generation = self._held.get(ds_id)
+
+        if generation is None:
+            return False
+
+        try:
+            with open(self._lease_path(ds_id, generation)) as reader:
+                owner = json.load(reader)['owner']
+        except (FileNotFoundError, ValueError):
+            # Removed, or claimed by another scan that is still writing it
+            return False
+
+        return owner == self.owner and self._generations(ds_id)[-1] == generation
+
+    def _remove(self, ds_id, generation):
+        try:
+            os.remove(self._lease_path(ds_id, generation))
+        except FileNotFoundError:
+            pass
+
+    def release(self, ds_ids, done=True):
+        """
+        Releases the leases on `ds_ids`, first marking each as done if `done` is True.
+        """
+        for ds_id in ds_ids:
+            with self._lock:
+                generation = self._held.pop(ds_id, None)
+
+            if generation is None:
+                continue
+
+            if done:
+                write_atomic(self._done_path(ds_id), self.owner)
+
+            self._remove(ds_id, generation)
+
+    def renew(self):
+        """
+        Renews every lease held by this process.
+        """
+        with self._lock:
+            held = list(self._held.items())
+
+        for ds_id, generation in held:
+            try:
+                os.utime(self._lease_path(ds_id, generation))
+            except FileNotFoundError:
+                # Reclaimed by another scan, see `holds`
+                pass
+
+    def _renew_until_stopped(self):
+        while not self._stopped.wait(self.lease_seconds / 4.):
+            self.renew()
+
+    def start(self):
+        """
+        Starts renewing the leases held by this process in a background thread.
+        """
+        self._stopped.clear()
+        self._renewer = threading.Thread(target=self._renew_until_stopped, daemon=True)
+        self._renewer.start()
+
+    def stop(self):
+        """
+        Stops renewing, and releases every lease still held without marking it done,
+        so that other scans can claim those datasets straight away.
+        """
+        self._stopped.set()
+
+        if self._renewer is not None:
+            self._renewer.join()
+
+        with self._lock:
+            held = list(self._held)
+
+        self.release(held, done=False)
@@ -0,0 +1,164 @@
+"""
+Timings and bytes read for each phase of scanning a dataset.
+
+A `ScanMetrics` object is passed down through `scan.scan_dataset` and the extraction
+engines, which time each phase with:
+
+    with metrics.phase('open'):
+        ...
+
+Phases of the same name are accumulated, and phases may be nested (e.g. 'open' within
+'extract'). Bytes read are taken from the 'rchar' counter of /proc/self/io, so they
+include reads served from the page cache and reads by every thread of the process;
+they are None where /proc is not available.
+"""
+
+import contextlib
+import json
+import time
+
+import numpy as np
+
+from lib.writer import make_dirs
+
+
+PROC_IO_PATH = '/proc/self/io'
+
+# Percentiles of each phase reported at the end of a run
+REPORT_PERCENTILES = [50, 90, 99]
+
+
+def read_bytes():
+    """
+    Returns the number of bytes read by the current process so far, OR None if unknown.
+    """
+    try:
+        with open(PROC_IO_PATH) as reader:
+            for line in reader:
+                name, value = line.split(':')
+
+                if name == 'rchar':
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+class ScanMetrics(object):
+
+    def __init__(self):
+        """
+        Accumulates the seconds and bytes read spent in each named phase of a scan.
+        """
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager that adds the time and bytes read within it to phase `name`.
+        """
+        start_time = time.perf_counter()
+        start_bytes = read_bytes()
+
+        try:
+            yield
+        finally:
+            end_bytes = read_bytes()
+            totals = self.phases.setdefault(name, {'seconds': 0., 'bytes_read': None})
+            totals['seconds'] += time.perf_counter() - start_time
+
+            if start_bytes is not None and end_bytes is not None:
+                totals['bytes_read'] = (totals['bytes_read'] or 0) + end_bytes - start_bytes
+
+    @classmethod
+    def from_dict(cls, phases):
+        """
+        Returns ScanMetrics holding `phases`, as returned by `to_dict`, so that timing
+        can continue in another process.
+        """
+        metrics = cls()
+        metrics.phases = {name: dict(totals) for name, totals in phases.items()}
+        return metrics
+
+    def to_dict(self):
+        """
+        Returns a dictionary of {<phase>: {'seconds': <float>, 'bytes_read': <int or None>}}.
+        """
+        return {name: {'seconds': round(totals['seconds'], 6), 'bytes_read': totals['bytes_read']}
+                for name, totals in self.phases.items()}
+
+
+def null_phase(name):
+    # Stands in for `ScanMetrics.phase` when no metrics are being collected
+    return contextlib.nullcontext()
+
+
+def get_phase(metrics):
+    """
+    Returns the `phase` context manager of `metrics`, OR one that does nothing if it is None.
+    """
+    return metrics.phase if metrics is not None else null_phase
+
+
+def write_metrics(metrics_path, ds_id, mode, status, phases):
+    """
+    Appends the metrics of one scan to the JSON lines file at `metrics_path`, in one
+    write so that several worker processes can share the file.
+
+    :param ds_id: dataset identifier (DSID)
+    :param mode: Scanning mode the dataset was scanned in.
+    :param status: 'success' or the class of failure, as in lib.state.
+    :param phases: dictionary returned by `ScanMetrics.to_dict`.
+    """
+    make_dirs(metrics_path)
+    line = json.dumps({'ds_id': ds_id, 'mode': mode, 'status': status, 'phases': phases})
+
+    with open(metrics_path, 'a') as writer:
+        writer.write(line + '\n')
+
+
+def summarise_phases(all_phases):
+    """
+    Aggregates the metrics of many scans into percentiles of each phase.
+
+    :param all_phases: dictionary of {<ds_id>: <dictionary returned by `ScanMetrics.to_dict`>}
+    :return: dictionary of {<phase>: {'count': <int>, 'p50': <seconds>, ..., 'max': <seconds>,
+             'slowest': <ds_id>, 'bytes_read': <total or None>}}
+    """
+    summary = {}
+    names = sorted(set(name for phases in all_phases.values() for name in phases))
+
+    for name in names:
+        ds_ids = [ds_id for ds_id, phases in all_phases.items() if name in phases]
+        seconds = np.array([all_phases[ds_id][name]['seconds'] for ds_id in ds_ids])
+        bytes_read = [all_phases[ds_id][name]['bytes_read'] for ds_id in ds_ids]
+
+        info = {'count': len(ds_ids)}
+        info.update({f'p{p}': float(np.percentile(seconds, p)) for p in REPORT_PERCENTILES})
+        info['max'] = float(seconds.max())
+        info['slowest'] = ds_ids[int(seconds.argmax())]
+        info['bytes_read'] = None if None in bytes_read else int(sum(bytes_read))
+
+        summary[name] = info
+
+    return summary
+
+
+def print_report(all_phases):
+    """
+    Prints the percentiles of each phase over the scans in `all_phases` (see `summarise_phases`).
+    """
+    summary = summarise_phases(all_phases)
+
+    if not summary:
+        return
+
+    print(f'[INFO] Phase timings (seconds) over {len(all_phases)} datasets:')
+
+    for name, info in summary.items():
+        percentiles = ', '.join(f'p{p}={info[f"p{p}"]:.3f}' for p in REPORT_PERCENTILES)
+        bytes_read = f', bytes read={info["bytes_read"]}' if info['bytes_read'] is not None else ''
+
+        print(f'[INFO]   {name}: {percentiles}, max={info["max"]:.3f} '
+              f'({info["slowest"]}){bytes_read}')
@@ -0,0 +1,311 @@
+"""
+Storage backends for the register of dataset characters.
+
+ - JSONRegister: one JSON file per dataset under SETTINGS.JSON_OUTPUT_PATH.
+ - SQLiteRegister: one SQLite database holding every dataset, with an indexed
+   column per facet (from `options.facet_rules`) so that datasets can be
+   selected by facet pattern without opening each record.
+
+Use `get_register` to get the (per-process) register for a project.
+"""
+
+import glob
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import SETTINGS
+from lib import options, utils
+from lib.writer import dumps_json, make_dirs, write_atomic, write_many
+
+
+backends = ['json', 'sqlite']
+
+
+def to_json(character, output_path, compact=None):
+    """
+    Outputs the extracted characteristics to a JSON file, which is replaced in one
+    rename so that it is never left half written.
+
+    :param character: (dict) The extracted characteristics.
+    :param output_path: (string) The file path at which the JSON file is produced.
+    :param compact: if True, write without indentation, OR None to use SETTINGS.COMPACT_JSON.
+    :return : None
+    """
+    write_atomic(output_path, dumps_json(character, compact=compact))
+
+
+class JSONRegister(object):
+
+    def __init__(self, project, batch_size=None):
+        """
+        Register that stores each character as a JSON file, sharded into directories
+        by `utils.get_grouped_ds_id`. Writes are buffered and written in batches of
+        `batch_size` records, concurrently in a pool of SETTINGS.WRITE_THREADS threads.
+
+        :param project: top-level project.
+        :param batch_size: (int) records to buffer per write, defaults to SETTINGS.REGISTER_BATCH_SIZE.
+        """
+        self.project = project
+        self.batch_size = batch_size or SETTINGS.REGISTER_BATCH_SIZE
+
+        self._pending = {}
+
+    def __str__(self):
+        return os.path.dirname(self._split_template()[0])
+
+    @staticmethod
+    def _split_template():
+        return SETTINGS.JSON_OUTPUT_PATH.split('{grouped_ds_id}')
+
+    def location(self, ds_id):
+        grouped_ds_id = utils.get_grouped_ds_id(ds_id)
+        return SETTINGS.JSON_OUTPUT_PATH.format(grouped_ds_id=grouped_ds_id)
+
+    def get(self, ds_id, json_path=None):
+        """
+        Returns the registered character, or None if the dataset is not registered.
+        Raises `json.decoder.JSONDecodeError` if the record is corrupt.
+        """
+        pending = self._pending.get(ds_id)
+
+        if pending is not None:
+            return json.loads(pending)
+
+        json_path = json_path or self.location(ds_id)
+
+        if not os.path.exists(json_path):
+            return None
+
+        with open(json_path) as reader:
+            return json.load(reader)
+
+    def get_many(self, ds_ids, batch_size=1000):
+        """
+        Generator of (ds_id, character) pairs, in the order of `ds_ids` (which may be
+        streamed), reading the JSON files of each batch of `batch_size` concurrently in
+        a pool of SETTINGS.LOAD_THREADS threads.
+        """
+        ds_ids = iter(ds_ids)
+
+        with ThreadPoolExecutor(max_workers=SETTINGS.LOAD_THREADS) as executor:
+            while True:
+                batch = list(itertools.islice(ds_ids, batch_size))
+
+                if not batch:
+                    return
+
+                json_paths = [SETTINGS.JSON_OUTPUT_PATH.format(grouped_ds_id=_)
+                              for _ in utils.iter_grouped_ds_ids(batch)]
+
+                yield from zip(batch, executor.map(self.get, batch, json_paths))
+
+    def put(self, ds_id, character):
+        # Serialised now so that a character that cannot be encoded fails its own put
+        self._pending[ds_id] = dumps_json(character)
+
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def delete(self, ds_id):
+        self._pending.pop(ds_id, None)
+        json_path = self.location(ds_id)
+
+        if os.path.exists(json_path):
+            os.remove(json_path)
+
+    def flush(self):
+        """
+        Writes all buffered records.
+        """
+        if not self._pending:
+            return
+
+        write_many({self.location(ds_id): text for ds_id, text in self._pending.items()})
+        self._pending.clear()
+
+    def select(self, facets):
+        """
+        Returns a list of registered DSIDs matching the facet patterns in `facets`,
+        a dictionary of {<facet name>: <glob pattern>}. Facets not given match anything.
+        """
+        self.flush()
+
+        facet_order = options.facet_rules[self.project]
+        pattern = '.'.join([facets.get(_, '*') for _ in facet_order])
+        prefix, suffix = self._split_template()
+
+        ds_ids = []
+
+        for json_path in sorted(glob.glob(self.location(pattern))):
+            grouped_ds_id = json_path[len(prefix):len(json_path) - len(suffix)]
+            ds_ids.append(grouped_ds_id.replace('/', '.'))
+
+        return ds_ids
+
+
+class SQLiteRegister(object):
+
+    def __init__(self, project, db_path=None, batch_size=None):
+        """
+        Register that stores every character of a project in one table of a SQLite
+        database, with an indexed column per facet. Writes are buffered and committed
+        in batches of `batch_size` records within a single transaction.
+
+        :param project: top-level project.
+        :param db_path: (string) path to the database, defaults to SETTINGS.SQLITE_REGISTER_PATH.
+        :param batch_size: (int) records to buffer per write, defaults to SETTINGS.REGISTER_BATCH_SIZE.
+        """
+        self.project = project
+        self.db_path = db_path or SETTINGS.SQLITE_REGISTER_PATH
+        self.batch_size = batch_size or SETTINGS.REGISTER_BATCH_SIZE
+
+        self._table = project.replace('-', '_')
+        self._facet_names = options.facet_rules[project]
+        self._pending = {}
+        self._local = threading.local()
+
+    def __str__(self):
+        return self.db_path
+
+    def location(self, ds_id):
+        return f'{self.db_path}:{self._table}/{ds_id}'
+
+    @property
+    def conn(self):
+        # A connection must not be shared with a forked worker process or another thread
+        # (the scanning pipeline checks the register while it writes to it)
+        if getattr(self._local, 'pid', None) != os.getpid():
+            make_dirs(self.db_path)
+            self._local.conn = sqlite3.connect(self.db_path, timeout=SETTINGS.SQLITE_TIMEOUT)
+            self._local.pid = os.getpid()
+            self._create_table(self._local.conn)
+
+        return self._local.conn
+
+    def _create_table(self, conn):
+        facet_columns = ''.join([f'"{_}" TEXT, ' for _ in self._facet_names])
+
+        with conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{self._table}" ('
+                         f'ds_id TEXT PRIMARY KEY, {facet_columns}'
+                         f'mode TEXT, last_scanned TEXT, character TEXT NOT NULL)')
+
+            for facet_name in self._facet_names:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "{self._table}_{facet_name}" '
+                             f'ON "{self._table}" ("{facet_name}")')
+
+    def get(self, ds_id):
+        pending = self._pending.get(ds_id)
+
+        if pending is not None:
+            return pending
+
+        row = self.conn.execute(f'SELECT character FROM "{self._table}" WHERE ds_id = ?',
+                                (ds_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def get_many(self, ds_ids, batch_size=500):
+        """
+        Generator of (ds_id, character) pairs, in the order of `ds_ids` (which may be
+        streamed), fetching `batch_size` records per query.
+        """
+        self.flush()
+        ds_ids = iter(ds_ids)
+
+        while True:
+            batch = list(itertools.islice(ds_ids, batch_size))
+
+            if not batch:
+                return
+
+            placeholders = ', '.join(['?'] * len(batch))
+            rows = dict(self.conn.execute(f'SELECT ds_id, character FROM "{self._table}" '
+                                          f'WHERE ds_id IN ({placeholders})', batch))
+
+            for ds_id in batch:
+                yield ds_id, json.loads(rows[ds_id]) if ds_id in rows else None
+
+    def put(self, ds_id, character):
+        self._pending[ds_id] = character
+
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def delete(self, ds_id):
+        self._pending.pop(ds_id, None)
+
+        with self.conn:
+            self.conn.execute(f'DELETE FROM "{self._table}" WHERE ds_id = ?', (ds_id,))
+
+    def flush(self):
+        """
+        Writes all buffered records in one transaction.
+        """
+        if not self._pending:
+            return
+
+        rows = []
+
+        for ds_id, character in self._pending.items():
+            facets = utils.get_facets(self.project, ds_id)
+            scan_metadata = character.get('scan_metadata', {})
+
+            rows.append([ds_id] + [facets.get(_) for _ in self._facet_names] +
+                        [scan_metadata.get('mode'), scan_metadata.get('last_scanned'),
+                         json.dumps(character, sort_keys=True)])
+
+        placeholders = ', '.join(['?'] * len(rows[0]))
+
+        with self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO "{self._table}" VALUES ({placeholders})', rows)
+
+        self._pending.clear()
+
+    def select(self, facets):
+        """
+        Returns a list of registered DSIDs matching the facet patterns in `facets`,
+        a dictionary of {<facet name>: <glob pattern>}. Facets not given match anything.
+        """
+        self.flush()
+
+        unknown = set(facets) - set(self._facet_names)
+        if unknown:
+            raise Exception(f'Unknown facets for project {self.project}: {sorted(unknown)}')
+
+        where = ' AND '.join([f'"{name}" GLOB ?' for name in facets]) or '1'
+        query = f'SELECT ds_id FROM "{self._table}" WHERE {where} ORDER BY ds_id'
+
+        return [row[0] for row in self.conn.execute(query, list(facets.values()))]
+
+
+_registers = {}
+
+
+def get_register(project, backend=None):
+    """
+    Returns the register for `project`, shared by all callers in the current process.
+
+    :param project: top-level project.
+    :param backend: (string) either 'json' or 'sqlite', defaults to SETTINGS.REGISTER_BACKEND.
+    :return: register instance.
+    """
+    backend = backend or SETTINGS.REGISTER_BACKEND
+    key = (project, backend, SETTINGS.SQLITE_REGISTER_PATH)
+
+    if key not in _registers:
+        register_classes = {
+            'json': JSONRegister,
+            'sqlite': SQLiteRegister
+        }
+
+        _registers[key] = register_classes[backend](project)
+
+    return _registers[key]
@@ -0,0 +1,192 @@
+"""
+Manifest of the outcome of the latest scan of each dataset.
+
+The manifest is an append-only JSON lines file with one entry per finished scan:
+
+    {"ds_id": <DSID>, "mode": <mode>, "status": <status>, "time": <timestamp>,
+     "fingerprint": <fingerprint of the dataset's files, see `utils.get_fingerprint`>}
+
+where status is 'success' or the class of failure (one of `failure_classes`). The latest
+entry for a DSID wins, so deciding whether a dataset can be skipped, or has failed and
+should be re-run, is a dictionary lookup rather than opening its register record and
+failure logs. Entries are buffered until `flush` and then appended in one write, so
+several worker processes can share a manifest. Callers flush the register before the
+manifest, so the manifest never records a dataset as registered before it is.
+
+The manifest grows with every scan and can be rewritten with only the latest entries
+by `compact`, run explicitly with compact-state.py. Appending and compacting both hold
+an exclusive lock on `<manifest>.lock`, so entries appended by scans that are running
+at the same time are never lost.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+from datetime import datetime
+
+import SETTINGS
+from lib import options
+from lib.writer import make_dirs, write_atomic
+
+
+SUCCESS = 'success'
+
+# Classes of failure: the first three have a failure log of the same name (see scan._get_output_paths)
+failure_classes = ['no_files_error', 'extract_error', 'write_error', 'error', 'crashed']
+
+
+class StateManifest(object):
+
+    def __init__(self, manifest_path):
+        """
+        Scan-state manifest stored as JSON lines at `manifest_path`.
+
+        :param manifest_path: (string) path of the manifest file.
+        """
+        self._manifest_path = manifest_path
+        self._pending = []
+        self._n_lines = 0
+        self._entries = self._load()
+
+    def __str__(self):
+        return self._manifest_path
+
+    def _load(self):
+        entries = {}
+        self._n_lines = 0
+
+        if not os.path.exists(self._manifest_path):
+            return entries
+
+        with open(self._manifest_path) as reader:
+            for line in reader:
+                self._n_lines += 1
+
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a process being killed mid-write
+                    print(f'[WARN] Ignoring unreadable line {self._n_lines} of state manifest: '
+                          f'{self._manifest_path}')
+                    continue
+
+                entries[entry['ds_id']] = entry
+
+        return entries
+
+    def get(self, ds_id):
+        """
+        Returns the latest entry for `ds_id`, or None if it has never been scanned.
+        """
+        return self._entries.get(ds_id)
+
+    def is_complete(self, ds_id, mode, fingerprint=None):
+        """
+        Returns True if the latest scan of `ds_id` succeeded in `mode` or a more complete mode,
+        and (if `fingerprint` is given) its files have not changed since. Entries recorded
+        without a fingerprint are taken to be unchanged.
+        """
+        entry = self._entries.get(ds_id)
+
+        return (entry is not None and entry['status'] == SUCCESS
+                and options.modes.index(entry['mode']) >= options.modes.index(mode)
+                and fingerprint in (None, entry.get('fingerprint', fingerprint)))
+
+    def failed(self):
+        """
+        Returns a sorted list of the DSIDs whose latest scan failed.
+        """
+        return sorted([ds_id for ds_id, entry in self._entries.items() if entry['status'] != SUCCESS])
+
+    def record(self, ds_id, mode, status, fingerprint=None):
+        """
+        Records the outcome of a finished scan of `ds_id`. The entry is written by `flush`.
+
+        :param ds_id: dataset identifier (DSID)
+        :param mode: Scanning mode the dataset was scanned in.
+        :param status: 'success' or one of `failure_classes`.
+        :param fingerprint: fingerprint of the files scanned, OR None if unknown.
+        """
+        if status != SUCCESS and status not in failure_classes:
+            raise ValueError(f'Unknown scan status: {status}')
+
+        entry = {
+            'ds_id': ds_id,
+            'mode': mode,
+            'status': status,
+            'time': datetime.now().isoformat(timespec='seconds')
+        }
+
+        if fingerprint is not None:
+            entry['fingerprint'] = fingerprint
+
+        self._entries[ds_id] = entry
+        self._pending.append(entry)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # Locks a separate file, as compacting replaces the manifest file itself
+        lock_path = f'{self._manifest_path}.lock'
+        make_dirs(lock_path)
+
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def flush(self):
+        """
+        Appends all recorded entries to the manifest in one write.
+        """
+        if not self._pending:
+            return
+
+        with self._locked():
+            with open(self._manifest_path, 'a') as writer:
+                writer.write(''.join([json.dumps(entry) + '\n' for entry in self._pending]))
+
+        self._n_lines += len(self._pending)
+        self._pending.clear()
+
+    def compact(self):
+        """
+        Rewrites the manifest with only the latest entry for each DSID, if at least half
+        of its lines are out of date. The manifest is re-read while holding the lock taken
+        by `flush`, so that no entry appended by another process is lost.
+        """
+        self.flush()
+
+        with self._locked():
+            self._entries = self._load()
+
+            if self._n_lines < 2 * len(self._entries) or not self._entries:
+                return
+
+            write_atomic(self._manifest_path, ''.join([json.dumps(entry) + '\n'
+                                                       for entry in self._entries.values()]))
+            self._n_lines = len(self._entries)
+
+
+_manifests = {}
+
+
+def get_state(project, backend=None):
+    """
+    Returns the scan-state manifest for the register of `project` with `backend`,
+    shared by all callers in the current process.
+
+    :param project: top-level project.
+    :param backend: (string) register backend, defaults to SETTINGS.REGISTER_BACKEND.
+    :return: StateManifest
+    """
+    backend = backend or SETTINGS.REGISTER_BACKEND
+    manifest_path = SETTINGS.STATE_MANIFEST_PATH.format(project=project, backend=backend)
+
+    if manifest_path not in _manifests:
+        _manifests[manifest_path] = StateManifest(manifest_path)
+
+    return _manifests[manifest_path]
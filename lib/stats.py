@@ -0,0 +1,402 @@
+import math
+
+import numpy as np
+
+
+def iter_slabs(shape, itemsize, memory_budget):
+    """
+    Splits an array of `shape` into slabs along its leading dimension(s) so that
+    each slab holds no more than `memory_budget` bytes. If a single index of the
+    leading dimension is already over budget the next dimension is split as well.
+
+    :param shape: (tuple) shape of the array.
+    :param itemsize: (int) number of bytes per array element.
+    :param memory_budget: (int) maximum number of bytes to hold in memory per slab.
+    :return: generator of tuples of slices, one tuple per slab.
+    """
+    if not shape:
+        yield ()
+        return
+
+    row_bytes = itemsize * int(np.prod(shape[1:]))
+
+    if row_bytes > memory_budget and len(shape) > 1:
+        for i in range(shape[0]):
+            for index in iter_slabs(shape[1:], itemsize, memory_budget):
+                yield (slice(i, i + 1),) + index
+        return
+
+    step = max(1, memory_budget // max(row_bytes, 1))
+
+    for start in range(0, shape[0], step):
+        yield (slice(start, min(start + step, shape[0])),)
+
+
+def stratified_sample(n, n_samples, rng):
+    """
+    Splits range(n) into `n_samples` strata of (nearly) equal size and picks one
+    index at random from each, so that the sample is spread evenly over the range.
+
+    :param n: (int) number of items to sample from.
+    :param n_samples: (int) number of items to pick. If n_samples >= n, every item is picked.
+    :param rng: numpy random Generator.
+    :return: sorted list of indices.
+    """
+    if n_samples >= n:
+        return list(range(n))
+
+    edges = (np.arange(n_samples + 1) * n) // n_samples
+    return [int(rng.integers(lo, hi)) for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+def iter_sample_slabs(shape, itemsize, memory_budget, n_blocks, rng, block_length=1):
+    """
+    Splits the leading dimension of an array of `shape` into blocks of `block_length`
+    (e.g. the on-disk chunk length, so that a block is read in whole chunks), picks a
+    stratified sample of `n_blocks` blocks and yields each block as slabs that hold
+    no more than `memory_budget` bytes.
+
+    :param shape: (tuple) shape of the array.
+    :param itemsize: (int) number of bytes per array element.
+    :param memory_budget: (int) maximum number of bytes to hold in memory per slab.
+    :param n_blocks: (int) number of blocks to sample.
+    :param rng: numpy random Generator.
+    :param block_length: (int) length of a block along the leading dimension.
+    :return: generator of tuples of slices, one tuple per slab.
+    """
+    if not shape:
+        yield ()
+        return
+
+    n_total = -(-shape[0] // block_length)
+
+    for block in stratified_sample(n_total, n_blocks, rng):
+        start = block * block_length
+        stop = min(start + block_length, shape[0])
+
+        for index in iter_slabs((stop - start,) + tuple(shape[1:]), itemsize, memory_budget):
+            yield (slice(start + index[0].start, start + index[0].stop),) + index[1:]
+
+
+def slab_size(index, shape):
+    """
+    Returns the number of elements in the slab selected by `index` (a tuple of slices
+    with unit steps, as yielded by `iter_slabs`) from an array of `shape`.
+    """
+    size = 1
+
+    for i, length in enumerate(shape):
+        size *= index[i].stop - index[i].start if i < len(index) else length
+
+    return size
+
+
+def count_blocks(shape, block_length=1):
+    """
+    Returns the number of blocks of `block_length` along the leading dimension of `shape`.
+    """
+    return -(-shape[0] // block_length) if shape else 1
+
+
+def outside_fraction_bound(n_blocks, confidence):
+    """
+    Distribution-free bound on the coverage of a sample min and max: if `n_blocks`
+    blocks are sampled at random, then with probability `confidence` no more than
+    the returned fraction of all blocks hold values above the sample max, and no more
+    than it hold values below the sample min. Each tail exceeds a fraction e with
+    probability (1 - e) ** n <= exp(-e * n), so by the union bound over both tails
+    2 * exp(-e * n) = 1 - confidence.
+
+    :param n_blocks: (int) number of blocks read.
+    :param confidence: (float) between 0 and 1.
+    :return: fraction between 0 and 1.
+    """
+    if n_blocks == 0:
+        return 1.
+
+    return min(1., math.log(2. / (1. - confidence)) / n_blocks)
+
+
+def min_max(slabs):
+    """
+    Reduces an iterable of numpy arrays to a single (min, max) pair, holding
+    only one slab in memory at a time. NaNs propagate in the same way as
+    calling `.min()` and `.max()` on the whole array.
+
+    :param slabs: iterable of numpy arrays.
+    :return: tuple of (min, max) as floats, or (None, None) if there was no data.
+    """
+    mn = mx = None
+
+    for slab in slabs:
+        if slab.size == 0:
+            continue
+
+        slab_mn, slab_mx = slab.min(), slab.max()
+
+        if mx is None:
+            mn, mx = slab_mn, slab_mx
+        else:
+            mn, mx = np.minimum(mn, slab_mn), np.maximum(mx, slab_mx)
+
+    if mx is None:
+        return None, None
+
+    return float(mn), float(mx)
+
+
+class DDSketch(object):
+
+    # Bit layout of the supported float types: (unsigned integer view, mantissa bits, exponent bias)
+    _FLOAT_LAYOUTS = {
+        np.dtype('f4'): ('u4', 23, 127),
+        np.dtype('f8'): ('u8', 52, 1023)
+    }
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        """
+        Mergeable quantile sketch (DDSketch, Masson et al. 2019). Values are counted in
+        logarithmically sized bins, so any quantile is returned to within
+        `relative_accuracy` of a value of that rank, and sketches of separate slabs or
+        files merge into the sketch of all of them by adding bin counts.
+
+        Bins are found from the bits of the floating point values (the exponent and the
+        leading bits of the mantissa), as in the log-linear mapping of the reference
+        implementation, which costs a shift per value instead of a logarithm.
+
+        Bins of the values closest to zero are collapsed if there are more than
+        `max_bins` bins for either sign, which only affects the accuracy of quantiles
+        of those values. Non-finite values are ignored.
+
+        :param relative_accuracy: (float) between 0 and 1.
+        :param max_bins: (int) maximum number of bins per sign.
+        """
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.zero = 0
+        self.positive = {}
+        self.negative = {}
+
+        # Bins of width 2 ** -mantissa_bits relative to their lower bound: the value at
+        # the middle of a bin is within half of that of any value in the bin
+        self._mantissa_bits = max(0, math.ceil(math.log2(1. / (2. * relative_accuracy))))
+
+    @property
+    def count(self):
+        return self.zero + sum(self.positive.values()) + sum(self.negative.values())
+
+    def _collapse(self, store):
+        if len(store) <= self.max_bins:
+            return
+
+        indices = sorted(store)
+        lowest = indices[-self.max_bins]
+        store[lowest] += sum(store.pop(_) for _ in indices[:-self.max_bins])
+
+    def add(self, values):
+        """
+        Adds a numpy array of values to the sketch. Values too small to be represented
+        as normal floating point numbers count as zero.
+        """
+        values = np.ravel(values)
+
+        if values.dtype not in self._FLOAT_LAYOUTS:
+            values = values.astype('f8')
+
+        uint_type, n_mantissa, bias = self._FLOAT_LAYOUTS[values.dtype]
+        n_exponent = values.dtype.itemsize * 8 - 1 - n_mantissa
+        shift = n_mantissa - self._mantissa_bits
+
+        # Dropping the trailing mantissa bits leaves the sign, exponent and leading
+        # mantissa bits of each value: its bin, counted in a single pass
+        keys = np.ascontiguousarray(values).view(uint_type) >> np.array(shift, dtype=uint_type)
+        counts = np.bincount(keys.astype('i8', copy=False))
+
+        sign_bit = 1 << (n_exponent + self._mantissa_bits)
+        not_finite = ((1 << n_exponent) - 1) << self._mantissa_bits
+
+        for key in np.flatnonzero(counts):
+            magnitude = int(key) & (sign_bit - 1)
+            count = int(counts[key])
+
+            if magnitude == 0:
+                self.zero += count
+            elif magnitude < not_finite:
+                store = self.negative if key & sign_bit else self.positive
+                index = magnitude - (bias << self._mantissa_bits)
+                store[index] = store.get(index, 0) + count
+
+        self._collapse(self.positive)
+        self._collapse(self.negative)
+
+    def merge(self, other):
+        """
+        Adds the counts of sketch `other`, which must have the same relative accuracy.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Cannot merge sketches of different relative accuracy')
+
+        self.zero += other.zero
+
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_store.items():
+                store[index] = store.get(index, 0) + count
+
+            self._collapse(store)
+
+    def _value(self, index):
+        exponent, mantissa = index >> self._mantissa_bits, index & ((1 << self._mantissa_bits) - 1)
+        return math.ldexp(1. + (mantissa + 0.5) / (1 << self._mantissa_bits), exponent)
+
+    def quantile(self, q):
+        """
+        Returns the approximate value at quantile `q` (between 0 and 1), or None if the sketch is empty.
+        """
+        count = self.count
+
+        if count == 0:
+            return None
+
+        rank = q * (count - 1)
+        seen = 0
+
+        bins = ([(-self._value(index), self.negative[index]) for index in sorted(self.negative, reverse=True)] +
+                [(0., self.zero)] +
+                [(self._value(index), self.positive[index]) for index in sorted(self.positive)])
+
+        for value, n in bins:
+            seen += n
+
+            if seen > rank:
+                return value
+
+        return bins[-1][0]
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'max_bins': self.max_bins,
+            'zero': self.zero,
+            'positive': {str(k): v for k, v in self.positive.items()},
+            'negative': {str(k): v for k, v in self.negative.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, dct):
+        sketch = cls(dct['relative_accuracy'], dct['max_bins'])
+        sketch.zero = dct['zero']
+        sketch.positive = {int(k): v for k, v in dct['positive'].items()}
+        sketch.negative = {int(k): v for k, v in dct['negative'].items()}
+        return sketch
+
+
+class Summary(object):
+
+    def __init__(self, relative_accuracy=0.01):
+        """
+        Mergeable summary statistics of an array read one slab at a time:
+
+         - min and max, which are NaN if any value is NaN (as in `min_max`)
+         - count, mean and variance of the valid (not NaN) values, merged across
+           slabs with the pairwise update of Chan et al. (1979)
+         - nan_count: number of NaN values, i.e. missing and fill values once decoded
+         - a `DDSketch` of the valid values for approximate quantiles
+
+        :param relative_accuracy: (float) relative accuracy of the quantile sketch.
+        """
+        self.min = self.max = None
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.nan_count = 0
+        self.sketch = DDSketch(relative_accuracy)
+
+    def _merge_min_max(self, mn, mx):
+        if mx is None:
+            return
+
+        if self.max is None:
+            self.min, self.max = mn, mx
+        else:
+            self.min, self.max = float(np.minimum(self.min, mn)), float(np.maximum(self.max, mx))
+
+    def _merge_moments(self, count, mean, m2):
+        if count == 0:
+            return
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def add(self, slab):
+        """
+        Adds the values of a numpy array.
+
+        :param slab: numpy array.
+        """
+        if slab.size == 0:
+            return
+
+        self._merge_min_max(float(slab.min()), float(slab.max()))
+
+        values = slab.ravel()
+
+        if slab.dtype.kind == 'f':
+            nans = np.isnan(values)
+            n_nans = int(np.count_nonzero(nans))
+
+            if n_nans:
+                self.nan_count += n_nans
+                values = values[~nans]
+
+        if values.size:
+            mean = values.mean(dtype='f8')
+            self._merge_moments(values.size, float(mean), float(np.square(values - mean).sum()))
+            self.sketch.add(values)
+
+    def merge(self, other):
+        """
+        Merges the summary `other` of another part of the same array.
+        """
+        self._merge_min_max(other.min, other.max)
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.nan_count += other.nan_count
+        self.sketch.merge(other.sketch)
+
+    def get_info(self, quantiles):
+        """
+        Returns a dictionary of the statistics, with the approximate values at each of
+        `quantiles` keyed by the quantile as a string.
+        """
+        return {
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean if self.count else None,
+            'variance': self.m2 / self.count if self.count else None,
+            'count': self.count,
+            'nan_count': self.nan_count,
+            'quantiles': {str(q): self.sketch.quantile(q) for q in quantiles}
+        }
+
+    def to_dict(self):
+        return {
+            'min': self.min,
+            'max': self.max,
+            'count': self.count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'nan_count': self.nan_count,
+            'sketch': self.sketch.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, dct):
+        summary = cls()
+        summary.min, summary.max = dct['min'], dct['max']
+        summary.count, summary.mean, summary.m2 = dct['count'], dct['mean'], dct['m2']
+        summary.nan_count = dct['nan_count']
+        summary.sketch = DDSketch.from_dict(dct['sketch'])
+        return summary
@@ -1,4 +1,6 @@
+import hashlib
 import os
+import sys
 
 from lib import options
 
@@ -6,14 +8,78 @@ import SETTINGS
 
 
 def get_grouped_ds_id(ds_id):
+    return next(iter_grouped_ds_ids([ds_id]))
 
+
+def iter_grouped_ds_ids(ds_ids):
+    """
+    Generator of the "grouped" ds_id of each of `ds_ids`.
+    """
     # Define a "grouped" ds_id that splits facets across directories and then groups
     # the final set into a file path, based on SETTINGS.DIR_GROUPING_LEVEL value
     gl = SETTINGS.DIR_GROUPING_LEVEL
-    parts = ds_id.split('.')
-    grouped_ds_id = '/'.join(parts[:-gl]) + '/' + '.'.join(parts[-gl:])
 
-    return grouped_ds_id
+    for ds_id in ds_ids:
+        parts = ds_id.split('.')
+        yield '/'.join(parts[:-gl]) + '/' + '.'.join(parts[-gl:])
+
+
+def iter_arg_items(value):
+    """
+    Generator of the items of a command line argument, which is either a comma-separated
+    list, "@<path>" to read items from a file, or "-" to read them from standard input.
+    Files and standard input hold one or more comma-separated items per line, and are
+    read lazily so that the items can be used before they have all been read.
+
+    :param value: (string) argument value.
+    :return: generator of non-empty items.
+    """
+    if value == '-':
+        lines = sys.stdin
+    elif value.startswith('@'):
+        lines = _iter_lines(value[1:])
+    else:
+        lines = [value]
+
+    for line in lines:
+        for item in line.strip().split(','):
+            if item.strip():
+                yield item.strip()
+
+
+def _iter_lines(path):
+    with open(path) as reader:
+        yield from reader
+
+
+def get_facets(project, ds_id):
+    """
+    Returns a dictionary of {<facet name>: <facet value>} for a dataset identifier.
+
+    :param project: top-level project
+    :param ds_id: dataset identifier (DSID)
+    :return: dictionary of facets.
+    """
+    facet_names = options.facet_rules[project]
+    return dict(zip(facet_names, ds_id.split('.')))
+
+
+def get_fingerprint(file_paths):
+    """
+    Returns a fingerprint of a dataset built from the name, size and modification time
+    of each of its files (using `stat` only), which changes if a file is added, replaced,
+    modified or retracted.
+
+    :param file_paths: sequence of the paths of the dataset's files.
+    :return: (string) hexadecimal digest.
+    """
+    digest = hashlib.sha1()
+
+    for path in sorted(file_paths):
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+
+    return digest.hexdigest()
 
 
 def switch_ds(project, ds):
@@ -24,10 +90,19 @@ def switch_ds(project, ds):
     :param ds: either dataset path or dataset ID (DSID)
     :return: either dataset path or dataset ID (DSID) - switched from the input.
     """
+    return next(iter_switch_ds(project, [ds]))[1]
+
+
+def iter_switch_ds(project, items):
+    """
+    Generator of (<item>, <switched item>) pairs, switching each of `items` between
+    dataset path and dataset ID as `switch_ds` does.
+    """
     base_dir = options.project_base_dirs[project]
 
-    if ds.startswith('/'):
-        return '.'.join(ds.replace(base_dir, '').strip('/').split('/'))
-    else:
-        return os.path.join(base_dir, '/'.join(ds.split('.')))
+    for ds in items:
+        if ds.startswith('/'):
+            yield ds, '.'.join(ds.replace(base_dir, '').strip('/').split('/'))
+        else:
+            yield ds, os.path.join(base_dir, ds.replace('.', '/'))
 
@@ -0,0 +1,88 @@
+"""
+Writes the output files of a scan.
+
+ - `make_dirs` makes the parent directory of an output file, remembering the
+   directories it has made so that each is only checked once per process.
+ - `write_atomic` writes a file to a temporary path beside it and renames it into
+   place, so that a reader (or a scan that is killed) never leaves a half-written file.
+ - `write_many` writes a batch of files concurrently in a pool of threads.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import SETTINGS
+
+
+# Directories this process has made or found
+_made_dirs = set()
+
+
+def make_dirs(path):
+    """
+    Makes the parent directory of `path` if this process has not already made it.
+    """
+    dr = os.path.dirname(path)
+
+    if dr and dr not in _made_dirs:
+        os.makedirs(dr, exist_ok=True)
+        _made_dirs.add(dr)
+
+
+def dumps_json(content, compact=None):
+    """
+    Serialises `content` to JSON with sorted keys.
+
+    :param compact: if True, without indentation or spaces after separators, OR None
+                    to use SETTINGS.COMPACT_JSON.
+    """
+    if compact is None:
+        compact = SETTINGS.COMPACT_JSON
+
+    if compact:
+        return json.dumps(content, sort_keys=True, separators=(',', ':'))
+
+    return json.dumps(content, indent=4, sort_keys=True)
+
+
+def write_atomic(path, text):
+    """
+    Writes `text` to the file at `path`, making its directory if needed, by writing
+    a temporary file and renaming it to `path`.
+    """
+    make_dirs(path)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    try:
+        writer = open(tmp_path, 'w')
+    except FileNotFoundError:
+        # The directory was removed since it was made
+        _made_dirs.discard(os.path.dirname(path))
+        make_dirs(path)
+        writer = open(tmp_path, 'w')
+
+    try:
+        with writer:
+            writer.write(text)
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_many(texts, threads=None):
+    """
+    Writes each file in `texts`, a dictionary of {<path>: <text>}, with `write_atomic`,
+    in a pool of `threads` threads (defaults to SETTINGS.WRITE_THREADS).
+    """
+    if len(texts) <= 1:
+        for path, text in texts.items():
+            write_atomic(path, text)
+        return
+
+    with ThreadPoolExecutor(max_workers=threads or SETTINGS.WRITE_THREADS) as executor:
+        # Consume the results so that the first failure is raised
+        list(executor.map(write_atomic, texts.keys(), texts.values()))
@@ -12,10 +12,20 @@ import collections
 import os
 import glob
 import argparse
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import SETTINGS
-from lib import options, utils
+from lib import discovery, options, utils
+from lib.cache import FileFactsCache
 from lib.character import extract_character
+from lib.lease import Leases
+from lib.metrics import ScanMetrics, print_report, write_metrics
+from lib.register import backends, get_register
+from lib.state import SUCCESS, get_state
+from lib.writer import make_dirs
 
 
 def _get_arg_parser():
@@ -27,6 +37,7 @@ def _get_arg_parser():
     parser = argparse.ArgumentParser()
     project_options = options.known_projects
     location_options = options.locations
+    register_backends = backends
 
     parser.add_argument(
         "project",
@@ -43,7 +54,8 @@ def _get_arg_parser():
         type=str,
         default=None,
         required=False,
-        help='List of comma-separated dataset identifiers'
+        help='List of comma-separated dataset identifiers, OR @<file> to read them from a file '
+             '(one or more per line), OR - to read them from standard input'
     )
 
     parser.add_argument(
@@ -53,7 +65,8 @@ def _get_arg_parser():
         type=str,
         default=None,
         required=False,
-        help='List of comma-separated directories to search'
+        help='List of comma-separated directories to search, OR @<file> to read them from a file '
+             '(one or more per line), OR - to read them from standard input'
     )
 
     parser.add_argument(
@@ -81,10 +94,12 @@ def _get_arg_parser():
         "--mode",
         nargs=1,
         type=str,
-        default="quick",
+        default=["quick"],
         required=False,
-        help='Scanning mode: can be either quick or full. A full scan returns '
-             'max and min values while a quick scan excludes them. Defaults to quick.'
+        choices=options.modes,
+        help='Scanning mode: one of quick, estimate or full. A full scan returns '
+             'max and min values while a quick scan excludes them. An estimate scan '
+             'estimates them from a sample of the data. Defaults to quick.'
     )
 
     parser.add_argument(
@@ -98,6 +113,53 @@ def _get_arg_parser():
         help=f'Location of scan, must be one of: {location_options}'
     )
 
+    parser.add_argument(
+        "-r",
+        "--register",
+        nargs=1,
+        type=str,
+        default=[SETTINGS.REGISTER_BACKEND],
+        required=False,
+        choices=register_backends,
+        help=f'Register backend to write to, must be one of: {register_backends}. '
+             f'Defaults to {SETTINGS.REGISTER_BACKEND}.'
+    )
+
+    parser.add_argument(
+        "--from-register",
+        action="store_true",
+        help='Select the datasets matching the facets (-f) from the register, instead of '
+             'searching the archive. Useful for re-scanning registered datasets.'
+    )
+
+    parser.add_argument(
+        "--only-failed",
+        action="store_true",
+        help='Only re-scan the datasets whose latest scan failed, according to the state manifest. '
+             'If no datasets, paths or facets are given, every failed dataset is re-scanned.'
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        nargs=1,
+        type=int,
+        default=[1],
+        required=False,
+        help='Number of worker processes used to scan datasets in parallel. Defaults to 1.'
+    )
+
+    parser.add_argument(
+        "--coordinate",
+        nargs=1,
+        type=str,
+        default=None,
+        required=False,
+        help='Name of a run shared with other scans of the same selection (e.g. on other nodes): '
+             'each dataset is claimed through a lease file on the output directory, so that '
+             'it is scanned by only one of them.'
+    )
+
     return parser
 
 
@@ -106,6 +168,12 @@ def _to_list(item):
     return item[0].split(',')
 
 
+def _to_items(item):
+    # Lazy, as the items may be read from a file or standard input
+    if not item: return item
+    return utils.iter_arg_items(item[0])
+
+
 def _to_dict(item):
     if not item: return item
     return dict([_.split('=') for _ in item[0].split(',')])
@@ -116,55 +184,61 @@ def parse_args():
     args = parser.parse_args()
 
     project = args.project[0]
-    ds_ids = _to_list(args.dataset_ids)
-    paths = _to_list(args.paths)
+    ds_ids = _to_items(args.dataset_ids)
+    paths = _to_items(args.paths)
     facets = _to_dict(args.facets)
     exclude = _to_list(args.exclude)
     mode = args.mode[0]
     location = args.location[0]
+    workers = args.workers[0]
+    backend = args.register[0]
+    from_register = args.from_register
+    only_failed = args.only_failed
+    coordinate = args.coordinate[0] if args.coordinate else None
 
-    return project, ds_ids, paths, facets, exclude, mode, location
+    return (project, ds_ids, paths, facets, exclude, mode, location, workers, backend, from_register,
+            only_failed, coordinate)
 
 
-def to_json(character, output_path):
+def _iter_ds_paths(project, facets, exclude=None):
     """
-    Outputs the extracted characteristics to a JSON file.
-    If the characteristics can't be output an error file is produced.
+    Generator of (<ds_id>, <ds_path>) pairs for the dataset directories matching `facets`,
+    a dictionary of {<facet name>: <glob pattern>}, as they are found. Facets not given
+    match anything.
 
-    :param character: (dict) The extracted characteristics.
-    :param output_path: (string) The file path at which the JSON file is produced.
-    :return : None
+    :param project: top-level project
+    :param facets: dictionary of facet patterns.
+    :param exclude: compiled regular expression of paths to prune, OR None.
     """
-    # Output to JSON file
-    with open(output_path, 'w') as writer:
-        json.dump(character, writer, indent=4, sort_keys=True)
+    base_dir = options.project_base_dirs[project]
+    facet_patterns = [facets.get(_, '*') for _ in options.facet_rules[project]]
+
+    pattern = os.path.join(base_dir, *facet_patterns)
+    print(f'[INFO] Finding dataset paths for pattern: {pattern}')
+
+    for ds_path in discovery.iter_dataset_paths(base_dir, facet_patterns, exclude=exclude):
+        yield utils.switch_ds(project, ds_path), ds_path
 
 
-def _get_ds_paths_from_paths(paths, project):
+def _iter_ds_paths_from_paths(paths, project, exclude=None):
     """
-    Return an OrderedDict of {<ds_id>: <ds_path>} found under the paths provided
-    as `paths` (a sequence of directory/file paths).
+    Generator of (<ds_id>, <ds_path>) pairs for the datasets found under the paths
+    provided as `paths` (an iterable of directory/file paths).
 
-    :param paths: (sequence) directory/file paths
+    :param paths: (iterable) directory/file paths
     :param project: top-level project, e.g. "cmip5", "cmip6" or "cordex" (case-insensitive) 
-    :return: OrderedDict of {<ds_id>: <ds_path>}
+    :param exclude: compiled regular expression of paths to prune, OR None.
     """
     base_dir = options.project_base_dirs[project]
 
-    # Check paths first
-    bad_paths = []
-
-    for pth in paths:
-        if not pth.startswith(base_dir):
-            bad_paths.append(pth)
-
-    if bad_paths:
-        raise Exception(f'Invalid paths provided: {bad_paths}')
-
-    
-    ds_paths = collections.OrderedDict()
+    # Paths may overlap, so only yield each dataset once
+    seen = set()
     
     for pth in paths:
+
+        # Checked as they are read, as paths may be streamed from a file
+        if not pth.startswith(base_dir):
+            raise Exception(f'Invalid paths provided: {[pth]}')
         
         print(f'[INFO] Searching for datasets under: {pth}')
         facet_order = options.facet_rules[project]
@@ -188,126 +262,450 @@ def _get_ds_paths_from_paths(paths, project):
         if '/files' in facets_as_path:
             continue
 
-        #TODO: This is repet code of below. Suggest we create a module/class
-        #      to manage all mapping of different args to resolve to ds_paths dictionary, later.
-        pattern = os.path.join(base_dir, facets_as_path)
-        print(f'[INFO] Finding dataset paths for pattern: {pattern}')
+        for dsid, ds_path in _iter_ds_paths(project, facets, exclude=exclude):
+            if dsid not in seen:
+                seen.add(dsid)
+                yield dsid, ds_path
 
-        for ds_path in glob.glob(pattern):
-            dsid = utils.switch_ds(project, ds_path)
-            ds_paths[dsid] = ds_path
 
-    return ds_paths
-
-
-def get_dataset_paths(project, ds_ids=None, paths=None, facets=None, exclude=None):
+def iter_dataset_paths(project, ds_ids=None, paths=None, facets=None, exclude=None):
     """
-    Converts the input arguments into an Ordered Dictionary of {DSID: directory} items.
+    Converts the input arguments into (DSID, directory) pairs, yielded as each dataset
+    is found so that scanning can start before discovery has finished.
 
     :param project: top-level project, e.g. "cmip5", "cmip6" or "cordex" (case-insensitive)
-    :param ds_ids: sequence of dataset identifiers (DSIDs), OR None.
-    :param paths: sequence of file paths to scan for NetCDF files under, OR None.
+    :param ds_ids: iterable of dataset identifiers (DSIDs), OR None.
+    :param paths: iterable of file paths to scan for NetCDF files under, OR None.
     :param facets: dictionary of facet values to limit the search, OR None.
     :param exclude: list of regular expressions to exclude in file paths, OR None.
+                    A dataset is excluded if any pattern is found in its directory
+                    path, or the path of one of its parent directories, ending in '/'.
 
-    :return: An Ordered Dictionary of {dsid: directory}
+    :return: generator of (dsid, directory) pairs.
     """
     base_dir = options.project_base_dirs[project]
-    ds_paths = collections.OrderedDict()
+    exclude = discovery.compile_exclude(exclude)
 
     # If ds_ids is defined then ignore all other arguments and use this list
     if ds_ids:
 
-        for dsid in ds_ids:
-            if not dsid: continue
+        for dsid, ds_path in utils.iter_switch_ds(project, (_ for _ in ds_ids if _)):
 
-            ds_path = utils.switch_ds(project, dsid)
-            ds_paths[dsid] = ds_path
+            if discovery.is_excluded(exclude, ds_path, base_dir):
+                continue
+
+            yield dsid, ds_path
 
     # Else use facets if they exist
     elif facets:
 
-        facet_order = options.facet_rules[project]
-        facets_as_path = '/'.join([facets.get(_, '*') for _ in facet_order])
-
-        pattern = os.path.join(base_dir, facets_as_path)
-        print(f'[INFO] Finding dataset paths for pattern: {pattern}')
-
-        for ds_path in glob.glob(pattern):
-            dsid = utils.switch_ds(project, ds_path)
-            ds_paths[dsid] = ds_path
+        yield from _iter_ds_paths(project, facets, exclude=exclude)
 
     elif paths:
  
-        ds_paths = _get_ds_paths_from_paths(paths, project)
+        yield from _iter_ds_paths_from_paths(paths, project, exclude=exclude)
 
     else:
         raise NotImplementedError('Code currently breaks if not using "ds_ids" argument.')
 
-    return ds_paths
 
+def get_dataset_paths(project, ds_ids=None, paths=None, facets=None, exclude=None):
+    """
+    Converts the input arguments into an Ordered Dictionary of {DSID: directory} items,
+    see `iter_dataset_paths`.
+
+    :return: An Ordered Dictionary of {dsid: directory}
+    """
+    return collections.OrderedDict(iter_dataset_paths(project, ds_ids=ds_ids, paths=paths, facets=facets,
+                                                      exclude=exclude))
+
+
+def iter_selected_dataset_paths(project, ds_ids=None, paths=None, facets=None, exclude=None,
+                                backend=None, from_register=False, only_failed=False):
+    """
+    Selects the datasets to scan, as `iter_dataset_paths` does, with two optional filters.
+
+    :param from_register: if True, `facets` are matched against datasets already in the
+                          register instead of searching the archive.
+    :param only_failed: if True, only datasets whose latest scan failed are selected,
+                        from the state manifest. If no `ds_ids`, `paths` or `facets`
+                        are given, every failed dataset is selected.
+    :return: generator of (dsid, directory) pairs.
+    """
+    if from_register:
+        register = get_register(project, backend)
+        ds_ids = register.select(facets or {})
+        print(f'[INFO] Selected {len(ds_ids)} datasets from register: {register}')
+
+        if not ds_ids:
+            return
+
+        paths = facets = None
+
+    if only_failed:
+        state = get_state(project, backend)
+        failed = set(state.failed())
+        print(f'[INFO] Found {len(failed)} failed datasets in state manifest: {state}')
+
+        if not (ds_ids or paths or facets):
+            ds_ids = sorted(failed)
+
+        if not ds_ids and not (paths or facets):
+            return
+
+    for ds_id, ds_path in iter_dataset_paths(project, ds_ids=ds_ids, paths=paths, facets=facets,
+                                             exclude=exclude):
+        if not only_failed or ds_id in failed:
+            yield ds_id, ds_path
+
+
+def select_dataset_paths(project, ds_ids=None, paths=None, facets=None, exclude=None,
+                         backend=None, from_register=False, only_failed=False):
+    """
+    Selects the datasets to scan as an Ordered Dictionary of {DSID: directory} items,
+    see `iter_selected_dataset_paths`.
+
+    :return: An Ordered Dictionary of {dsid: directory}
+    """
+    return collections.OrderedDict(iter_selected_dataset_paths(project, ds_ids=ds_ids, paths=paths, facets=facets,
+                                                               exclude=exclude, backend=backend,
+                                                               from_register=from_register,
+                                                               only_failed=only_failed))
+
+
+def _flush(project, backend=None):
+    # The register is flushed before the state manifest so that the manifest never
+    # records a dataset as registered before its record is written
+    get_register(project, backend).flush()
+    get_state(project, backend).flush()
+
+
+def _extract_dataset_safely(project, ds_id, ds_path, mode, location, **kwargs):
+    """
+    Calls `extract_dataset` but turns any unexpected exception into a failed outcome so
+    that one bad dataset cannot stop the remaining datasets from being scanned.
+
+    :return: outcome dictionary (see `extract_dataset`), with the timings of each phase
+             of the extraction under 'phases' (see lib.metrics.ScanMetrics.to_dict).
+    """
+    metrics = ScanMetrics()
+
+    try:
+        outcome = extract_dataset(project, ds_id, ds_path, mode, location, metrics=metrics, **kwargs)
+    except Exception as exc:
+        print(f'[ERROR] Unexpected error scanning: {ds_id}')
+        print(f'[ERROR] Exception was: {exc}')
+        outcome = _get_outcome(ds_id, mode, 'error', error=str(exc))
+
+    outcome['phases'] = metrics.to_dict()
+    return outcome
+
+
+def _discover(tasks, task_queue, errors):
+    # Discovery stage: queues each task as soon as its dataset is found
+    try:
+        for task in tasks:
+            task_queue.put(task)
+    except Exception as exc:
+        errors.append(exc)
+    finally:
+        task_queue.put(None)
+
+
+def _iter_queue(task_queue):
+    while True:
+        task = task_queue.get()
+
+        if task is None:
+            return
+
+        yield task
+
+
+def _extract_in_thread(tasks, outcome_queue, slots, **kwargs):
+    # Extraction stage with one worker: extracts each task in this thread
+    n_tasks = 0
+
+    try:
+        for task in tasks:
+            slots.acquire()
+            n_tasks += 1
+            outcome_queue.put(('outcome', task, _extract_dataset_safely(*task, **kwargs)))
+    finally:
+        outcome_queue.put(('done', n_tasks, None))
+
+
+def _init_worker():
+    # The worker processes already extract several datasets at once, so the files of
+    # each dataset are read one at a time rather than in a pool of their own
+    SETTINGS.FILE_WORKERS = 1
+
+
+def _extract_in_pool(tasks, workers, outcome_queue, slots, **kwargs):
+    """
+    Extraction stage with a pool of `workers` processes: submits each task as it arrives
+    and queues its outcome as soon as it completes.
+
+    If a worker process dies (e.g. a segfault in a C library) the pool is broken and
+    every dataset in flight fails with it. Those tasks are queued as 'broken', to be
+    re-run one at a time once the pool has shut down (see `_iter_outcomes`), and the
+    pool is replaced so that the tasks that arrive later are extracted as usual.
+    """
+    def queue_outcome(task, future):
+        # Exactly one outcome is queued per task, as an exception raised here would be
+        # swallowed by the executor and the writing stage would wait for it forever
+        try:
+            outcome = future.result()
+        except BrokenProcessPool:
+            outcome_queue.put(('broken', task, None))
+            return
+        except Exception as exc:
+            # e.g. the outcome could not be unpickled, or the future was cancelled
+            print(f'[ERROR] Could not get the outcome of scanning: {task[1]}')
+            print(f'[ERROR] Exception was: {exc!r}')
+            outcome = dict(_get_outcome(task[1], task[3], 'error', error=repr(exc)), phases={})
+
+        outcome_queue.put(('outcome', task, outcome))
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    n_tasks = 0
+    executor = new_pool()
+
+    try:
+        for task in tasks:
+            slots.acquire()
+            n_tasks += 1
+
+            try:
+                future = executor.submit(_extract_dataset_safely, *task, **kwargs)
+            except BrokenProcessPool:
+                # The tasks in flight have failed with the broken pool (see queue_outcome)
+                executor.shutdown(wait=False)
+                executor = new_pool()
+                future = executor.submit(_extract_dataset_safely, *task, **kwargs)
+
+            future.add_done_callback(lambda future, task=task: queue_outcome(task, future))
+    finally:
+        executor.shutdown()
+        outcome_queue.put(('done', n_tasks, None))
+
+
+def _iter_outcomes(tasks, workers, **kwargs):
+    """
+    Generator that runs the discovery and extraction stages of the scanning pipeline
+    in background threads, yielding (task, outcome) pairs to the writing stage as
+    each dataset is extracted.
+
+    Discovery and extraction are connected by a queue of at most SETTINGS.PIPELINE_QUEUE_SIZE
+    tasks, and at most that many outcomes (plus the datasets being extracted) wait to be
+    written, so that a slow stage holds back the others instead of filling memory.
+
+    :param tasks: iterable of argument tuples: (project, ds_id, ds_path, mode, location)
+    :param workers: number of worker processes, OR 1 to extract in a thread of this process.
+    :param kwargs: keyword arguments passed on to `extract_dataset`.
+    """
+    task_queue = queue.Queue(maxsize=SETTINGS.PIPELINE_QUEUE_SIZE)
+    outcome_queue = queue.Queue()
+    slots = threading.Semaphore(workers + SETTINGS.PIPELINE_QUEUE_SIZE)
+    errors = []
+
+    if workers > 1:
+        extract, args = _extract_in_pool, (_iter_queue(task_queue), workers, outcome_queue, slots)
+    else:
+        extract, args = _extract_in_thread, (_iter_queue(task_queue), outcome_queue, slots)
+
+    stages = [threading.Thread(target=_discover, args=(tasks, task_queue, errors), daemon=True),
+              threading.Thread(target=extract, args=args, kwargs=kwargs, daemon=True)]
+
+    for stage in stages:
+        stage.start()
+
+    n_tasks, n_done = None, 0
+    broken = []
 
-def scan_datasets(project, mode, location, ds_ids=None, paths=None, facets=None, exclude=None):
+    while n_tasks is None or n_done < n_tasks:
+        kind, task, outcome = outcome_queue.get()
+
+        if kind == 'done':
+            n_tasks = task
+            continue
+
+        n_done += 1
+        slots.release()
+
+        if kind == 'broken':
+            broken.append(task)
+        else:
+            yield task, outcome
+
+    for stage in stages:
+        stage.join()
+
+    if errors:
+        raise errors[0]
+
+    for task in broken:
+        print(f'[WARN] Worker pool crashed, re-running in isolation: {task[1]}')
+
+        with ProcessPoolExecutor(max_workers=1, initializer=_init_worker) as executor:
+            try:
+                outcome = executor.submit(_extract_dataset_safely, *task, **kwargs).result()
+            except BrokenProcessPool:
+                print(f'[ERROR] Worker process crashed while scanning: {task[1]}')
+                outcome = dict(_get_outcome(task[1], task[3], 'crashed'), phases={})
+
+        yield task, outcome
+
+
+def _write_outcomes(project, tasks, workers, backend=None, leases=None):
+    """
+    Writing stage of the scanning pipeline: writes the outcome of each task as it is
+    extracted (see `_iter_outcomes`), flushing the register and state manifest every
+    SETTINGS.REGISTER_BATCH_SIZE datasets. If `leases` are given, an outcome is only
+    written while its lease is held, and leases are released as done once flushed.
+
+    :return: tuple of (<results dictionary, as returned by `scan_datasets`>,
+                       <dictionary of {<ds_id>: <phases>} of the datasets scanned>)
+    """
+    results = {'success': [], 'failed': []}
+    all_phases = {}
+    written = []
+
+    def flush():
+        _flush(project, backend)
+
+        if leases is not None:
+            leases.release(written)
+
+        written.clear()
+
+    for task, outcome in _iter_outcomes(tasks, workers, backend=backend):
+        ds_id = task[1]
+        metrics = ScanMetrics.from_dict(outcome.pop('phases'))
+
+        if leases is not None and not leases.holds(ds_id):
+            print(f'[WARN] Lease was taken over by another scan, not writing: {ds_id}')
+            continue
+
+        if write_outcome(project, outcome, backend=backend, metrics=metrics):
+            results['success'].append(ds_id)
+        else:
+            results['failed'].append(ds_id)
+
+        written.append(ds_id)
+        phases = metrics.to_dict()
+
+        # Datasets skipped as already scanned are not reported
+        if phases and not outcome['skipped']:
+            all_phases[ds_id] = phases
+
+            if SETTINGS.WRITE_METRICS:
+                write_metrics(SETTINGS.METRICS_PATH.format(project=project), ds_id, outcome['mode'],
+                              get_state(project, backend).get(ds_id)['status'], phases)
+
+        n_done = len(results['success']) + len(results['failed'])
+
+        if n_done % SETTINGS.REGISTER_BATCH_SIZE == 0:
+            flush()
+
+    flush()
+    return results, all_phases
+
+
+def scan_datasets(project, mode, location, ds_ids=None, paths=None, facets=None, exclude=None,
+                  workers=1, backend=None, from_register=False, only_failed=False, coordinate=None):
     """
     Loops over ESGF data sets and scans them for character.
 
     Scans multiple ESGF Datasets found for a given `project` based on a combination of:
-     - ds_ids: sequence of dataset identifiers (DSIDs)
-     - paths: sequence of file paths to scan for NetCDF files under
+     - ds_ids: iterable of dataset identifiers (DSIDs), which may be streamed
+     - paths: iterable of file paths to scan for NetCDF files under, which may be streamed
      - facets: dictionary of facet values to limit the search
      - exclude: list of regular expressions to exclude in file paths
 
-    The scanned datasets are characterised and the output is written to a JSON file
+    The scanned datasets are characterised and the output is written to the register
     if no errors occurred.
 
+    Scanning is a pipeline of three stages that run at the same time: datasets are
+    discovered in a background thread, extracted in a pool of worker processes (or a
+    background thread if `workers` is 1) as soon as they are found, and each outcome
+    is written to the register by this process as soon as it is extracted.
+
+    Several scans of the same selection (e.g. on different batch nodes) can share the
+    work by passing the same `coordinate` run name: each dataset is claimed through a
+    lease file before it is extracted and marked done once its outcome has been written
+    and flushed, so that it is scanned by only one of them (see lib.lease).
+
     Keeps track of whether the job was successful or not.
     Produces error files if an error occurs, otherwise produces a success file.
+    Ends with a report of percentiles of the time spent in each phase of the scans.
 
     :param project: top-level project, e.g. "cmip5", "cmip6" or "cordex" (case-insensitive)
-    :param ds_ids: sequence of dataset identifiers (DSIDs), OR None.
-    :param paths: sequence of file paths to scan for NetCDF files under, OR None.
+    :param ds_ids: iterable of dataset identifiers (DSIDs), OR None.
+    :param paths: iterable of file paths to scan for NetCDF files under, OR None.
     :param facets: dictionary of facet values to limit the search, OR None.
     :param exclude: list of regular expressions to exclude in file paths, OR None.
-    :param mode: Scanning mode: can be either quick or full. A full scan returns
+    :param mode: Scanning mode: one of quick, estimate or full. A full scan returns
                  max and min values while a quick scan excludes them. Default is quick.
+    :param workers: number of worker processes to extract datasets with. If 1 (the default)
+                    datasets are extracted one at a time in a thread of the current process.
+    :param backend: register backend, either 'json' or 'sqlite'. Defaults to SETTINGS.REGISTER_BACKEND.
+    :param from_register: if True, `facets` are matched against datasets already in the
+                          register instead of searching the archive.
+    :param only_failed: if True, only re-scan datasets whose latest scan failed.
+    :param coordinate: (string) run name shared with other scans of the same selection, OR None.
     :return: Dictionary of {"success": list of DSIDs that were successfully scanned,
                             "failed": list of DSIDs that failed to scan}
+                            (only those claimed by this scan, if coordinating)
     """
-    # Keep track of failures
-    count = 0
-    failure_count = 0
+    # Filter arguments to get a stream of file paths to DSIDs
+    ds_paths = iter_selected_dataset_paths(project, ds_ids=ds_ids, paths=paths, facets=facets, exclude=exclude,
+                                           backend=backend, from_register=from_register,
+                                           only_failed=only_failed)
+
+    leases = Leases(coordinate) if coordinate else None
 
-    # Filter arguments to get a set of file paths to DSIDs
-    ds_paths = get_dataset_paths(project, ds_ids=ds_ids, paths=paths, facets=facets, exclude=exclude)
+    if leases is not None:
+        ds_paths = ((ds_id, ds_path) for ds_id, ds_path in ds_paths if leases.claim(ds_id))
+        leases.start()
 
-    for ds_id, ds_path in ds_paths.items():
-        scanner = scan_dataset(project, ds_id, ds_path, mode, location)
+    tasks = ((project, ds_id, ds_path, mode, location) for ds_id, ds_path in ds_paths)
 
-        count += 1
-        if scanner is False:
-            failure_count += 1
+    try:
+        results, all_phases = _write_outcomes(project, tasks, workers, backend, leases)
+    finally:
+        if leases is not None:
+            leases.stop()
 
-    percentage_failed = (failure_count / float(count)) * 100
+    count = len(results['success']) + len(results['failed'])
+    failure_count = len(results['failed'])
+    percentage_failed = (failure_count / float(count)) * 100 if count else 0.
 
     print(f'[INFO] COMPLETED. Total count: {count}'
           f', Failure count = {failure_count}. Percentage failed'
           f' = {percentage_failed:.2f}%')
 
+    print_report(all_phases)
+
+    return results
+
 
 def _get_output_paths(project, ds_id):
     """
-    Return a dictionary of output paths to write JSON output, success and failure files to.
-    Make each parent directory of not already there.
+    Return a dictionary of output paths to write the file cache, success and failure files to.
+    Make each parent directory if not already made by this process.
 
     :param project: top-level project.
     :param ds_id: Dataset Identifier (DSID)
     :return: dictionary of output paths with keys:
-             'success', 'json', 'no_files_error', 'extract_error', 'write_error', 'batch'
+             'success', 'cache', 'no_files_error', 'extract_error', 'write_error', 'batch'
     """
     grouped_ds_id = utils.get_grouped_ds_id(ds_id)
 
     paths = {
-        'json': SETTINGS.JSON_OUTPUT_PATH.format(**vars()),
+        'cache': SETTINGS.FILE_CACHE_PATH.format(**vars()),
         'no_files_error': SETTINGS.NO_FILES_PATH.format(**vars()),
         'extract_error': SETTINGS.EXTRACT_ERROR_PATH.format(**vars()),
         'write_error': SETTINGS.WRITE_ERROR_PATH.format(**vars()),
@@ -316,10 +714,7 @@ def _get_output_paths(project, ds_id):
 
     # Make directories if not already there
     for pth in paths.values():
-        dr = os.path.dirname(pth)
-
-        if not os.path.isdir(dr):
-            os.makedirs(dr)
+        make_dirs(pth)
 
     return paths
 
@@ -331,133 +726,258 @@ def analyse_facets(project, ds_id):
     :param ds_id:
     :return:
     """
-    facet_names = options.facet_rules[project]
-    facet_values = ds_id.split('.')
+    return utils.get_facets(project, ds_id)
 
-    return dict(zip(facet_names, facet_values))
 
+def _check_for_min_max(record):
+    return record["data"]["max"] is not None and record["data"]["min"] is not None
 
-def is_registered(json_path):
-    if os.path.exists(json_path):
-        return True
-    else:
-        return False
 
+def _is_complete(record, mode, fingerprint=None):
+    """
+    Returns True if a registered `record` already holds everything a scan in `mode` would produce,
+    and (if `fingerprint` is given) was made from the same files. Records without a
+    fingerprint are taken to be unchanged.
+    """
+    recorded_mode = record["scan_metadata"]["mode"]
 
-def _check_for_min_max(json_path):
-    data = json.load(open(json_path))
-    mx = data["data"]["max"]
-    mn = data["data"]["min"]
-    if mx and mn:
-        return True
-    else:
+    if options.modes.index(recorded_mode) < options.modes.index(mode):
+        return False
+
+    if fingerprint is not None and record["scan_metadata"].get("fingerprint", fingerprint) != fingerprint:
         return False
 
+    if recorded_mode != 'quick':
+        return _check_for_min_max(record)
 
-def scan_dataset(project, ds_id, ds_path, mode, location):
+    return True
+
+
+def _get_outcome(ds_id, mode, status, character=None, error=None, skipped=False, fingerprint=None,
+                 corrupt_record=False):
+    return {
+        'ds_id': ds_id,
+        'mode': mode,
+        'status': status,
+        'character': character,
+        'error': error,
+        'skipped': skipped,
+        'fingerprint': fingerprint,
+        'corrupt_record': corrupt_record
+    }
+
+
+def extract_dataset(project, ds_id, ds_path, mode, location, backend=None, metrics=None):
     """
-    Scans a set of files found under the `ds_path`.
+    Extraction stage of scanning a set of files found under the `ds_path`: checks
+    whether the dataset is already registered, from the same files, and otherwise
+    extracts its character.
 
-    The scanned datasets are characterised and the output is written to a JSON file
-    if no errors occurred.
+    Whether the files have changed is decided by comparing the fingerprint of the
+    files (see `utils.get_fingerprint`) with the one recorded by the previous scan, so
+    a dataset is rescanned (in any mode) if files were added, replaced or retracted.
 
-    Keeps track of whether the job was successful or not.
-    Produces error files if an error occurs, otherwise produces a success file.
+    Nothing is written to the register, the state manifest or the failure logs, so
+    this can run in a worker process while `write_outcome` writes earlier outcomes.
 
     :param project: top-level project, e.g. "cmip5", "cmip6" or "cordex" (case-insensitive)
     :param ds_id: dataset identifier (DSID)
     :param ds_path: directory under which to scan data files.
-    :param mode: Scanning mode: can be either quick or full. A full scan returns
-                 max and min values while a quick scan excludes them. Defaults to quick.'
-    :return: Boolean - indicating success of failure of scan.
+    :param mode: Scanning mode: one of quick, estimate or full.
+    :param backend: register backend, either 'json' or 'sqlite'. Defaults to SETTINGS.REGISTER_BACKEND.
+    :param metrics: (ScanMetrics) collects the time and bytes read in each phase of the scan,
+                    which are also recorded in the scan_metadata of the character, OR None.
+    :return: outcome dictionary of {'ds_id': <ds_id>, 'mode': <mode>, 'status': 'success' or
+             the class of failure, 'character': <character> or None, 'error': <error message>
+             or None, 'skipped': True if the dataset is already registered in `mode`,
+             'fingerprint': fingerprint of the files, 'corrupt_record': True if the register
+             record could not be read, to be deleted by `write_outcome`}
     """
+    if metrics is None:
+        metrics = ScanMetrics()
 
     if project not in options.known_projects:
         raise Exception(f'Project must be one of known projects: {options.known_projects}')
 
     print(f'[INFO] Scanning dataset: {ds_id}\n\t\t{ds_path} in {mode} mode ')
-    facets = analyse_facets(project, ds_id)
 
-    # Generate output file paths
-    outputs = _get_output_paths(project, ds_id)
+    # Get data files
+    with metrics.phase('discovery'):
+        nc_files = glob.glob(f'{ds_path}/*.nc')
+        fingerprint = utils.get_fingerprint(nc_files)
+
+    # check whether the dataset is already registered, from the state manifest
+    register = get_register(project, backend)
+    state = get_state(project, backend)
+    entry = state.get(ds_id)
+
+    if state.is_complete(ds_id, mode, fingerprint):
+        print(f'[INFO] Already ran for: {ds_id} in {entry["mode"]} mode')
+        return _get_outcome(ds_id, entry['mode'], SUCCESS, skipped=True, fingerprint=fingerprint)
+
+    if state.is_complete(ds_id, mode):
+        print(f'[INFO] Files have changed since the last scan of: {ds_id}')
+
+    corrupt_record = False
+
+    # Datasets missing from the manifest may have been registered before it existed
+    if entry is None:
 
-    # check json file exists
-    registration = is_registered(outputs["json"])
-    if registration:
         try:
-            # if json file exists get mode
-            data = json.load(open(outputs["json"]))
-            mode = data["scan_metadata"]["mode"]
-            if mode == 'quick':
-                print(f'[INFO] Already ran for: {ds_id} in quick mode')
-                return True
-
-            if mode == 'full':
-                check = _check_for_min_max(outputs["json"])
-                if check:
-                    print(f'[INFO] Already ran for: {ds_id} in full mode')
-                    return True
-
-        # flag that a corrupt JSON file exists
-        except json.decoder.JSONDecodeError as exc:
-            os.remove(outputs["json"])
-            print(f'[INFO] Corrupt JSON file. Deleting and re-running.')
+            record = register.get(ds_id)
 
-    # Delete previous failure files and log files
-    for file_key in ('no_files_error', 'extract_error', 'write_error'):
+        # flag that a corrupt record exists
+        except json.decoder.JSONDecodeError as exc:
+            corrupt_record = True
+            record = None
+            print(f'[INFO] Corrupt register record. Deleting and re-running.')
 
-        err_file = outputs[file_key]
-        if os.path.exists(err_file):
-            os.remove(err_file)
+        if record and _is_complete(record, mode, fingerprint):
+            print(f'[INFO] Already ran for: {ds_id} in {record["scan_metadata"]["mode"]} mode')
+            return _get_outcome(ds_id, record["scan_metadata"]["mode"], SUCCESS, skipped=True,
+                                fingerprint=fingerprint)
 
-    # Get data files
-    nc_files = glob.glob(f'{ds_path}/*.nc')
+    facets = analyse_facets(project, ds_id)
 
     if not nc_files:
         print(f'[ERROR] No data files found for: {ds_path}/*.nc')
-        open(outputs['no_files_error'], 'w')
-        return False
+        return _get_outcome(ds_id, mode, 'no_files_error', fingerprint=fingerprint, corrupt_record=corrupt_record)
 
     # Open files with Xarray and get character
     expected_facets = options.facet_rules[project]
     var_id = options.get_facet('variable', facets, project)
-
-    character = extract_character(nc_files, location, var_id=var_id,
-                                      mode=mode, expected_attrs=expected_facets)
-
+    cache = FileFactsCache(_get_output_paths(project, ds_id)['cache']) if SETTINGS.USE_FILE_CACHE else None
 
     try:
-        character = extract_character(nc_files, location, var_id=var_id,
-                                      mode=mode, expected_attrs=expected_facets)
+        with metrics.phase('extract'):
+            character = extract_character(nc_files, location, var_id=var_id, mode=mode,
+                                          expected_attrs=expected_facets, cache=cache, metrics=metrics)
     except Exception as exc:
         print(f'[ERROR] Could not load Xarray Dataset for: {ds_path}')
         print(f'[ERROR] Files: {nc_files}')
         print(f'[ERROR] Exception was: {exc}')
+        return _get_outcome(ds_id, mode, 'extract_error', error=str(exc), fingerprint=fingerprint,
+                            corrupt_record=corrupt_record)
+
+    character['scan_metadata']['fingerprint'] = fingerprint
+
+    # Record the timings so far (writing the character cannot time itself)
+    character['scan_metadata']['metrics'] = metrics.to_dict()
+    return _get_outcome(ds_id, mode, SUCCESS, character=character, fingerprint=fingerprint,
+                        corrupt_record=corrupt_record)
+
+
+def write_outcome(project, outcome, backend=None, metrics=None):
+    """
+    Writing stage of scanning a dataset: writes the character extracted by `extract_dataset`
+    to the register, or the failure log if it failed, and records the outcome in the
+    state manifest.
+
+    :param project: top-level project, e.g. "cmip5", "cmip6" or "cordex" (case-insensitive)
+    :param outcome: outcome dictionary, as returned by `extract_dataset`.
+    :param backend: register backend, either 'json' or 'sqlite'. Defaults to SETTINGS.REGISTER_BACKEND.
+    :param metrics: (ScanMetrics) to time writing the register in, OR None.
+    :return: Boolean - indicating success of failure of scan.
+    """
+    if metrics is None:
+        metrics = ScanMetrics()
+
+    ds_id, mode, status, fingerprint = outcome['ds_id'], outcome['mode'], outcome['status'], outcome['fingerprint']
+    register = get_register(project, backend)
+    state = get_state(project, backend)
+    entry = state.get(ds_id)
+
+    if outcome['skipped']:
+        # Datasets registered before the manifest (or fingerprints) existed are added to it
+        if entry is None or 'fingerprint' not in entry:
+            state.record(ds_id, mode, SUCCESS, fingerprint)
+
+        return True
 
-        # Create error file if can't open dataset
-        with open(outputs['extract_error'], 'w') as writer:
-            writer.write(str(exc))
+    if outcome['corrupt_record']:
+        register.delete(ds_id)
 
+    # Generate output file paths
+    outputs = _get_output_paths(project, ds_id)
+    failure_logs = ('no_files_error', 'extract_error', 'write_error')
+
+    # Only the failure log of the latest scan can exist, unless the dataset predates the manifest
+    if entry is not None:
+        failure_logs = [_ for _ in failure_logs if _ == entry['status']]
+
+    # Delete previous failure files and log files
+    for file_key in failure_logs:
+
+        err_file = outputs[file_key]
+        if os.path.exists(err_file):
+            os.remove(err_file)
+
+    if status != SUCCESS:
+
+        # Create error file, holding the error if there is one
+        if status in outputs:
+            with open(outputs[status], 'w') as writer:
+                writer.write(outcome['error'] or '')
+
+        state.record(ds_id, mode, status, fingerprint)
         return False
 
-    # Output to JSON file
+    # Output to register
     try:
-        output = to_json(character, outputs['json'])
+        with metrics.phase('write'):
+            register.put(ds_id, outcome['character'])
     except Exception as exc:
-        print(f'[ERROR] Could not write JSON output: {outputs["json"]}')
+        print(f'[ERROR] Could not write to register: {register.location(ds_id)}')
         # Create error file if can't output file
         open(outputs['write_error'], 'w')
+        state.record(ds_id, mode, 'write_error', fingerprint)
         return False
 
-    print(f'[INFO] Wrote JSON file: {outputs["json"]}')
+    print(f'[INFO] Registered: {register.location(ds_id)}')
+    state.record(ds_id, mode, SUCCESS, fingerprint)
+    return True
+
+
+def scan_dataset(project, ds_id, ds_path, mode, location, backend=None, metrics=None):
+    """
+    Scans a set of files found under the `ds_path`.
+
+    The scanned datasets are characterised and the output is written to the register
+    if no errors occurred. The register and state manifest are flushed before returning
+    (`scan_datasets` instead flushes them in batches, see `_write_outcomes`).
+
+    Keeps track of whether the job was successful or not.
+    Produces error files if an error occurs, otherwise produces a success file.
+
+    :param project: top-level project, e.g. "cmip5", "cmip6" or "cordex" (case-insensitive)
+    :param ds_id: dataset identifier (DSID)
+    :param ds_path: directory under which to scan data files.
+    :param mode: Scanning mode: one of quick, estimate or full. A full scan returns
+                 max and min values while a quick scan excludes them. Defaults to quick.'
+    :param backend: register backend, either 'json' or 'sqlite'. Defaults to SETTINGS.REGISTER_BACKEND.
+    :param metrics: (ScanMetrics) collects the time and bytes read in each phase of the scan,
+                    which are also recorded in the scan_metadata of the character, OR None.
+    :return: Boolean - indicating success of failure of scan.
+    """
+    if metrics is None:
+        metrics = ScanMetrics()
+
+    outcome = extract_dataset(project, ds_id, ds_path, mode, location, backend=backend, metrics=metrics)
+    result = write_outcome(project, outcome, backend=backend, metrics=metrics)
+
+    _flush(project, backend)
+    return result
 
 
 def main():
     """
     Runs script if called on command line
     """
-    project, ds_ids, paths, facets, exclude, mode, location = parse_args()
-    scan_datasets(project, mode, location, ds_ids, paths, facets, exclude)
+    (project, ds_ids, paths, facets, exclude, mode, location, workers, backend, from_register,
+     only_failed, coordinate) = parse_args()
+    scan_datasets(project, mode, location, ds_ids, paths, facets, exclude, workers=workers,
+                  backend=backend, from_register=from_register, only_failed=only_failed,
+                  coordinate=coordinate)
 
 
 if __name__ == "__main__":
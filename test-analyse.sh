@@ -1,7 +1,28 @@
 #!/bin/bash
 
-ds_ids=cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.MOHC.HadGEM2-CC.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.BCC.bcc-csm1-1.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.BCC.bcc-csm1-1-m.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.CCCma.CanCM4.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.CMCC.CMCC-CM.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.CMCC.CMCC-CMS.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.CSIRO-BOM.ACCESS1-0.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.CSIRO-BOM.ACCESS1-3.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.CSIRO-QCCCE.CSIRO-Mk3-6-0.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.INM.inmcm4.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.IPSL.IPSL-CM5A-LR.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.IPSL.IPSL-CM5A-MR.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.MIROC.MIROC-ESM-CHEM.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.MIROC.MIROC4h.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.MIROC.MIROC5.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.MPI-M.MPI-ESM-MR.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.NASA-GISS.GISS-E2-R.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.NASA-GISS.GISS-E2-R-CC.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.NCAR.CCSM4.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.NCC.NorESM1-M.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga,cmip5.output1.NCC.NorESM1-ME.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
-
-python analyse.py -d $ds_ids cmip5
-
-
+# Dataset identifiers are read from standard input, one per line
+python analyse.py -d - cmip5 <<EOF
+cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.MOHC.HadGEM2-CC.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.BCC.bcc-csm1-1.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.BCC.bcc-csm1-1-m.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.CCCma.CanCM4.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.CMCC.CMCC-CM.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.CMCC.CMCC-CMS.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.CSIRO-BOM.ACCESS1-0.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.CSIRO-BOM.ACCESS1-3.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.CSIRO-QCCCE.CSIRO-Mk3-6-0.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.INM.inmcm4.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.IPSL.IPSL-CM5A-LR.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.IPSL.IPSL-CM5A-MR.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.MIROC.MIROC-ESM-CHEM.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.MIROC.MIROC4h.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.MIROC.MIROC5.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.MPI-M.MPI-ESM-MR.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.NASA-GISS.GISS-E2-R.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.NASA-GISS.GISS-E2-R-CC.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.NCAR.CCSM4.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.NCC.NorESM1-M.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+cmip5.output1.NCC.NorESM1-ME.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga
+EOF
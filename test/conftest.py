@@ -60,3 +60,91 @@ def create_netcdf_file_2():
 
     return "test/data/test_file_2.nc"
 
+
+
+def write_cmip5_file(path, var_id, start_year, n_years, nlat=4, nlon=8, offset=0.):
+    """
+    Writes a small CMIP5-like monthly NetCDF file with a 360-day calendar and
+    CF-compliant coordinate attributes.
+    """
+    n_times = n_years * 12
+    test_file = Dataset(path, "w", format="NETCDF4")
+
+    test_file.project_id = "CMIP5"
+    test_file.frequency = "mon"
+    test_file.institute_id = "MOHC"
+
+    test_file.createDimension("time", None)
+    times = test_file.createVariable("time", "f8", ("time",))
+    times.units = "days since 1850-01-01 00:00:00"
+    times.calendar = "360_day"
+    times.standard_name = "time"
+    times.axis = "T"
+    first_month = (start_year - 1850) * 12
+    times[:] = (np.arange(first_month, first_month + n_times) * 30.) + 15.
+
+    test_file.createDimension("lat", nlat)
+    lat = test_file.createVariable("lat", "f8", ("lat",))
+    lat.standard_name = "latitude"
+    lat.units = "degrees_north"
+    lat[:] = np.linspace(-90, 90, nlat)
+
+    test_file.createDimension("lon", nlon)
+    lon = test_file.createVariable("lon", "f8", ("lon",))
+    lon.standard_name = "longitude"
+    lon.units = "degrees_east"
+    lon[:] = np.arange(nlon) * (360. / nlon)
+
+    var = test_file.createVariable(var_id, "f4", ("time", "lat", "lon",), fill_value=1.e20)
+    var.units = "K"
+    var.standard_name = "air_temperature"
+    var[:] = offset + np.arange(n_times * nlat * nlon, dtype="f4").reshape((n_times, nlat, nlon))
+
+    test_file.close()
+    return path
+
+
+MINI_ARCHIVE = {
+    'cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.atmos.Amon.r1i1p1.latest.tas': [(2006, 5), (2011, 5)],
+    'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.tas': [(2006, 10)],
+    'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.pr': [],
+}
+
+
+@pytest.fixture
+def mini_archive(tmp_path, monkeypatch):
+    """
+    Builds a miniature CMIP5 archive under `tmp_path` and points the project base
+    directory and all output paths at it.
+
+    :return: dictionary of {<ds_id>: <ds_path>}
+    """
+    import SETTINGS
+    from lib import options
+
+    base_dir = str(tmp_path / "badc/cmip5/data")
+    monkeypatch.setitem(options.project_base_dirs, "cmip5", base_dir)
+
+    base_path = SETTINGS._base_path
+    output_dir = str(tmp_path / "outputs")
+    for name, value in vars(SETTINGS).copy().items():
+        if isinstance(value, str) and value.startswith(base_path):
+            monkeypatch.setattr(SETTINGS, name, value.replace(base_path, output_dir, 1))
+
+    ds_paths = {}
+
+    for ds_id, file_spans in MINI_ARCHIVE.items():
+        ds_path = os.path.join(base_dir, *ds_id.split('.'))
+        os.makedirs(ds_path)
+        ds_paths[ds_id] = ds_path
+
+        facets = ds_id.split('.')
+        var_id, model = facets[-1], facets[3]
+
+        for start_year, n_years in file_spans:
+            end_year = start_year + n_years - 1
+            fname = f'{var_id}_Amon_{model}_rcp45_r1i1p1_{start_year}01-{end_year}12.nc'
+            write_cmip5_file(os.path.join(ds_path, fname), var_id, start_year, n_years,
+                             offset=(start_year - 2006) * 12 * 32)
+
+    return ds_paths
@@ -0,0 +1,53 @@
+import pytest
+
+import SETTINGS
+import analyse
+from lib.register import JSONRegister
+
+
+def _record(rank, calendar):
+    return {'data': {'rank': rank, 'shape': [1] * rank},
+            'coordinates': {'time': {'calendar': calendar}}}
+
+
+@pytest.fixture
+def register(tmpdir, monkeypatch):
+    monkeypatch.setattr(SETTINGS, 'JSON_OUTPUT_PATH', str(tmpdir.join('register/{grouped_ds_id}.json')))
+    register = JSONRegister('cmip5')
+
+    for i in range(10):
+        ds_id = f'cmip5.output1.INST.MODEL{i}.rcp45.mon.ocean.Omon.r1i1p1.latest.zostoga'
+        register.put(ds_id, _record(3 if i == 4 else 1, '360_day' if i < 5 else 'standard'))
+
+    register.flush()
+    return register
+
+
+def test_load_records_builds_table(register):
+    ds_ids = register.select({})
+    table = analyse.load_records(ds_ids, register, [('data', 'rank'), ('data', 'shape')])
+
+    assert list(table.index) == ds_ids
+    assert list(table.columns) == ['data.rank', 'data.shape']
+    assert table.loc[ds_ids[4], 'data.shape'] == (1, 1, 1)
+
+
+def test_load_records_missing_dataset(register):
+    with pytest.raises(Exception, match='not found in register'):
+        analyse.load_records(['cmip5.output1.A.B.C.D.E.F.G.H.I'], register)
+
+
+def test_analyse_reports_minority(register, capsys):
+    analyse.analyse_datasets('cmip5', facets={'realm': 'ocean'})
+    out = capsys.readouterr().out
+
+    assert "Testing: ('data', 'rank') - found 2 varieties" in out
+    assert "('data', 'rank') == 1:   9" in out
+    assert "SUGGEST FIX OF ('data', 'rank') ON:\n\t\tcmip5.output1.INST.MODEL4." in out
+    assert "('coordinates', 'time', 'calendar') == 360_day:   5" in out
+    assert "SUGGEST FIX OF ('coordinates', 'time', 'calendar')" not in out
+
+
+def test_analyse_no_datasets(register, capsys):
+    analyse.analyse_datasets('cmip5', facets={'realm': 'atmos'})
+    assert '[WARN] No datasets to analyse' in capsys.readouterr().out
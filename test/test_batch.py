@@ -0,0 +1,108 @@
+import os
+import shlex
+import sys
+
+import pytest
+
+import SETTINGS
+from lib import batch
+
+
+TAS_ID = 'cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.atmos.Amon.r1i1p1.latest.tas'
+PR_ID = 'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.pr'
+
+
+def test_wallclock_to_seconds():
+    assert batch.wallclock_to_seconds('00:30') == 1800
+    assert batch.wallclock_to_seconds('12:05') == 43500
+
+
+def test_estimate_cost(mini_archive):
+    cost = batch.estimate_cost(mini_archive[TAS_ID], 'full')
+    model = SETTINGS.BATCH_COST_MODEL['full']
+
+    n_bytes = sum(os.path.getsize(os.path.join(mini_archive[TAS_ID], _))
+                  for _ in os.listdir(mini_archive[TAS_ID]))
+
+    assert cost['files'] == 2
+    assert cost['bytes'] == n_bytes
+    assert cost['seconds'] == pytest.approx(model['dataset'] + 2 * model['file'] +
+                                            n_bytes / 1024 ** 3 * model['gb'])
+
+    assert batch.estimate_cost(mini_archive[PR_ID], 'quick')['files'] == 0
+    assert batch.estimate_cost('/no/such/dir', 'quick')['files'] == 0
+
+
+def test_pack_jobs_first_fit_decreasing():
+    costs = {'a': 50., 'b': 40., 'c': 30., 'd': 20., 'e': 10.}
+    jobs = batch.pack_jobs(costs, 60.)
+
+    assert [job['ds_ids'] for job in jobs] == [['a', 'e'], ['b', 'd'], ['c']]
+    assert [job['seconds'] for job in jobs] == [60., 60., 30.]
+
+
+def test_pack_jobs_oversize_dataset(capsys):
+    jobs = batch.pack_jobs({'big': 100., 'small': 10.}, 60.)
+
+    assert [job['ds_ids'] for job in jobs] == [['big'], ['small']]
+    assert '[WARN] Estimated cost of big' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('lsf', ['bsub', '-q', 'short-serial', '-W', '00:30', '-J', 'job-1', '-o', '/logs/out', '-e',
+             '/logs/err', 'python', 'scan.py', '-d', 'a b']),
+    ('slurm', ['sbatch', '-p', 'short-serial', '-t', '00:30:00', '-J', 'job-1', '-o', '/logs/out', '-e',
+               '/logs/err', '--wrap', "python scan.py -d 'a b'"]),
+])
+def test_template_executor_command(name, expected):
+    job = {'name': 'job-1', 'queue': 'short-serial', 'wallclock': '00:30', 'stdout': '/logs/out',
+           'stderr': '/logs/err', 'command': ['python', 'scan.py', '-d', 'a b']}
+
+    assert batch.get_executor(name).get_command(job) == expected
+
+
+@pytest.mark.parametrize('name, expected_tail', [
+    ('lsf', ['python', 'scan.py', '-d', '@/jobs/job 1/ds_ids.txt']),
+    ('slurm', ['--wrap', "python scan.py -d '@/jobs/job 1/ds_ids.txt'"]),
+])
+def test_template_executor_command_without_shlex_join(name, expected_tail, monkeypatch):
+    """ Checks scheduler commands are built without shlex.join, which Python 3.7 lacks"""
+    monkeypatch.delattr(shlex, 'join', raising=False)
+    job = {'name': 'job-1', 'queue': 'short-serial', 'wallclock': '00:30', 'stdout': '/logs/out',
+           'stderr': '/logs/err', 'command': ['python', 'scan.py', '-d', '@/jobs/job 1/ds_ids.txt']}
+
+    assert batch.get_executor(name).get_command(job)[-len(expected_tail):] == expected_tail
+
+
+def test_local_executor(tmpdir):
+    job = {'stdout': str(tmpdir.join('out')), 'stderr': str(tmpdir.join('err')),
+           'command': [sys.executable, '-c', 'print("scanned")']}
+
+    assert batch.LocalExecutor().submit(job) == 0
+    assert open(job['stdout']).read() == 'scanned\n'
+
+
+def test_submit_datasets_dry_run(mini_archive):
+    jobs = batch.submit_datasets('cmip5', 'quick', 'ceda', mini_archive, batch.get_executor('lsf'),
+                                 wallclock='00:01', dry_run=True)
+
+    # Three quick scans of at most a few seconds each fit in one job of 48 usable seconds
+    assert len(jobs) == 1
+    assert sorted(ds_id for job in jobs for ds_id in job['ds_ids']) == sorted(mini_archive)
+
+    for job in jobs:
+        job_dir = SETTINGS.BATCH_JOB_PATH.format(job_name=job['name'])
+
+        assert open(os.path.join(job_dir, 'ds_ids.txt')).read().split() == job['ds_ids']
+        assert job['command'][-1] == 'cmip5'
+        assert job['command'][job['command'].index('-d') + 1] == f'@{os.path.abspath(job_dir)}/ds_ids.txt'
+        assert not os.path.exists(job['stdout'])
+
+
+def test_submit_datasets_passes_coordinate(mini_archive):
+    jobs = batch.submit_datasets('cmip5', 'quick', 'ceda', mini_archive, batch.get_executor('lsf'),
+                                 coordinate='rerun-1', dry_run=True)
+
+    for job in jobs:
+        assert job['command'][job['command'].index('--coordinate') + 1] == 'rerun-1'
+        assert job['command'][-1] == 'cmip5'
@@ -0,0 +1,48 @@
+import os
+
+from benchmarks import generate, run
+from lib import character
+
+
+TINY_CASE = {'n_files': 3, 'n_times': 12, 'nlat': 4, 'nlon': 8, 'dtype': 'f8', 'chunks': [6, 4, 8],
+             'calendar': 'noleap'}
+
+
+def test_write_dataset(tmpdir):
+    files = generate.write_dataset(str(tmpdir), **TINY_CASE)
+
+    assert [os.path.basename(_)[-16:] for _ in files] == ['185001-185012.nc', '185101-185112.nc',
+                                                         '185201-185212.nc']
+    assert character.order_files_by_name(files[::-1]) == files
+
+    extracted = character.extract_character(files, 'ceda', 'tas', mode='full', engine='header')
+    time = extracted['coordinates']['time']
+
+    assert (time['min'], time['max'], time['calendar']) == ('1850-01-15T00:00:00', '1852-12-15T00:00:00',
+                                                            'noleap')
+    assert extracted['data']['shape'] == [36, 4, 8]
+
+
+def test_run_benchmarks(tmpdir):
+    results = run.run_benchmarks({'tiny': TINY_CASE}, ['extract-header-full', 'scan-quick'], repeat=1,
+                                 data_dir=str(tmpdir))
+
+    assert sorted(results) == ['tiny/extract-header-full', 'tiny/scan-quick']
+    assert all(result['seconds'] > 0 and result['peak_mb'] >= 0 for result in results.values())
+
+    # The dataset is only generated once
+    mtime = os.path.getmtime(str(tmpdir.join('tiny', 'params.json')))
+    run.prepare_case(str(tmpdir), 'tiny', TINY_CASE)
+    assert os.path.getmtime(str(tmpdir.join('tiny', 'params.json'))) == mtime
+
+
+def test_find_regressions(tmpdir):
+    baselines_path = str(tmpdir.join('baselines.json'))
+    run.save_baselines({'a/quick': {'seconds': 1., 'peak_mb': 100.}, 'b/quick': {'seconds': 0.01, 'peak_mb': 1.}},
+                       baselines_path)
+    baselines = run.load_baselines(baselines_path)
+
+    results = {'a/quick': {'seconds': 1.2, 'peak_mb': 200.}, 'b/quick': {'seconds': 0.05, 'peak_mb': 5.},
+               'c/quick': {'seconds': 10., 'peak_mb': 10.}}
+
+    assert run.find_regressions(results, baselines, tolerance=0.25) == [('a/quick', 'peak_mb', 100., 200.)]
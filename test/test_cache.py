@@ -0,0 +1,58 @@
+import glob
+import os
+
+from conftest import write_cmip5_file
+from lib import header
+from lib.cache import FileFactsCache
+from lib.character import extract_character
+
+
+def _count_reads(monkeypatch):
+    reads = []
+    get_file_facts = header.get_file_facts
+
+    def counting_get_file_facts(path, *args, **kwargs):
+        reads.append(os.path.basename(path))
+        return get_file_facts(path, *args, **kwargs)
+
+    monkeypatch.setattr(header, 'get_file_facts', counting_get_file_facts)
+    return reads
+
+
+def test_rescan_only_reads_new_files(tmpdir, monkeypatch):
+    cache_path = str(tmpdir.join('cache', 'ds.json'))
+    write_cmip5_file(str(tmpdir.join('tas_2006.nc')), 'tas', 2006, 2)
+    write_cmip5_file(str(tmpdir.join('tas_2008.nc')), 'tas', 2008, 2, offset=24 * 32)
+    reads = _count_reads(monkeypatch)
+
+    extract_character(sorted(glob.glob(f'{tmpdir}/*.nc')), 'ceda', 'tas', mode='full',
+                      engine='header', cache=FileFactsCache(cache_path))
+    assert reads == ['tas_2006.nc', 'tas_2008.nc']
+
+    write_cmip5_file(str(tmpdir.join('tas_2010.nc')), 'tas', 2010, 2, offset=48 * 32)
+    files = sorted(glob.glob(f'{tmpdir}/*.nc'))
+    character = extract_character(files, 'ceda', 'tas', mode='full', engine='header',
+                                  cache=FileFactsCache(cache_path))
+
+    assert reads[2:] == ['tas_2010.nc']
+    assert character == {**extract_character(files, 'ceda', 'tas', mode='full', engine='header'),
+                         'scan_metadata': character['scan_metadata']}
+
+
+def test_cache_entry_invalidated_by_change(tmpdir):
+    cache_path = str(tmpdir.join('cache.json'))
+    path = write_cmip5_file(str(tmpdir.join('tas.nc')), 'tas', 2006, 1)
+
+    cache = FileFactsCache(cache_path)
+    assert cache.get(path, 'tas', 'quick') is None
+    cache.put(path, 'tas', 'quick', header.get_file_facts(path, 'tas'))
+    cache.save()
+
+    cache = FileFactsCache(cache_path)
+    assert cache.get(path, 'tas', 'quick') is not None
+    # Quick facts have no min/max so cannot answer a full scan
+    assert cache.get(path, 'tas', 'full') is None
+    assert cache.get(path, 'pr', 'quick') is None
+
+    write_cmip5_file(path, 'tas', 2006, 2)
+    assert FileFactsCache(cache_path).get(path, 'tas', 'quick') is None
@@ -0,0 +1,302 @@
+import os
+import time
+
+import numpy as np
+import xarray as xr
+
+import SETTINGS
+from lib import character, stats
+
+
+def _make_da(values):
+    return xr.DataArray(values, dims=('time', 'lat', 'lon'), name='tas')
+
+
+def test_iter_slabs_respects_budget():
+    shape = (10, 4, 8)
+    slabs = list(stats.iter_slabs(shape, 4, 4 * 4 * 8 * 3))
+
+    assert len(slabs) == 4
+    assert all(s[0].stop - s[0].start <= 3 for s in slabs)
+    assert slabs[-1][0] == slice(9, 10)
+
+
+def test_iter_slabs_splits_inner_dimension_when_row_over_budget():
+    values = np.arange(2 * 4 * 8).reshape((2, 4, 8))
+    slabs = list(stats.iter_slabs(values.shape, values.itemsize, values.itemsize * 8))
+
+    assert len(slabs) == 8
+    assert sum(values[s].size for s in slabs) == values.size
+
+
+def test_streaming_min_max_matches_full_read():
+    values = np.random.RandomState(0).normal(size=(50, 4, 8)).astype('f4')
+    da = _make_da(values).chunk({'time': 7})
+    info = character.get_data_info(da, 'full', memory_budget=values[0].nbytes * 3)
+
+    assert info['min'] == float(values.min())
+    assert info['max'] == float(values.max())
+
+
+def test_streaming_min_max_propagates_nan():
+    values = np.ones((10, 4, 8))
+    values[7, 1, 1] = np.nan
+    info = character.get_data_info(_make_da(values), 'full', memory_budget=values[0].nbytes)
+
+    assert np.isnan(info['min']) and np.isnan(info['max'])
+
+
+def test_files_read_at_once_share_memory_budget(monkeypatch):
+    values = np.arange(4 * 4 * 8, dtype='f8').reshape((4, 4, 8))
+    file_arrays = {f'tas_{i}.nc': _make_da(values[i * 2:i * 2 + 2]) for i in range(2)}
+    budgets = []
+    summarise = character._summarise
+
+    def recording_summarise(da, memory_budget):
+        budgets.append(memory_budget)
+        return summarise(da, memory_budget)
+
+    monkeypatch.setattr(character, '_summarise', recording_summarise)
+    monkeypatch.setattr(SETTINGS, 'FILE_WORKERS', 2)
+    info = character.get_data_info(_make_da(values), 'full', memory_budget=values[0].nbytes * 2,
+                                   file_arrays=file_arrays)
+
+    assert budgets == [values[0].nbytes] * 2
+    assert info['max'] == float(values.max())
+
+
+def test_quick_mode_skips_min_max():
+    info = character.get_data_info(_make_da(np.ones((2, 3, 4))), 'quick')
+    assert info['min'] is None and info['max'] is None
+    assert info['shape'] == [2, 3, 4]
+
+
+def test_stratified_sample_picks_one_per_stratum():
+    rng = np.random.default_rng(0)
+    sample = stats.stratified_sample(100, 10, rng)
+
+    assert [i // 10 for i in sample] == list(range(10))
+    assert stats.stratified_sample(3, 10, rng) == [0, 1, 2]
+
+
+def test_iter_sample_slabs_reads_whole_blocks():
+    shape = (20, 4, 8)
+    slabs = list(stats.iter_sample_slabs(shape, 4, 4 * 4 * 8 * 2, 3, np.random.default_rng(0), block_length=5))
+
+    # 3 blocks of 5 time steps, each read as slabs of at most 2 time steps
+    assert sum(stats.slab_size(_, shape) for _ in slabs) == 3 * 5 * 4 * 8
+    assert len(set(_[0].start // 5 for _ in slabs)) == 3
+    assert all(_[0].stop - _[0].start <= 2 for _ in slabs)
+
+
+def test_estimate_mode_reports_sample(monkeypatch):
+    monkeypatch.setattr(SETTINGS, 'ESTIMATE_FILES', 1)
+    monkeypatch.setattr(SETTINGS, 'ESTIMATE_BLOCKS', 4)
+
+    values = np.random.RandomState(0).normal(size=(40, 4, 8))
+    info = character.get_data_info(_make_da(values), 'estimate')
+
+    assert values.min() <= info['min'] <= info['max'] <= values.max()
+    assert info['sample']['fraction_read'] == 0.1
+    assert info['sample']['blocks_read'] == 4
+    assert info['sample']['fraction_outside'] == stats.outside_fraction_bound(4, 0.95)
+
+
+def test_outside_fraction_bound_covers_both_tails():
+    n_total, n_blocks, confidence = 1000, 20, 0.95
+    bound = stats.outside_fraction_bound(n_blocks, confidence)
+    rng = np.random.default_rng(0)
+    failures = 0
+
+    for _ in range(2000):
+        ranks = rng.choice(n_total, n_blocks, replace=False)
+        above, below = (n_total - 1 - ranks.max()) / n_total, ranks.min() / n_total
+        failures += above > bound or below > bound
+
+    assert failures / 2000 <= 1 - confidence
+
+
+def test_estimate_mode_reading_everything_is_exact():
+    values = np.random.RandomState(0).normal(size=(3, 4, 8))
+    info = character.get_data_info(_make_da(values), 'estimate')
+
+    assert (info['min'], info['max']) == (values.min(), values.max())
+    assert info['sample']['fraction_read'] == 1.
+    assert info['sample']['fraction_outside'] == 0.
+
+
+def test_summary_merges_across_slabs():
+    values = np.random.RandomState(0).normal(10., 3., size=(50, 4, 8))
+    values[3, 2, 1] = np.nan
+
+    parts = [stats.Summary(), stats.Summary()]
+    for i, slab in enumerate(values):
+        parts[i % 2].add(slab)
+
+    summary = stats.Summary()
+    for part in parts:
+        summary.merge(stats.Summary.from_dict(part.to_dict()))
+
+    valid = values[~np.isnan(values)]
+    info = summary.get_info([0.5])
+
+    assert np.isnan(info['min']) and np.isnan(info['max'])
+    assert info['count'] == valid.size
+    assert info['nan_count'] == 1
+    assert np.isclose(info['mean'], valid.mean())
+    assert np.isclose(info['variance'], valid.var())
+    assert abs(info['quantiles']['0.5'] - np.median(valid)) <= 0.01 * abs(np.median(valid)) + 0.05
+
+
+def test_sketch_quantiles_within_relative_accuracy():
+    values = np.random.RandomState(0).lognormal(size=10000) * np.where(np.arange(10000) % 3, 1, -1)
+    sketch = stats.DDSketch(0.01)
+    sketch.add(values)
+
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        expected = np.sort(values)[int(q * (values.size - 1))]
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * abs(expected)
+
+    assert stats.DDSketch().quantile(0.5) is None
+
+
+def test_full_mode_reports_statistics():
+    values = np.arange(24, dtype='f8').reshape((2, 3, 4))
+    values[0, 0, 0] = np.nan
+    info = character.get_data_info(_make_da(values), 'full', memory_budget=values[0].nbytes)
+
+    assert info['count'] == 23 and info['nan_count'] == 1
+    assert 'fill_count' not in info
+    assert info['mean'] == 12.
+    assert set(info['quantiles']) == set(str(_) for _ in SETTINGS.QUANTILES)
+
+
+def _rewrite_time_units(path, units):
+    import cftime
+    from netCDF4 import Dataset
+
+    with Dataset(path, 'a') as nc:
+        times = nc.variables['time']
+        dates = cftime.num2date(times[:], times.units, times.calendar)
+        times.units = units
+        times[:] = cftime.date2num(dates, units, times.calendar)
+
+
+def test_raw_time_coordinates_match_decoded(tmpdir):
+    """ Checks times combined from raw values in different units match decoding every value"""
+    from conftest import write_cmip5_file
+
+    files = [write_cmip5_file(str(tmpdir.join(f'tas_{year}.nc')), 'tas', year, 2) for year in (2010, 2006, 2008)]
+    _rewrite_time_units(files[1], 'hours since 2000-01-01 00:00:00')
+    _rewrite_time_units(files[2], 'days since 2008-01-01 00:00:00')
+
+    ds = xr.open_mfdataset(files, decode_times=xr.coders.CFDatetimeCoder(use_cftime=True), combine='by_coords')
+    expected = character.get_coords(ds['tas'])
+    extracted = character.extract_character(files, 'ceda', 'tas', mode='quick', engine='xarray')
+
+    assert extracted['coordinates'] == expected
+    assert extracted['coordinates']['time']['length'] == 72
+    assert 'units' not in extracted['coordinates']['time']
+
+
+def test_get_min_max_reads_endpoints_of_monotonic_index():
+    import pandas as pd
+
+    values = np.array([3., 2., 1.])
+    assert character.get_min_max(values, pd.Index(values)) == (1., 3., 'decreasing')
+
+    values = np.array([1., 3., 2.])
+    assert character.get_min_max(values, pd.Index(values)) == (1., 3., 'unordered')
+
+    # Only the endpoints are read when the index is monotonic
+    values = np.array([1., np.nan, 3.])
+    assert character.get_min_max(values, pd.Index([1., 2., 3.])) == (1., 3., 'increasing')
+
+
+def test_concurrent_open_matches_open_mfdataset(tmpdir, monkeypatch):
+    from conftest import write_cmip5_file
+
+    files = [write_cmip5_file(str(tmpdir.join(f'tas_{year}.nc')), 'tas', year, 1) for year in range(2010, 2004, -1)]
+    _rewrite_time_units(files[2], 'hours since 2000-01-01 00:00:00')
+
+    monkeypatch.setattr(SETTINGS, 'OPEN_CONCURRENCY', 1)
+    expected = character.extract_character(files, 'ceda', 'tas', mode='full', engine='xarray')
+
+    def counting(func, state):
+        def counted(*args, **kwargs):
+            state['open'] += 1
+            state['most'] = max(state['most'], state['open'])
+            try:
+                time.sleep(0.05)
+                return func(*args, **kwargs)
+            finally:
+                state['open'] -= 1
+
+        return counted
+
+    prefetches, opens = {'open': 0, 'most': 0}, {'open': 0, 'most': 0}
+    monkeypatch.setattr(character, 'open', counting(open, prefetches), raising=False)
+    monkeypatch.setattr(xr, 'open_dataset', counting(xr.open_dataset, opens))
+    monkeypatch.setattr(SETTINGS, 'OPEN_CONCURRENCY', 3)
+    extracted = character.extract_character(files, 'ceda', 'tas', mode='full', engine='xarray')
+
+    # Headers are prefetched concurrently but the netCDF library is only called from one thread at a time
+    assert prefetches['most'] == 3
+    assert opens['most'] == 1
+    for section in ('variable', 'coordinates', 'global_attrs', 'data'):
+        assert extracted[section] == expected[section], section
+
+
+def test_order_files_by_name():
+    files = ['/a/tas_Amon_x_201001-201012.nc', '/a/tas_Amon_x_200801-200912.nc', '/b/tas_Amon_x_201101-201112.nc']
+    assert character.order_files_by_name(files) == [files[1], files[0], files[2]]
+
+    # No time range, mixed precision and overlapping ranges
+    assert character.order_files_by_name(files + ['/a/tas_fx_x.nc']) is None
+    assert character.order_files_by_name(files + ['/a/tas_Amon_x_2012-2013.nc']) is None
+    assert character.order_files_by_name(files + ['/a/tas_Amon_x_201006-201105.nc']) is None
+
+
+def test_filename_order_matches_by_coords(tmpdir, monkeypatch, capsys):
+    from conftest import write_cmip5_file
+
+    files = [write_cmip5_file(str(tmpdir.join(f'tas_Amon_x_{year}01-{year + 1}12.nc')), 'tas', year, 2)
+             for year in (2010, 2006, 2008)]
+
+    monkeypatch.setattr(SETTINGS, 'COMBINE', 'by_coords')
+    expected = character.extract_character(files, 'ceda', 'tas', mode='full', engine='xarray')
+
+    monkeypatch.setattr(SETTINGS, 'COMBINE', 'filename')
+    extracted = character.extract_character(files, 'ceda', 'tas', mode='full', engine='xarray')
+
+    for section in ('variable', 'coordinates', 'global_attrs', 'data'):
+        assert extracted[section] == expected[section], section
+
+    # Names that contradict the times in the files fall back to combining by coordinates
+    os.rename(files[0], str(tmpdir.join('tas_Amon_x_200001-200112.nc')))
+    files[0] = str(tmpdir.join('tas_Amon_x_200001-200112.nc'))
+    extracted = character.extract_character(files, 'ceda', 'tas', mode='full', engine='xarray')
+
+    assert extracted['coordinates'] == expected['coordinates']
+    assert 'not in time order' in capsys.readouterr().out
+
+
+def test_chunks_reported_in_scan_metadata(tmpdir, monkeypatch):
+    from netCDF4 import Dataset
+    from conftest import write_cmip5_file
+
+    files = [write_cmip5_file(str(tmpdir.join(f'tas_{year}.nc')), 'tas', year, 2) for year in (2006, 2008)]
+
+    with Dataset(files[0]) as nc:
+        disk_chunks = nc.variables['tas'].chunking()
+
+    # Budget for 3 on-disk chunks of the (24, 4, 8) f4 variable
+    chunk_bytes = 4 * int(np.prod(disk_chunks))
+    monkeypatch.setattr(SETTINGS, 'CHUNK_MEMORY_BUDGET', chunk_bytes * 3)
+    expected = {'disk': disk_chunks, 'read': [min(24, disk_chunks[0] * 3)] + disk_chunks[1:]}
+
+    extracted = character.extract_character(files, 'ceda', 'tas', mode='full', engine='xarray')
+    assert extracted['scan_metadata']['chunks'] == expected
+
+    extracted = character.extract_character(files, 'ceda', 'tas', mode='full', engine='header')
+    assert extracted['scan_metadata']['chunks']['disk'] == disk_chunks
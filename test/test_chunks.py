@@ -0,0 +1,38 @@
+import numpy as np
+
+from lib import chunks
+
+
+def test_plan_chunks_whole_disk_chunks_under_budget():
+    # Disk chunks of 12 x 145 x 192 f4 are ~1.3MB, so 3 fit in a 4MB budget
+    assert chunks.plan_chunks((240, 145, 192), 4, (12, 145, 192), 4 * 1024 ** 2) == (36, 145, 192)
+
+    # Trailing dimensions grow to their full length first
+    assert chunks.plan_chunks((240, 145, 192), 4, (1, 29, 48), 4 * 145 * 192 * 2) == (2, 145, 192)
+    assert chunks.plan_chunks((240, 145, 192), 4, (1, 29, 48), 4 * 58 * 192) == (1, 58, 192)
+
+
+def test_plan_chunks_over_budget_disk_chunk():
+    assert chunks.plan_chunks((240, 145, 192), 4, (12, 145, 192), 1024) == (12, 145, 192)
+
+
+def test_plan_chunks_contiguous():
+    assert chunks.plan_chunks((10, 4, 8), 4, None, 4 * 4 * 8 * 3) == (3, 4, 8)
+    assert chunks.plan_chunks((10, 4, 8), 4, None, 4 * 8 * 3) == (1, 3, 8)
+    assert chunks.plan_chunks((0, 4, 8), 4, None, 1024) == (1, 4, 8)
+
+
+def test_iter_chunks_covers_array():
+    values = np.arange(10 * 4 * 8).reshape((10, 4, 8))
+    index = list(chunks.iter_chunks(values.shape, (3, 4, 5)))
+
+    assert len(index) == 4 * 2
+    assert np.array_equal(np.sort(np.concatenate([values[_].ravel() for _ in index])), values.ravel())
+    assert list(chunks.iter_chunks((0, 4), (1, 4))) == []
+
+
+def test_distinct_chunk_info():
+    first, second = chunks.get_chunk_info((1, 4, 8), (3, 4, 8)), chunks.get_chunk_info(None, (2, 4, 8))
+
+    assert chunks.distinct_chunk_info([first, first]) == {'disk': [1, 4, 8], 'read': [3, 4, 8]}
+    assert chunks.distinct_chunk_info([first, second, first]) == [first, second]
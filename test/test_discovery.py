@@ -0,0 +1,119 @@
+import glob
+import os
+
+import pytest
+
+import scan
+from lib import discovery
+
+
+@pytest.fixture
+def tree(tmpdir):
+    base_dir = str(tmpdir.join('data'))
+
+    for model in ('HadGEM2-ES', 'HadGEM2-CC', 'MRI-CGCM3', '.hidden'):
+        for experiment in ('rcp45', 'rcp85', 'historical'):
+            for variable in ('tas', 'pr'):
+                os.makedirs(os.path.join(base_dir, model, experiment, 'mon', variable))
+
+    open(os.path.join(base_dir, 'HadGEM2-ES', 'rcp45', 'README'), 'w').close()
+    return base_dir
+
+
+@pytest.mark.parametrize('patterns', [
+    ['*', 'rcp45', 'mon', '*'],
+    ['Had*', '*', '*', 'tas'],
+    ['MRI-CGCM3', 'historical', 'mon', 'pr'],
+    ['*', 'rcp[48]5', '*', '[!t]*'],
+    ['nothing', '*', '*', '*'],
+])
+def test_matches_glob(tree, patterns):
+    expected = sorted(glob.glob(os.path.join(tree, *patterns)))
+    index = discovery.DirectoryIndex()
+
+    assert discovery.find_dataset_paths(tree, patterns, index=index, threads=4) == expected
+
+
+def test_index_is_reused(tree, tmpdir, monkeypatch):
+    index_path = str(tmpdir.join('index.json'))
+    patterns = ['*', '*', 'mon', 'tas']
+
+    expected = discovery.find_dataset_paths(tree, patterns, index=discovery.DirectoryIndex(index_path))
+    discovery.DirectoryIndex(index_path).save()
+    assert not os.path.exists(index_path)
+
+    index = discovery.DirectoryIndex(index_path)
+    discovery.find_dataset_paths(tree, patterns, index=index)
+    index.save()
+
+    def no_scandir(path):
+        raise AssertionError(f'Listed directory: {path}')
+
+    # Directories whose mtime has not changed are not listed again
+    monkeypatch.setattr(os, 'scandir', no_scandir)
+    assert discovery.find_dataset_paths(tree, patterns, index=discovery.DirectoryIndex(index_path)) == expected
+
+    # Nor even checked while a trusted index is fresh
+    index = discovery.DirectoryIndex(index_path, trust_seconds=3600)
+    # (the base directory is always checked to exist)
+    listed = set(index._entries) - {tree}
+    stat = os.stat
+
+    def no_stat(path, *args, **kwargs):
+        assert path not in listed, f'Checked directory: {path}'
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'stat', no_stat)
+    assert discovery.find_dataset_paths(tree, patterns, index=index) == expected
+
+
+def test_index_invalidated_by_mtime(tree, tmpdir):
+    index_path = str(tmpdir.join('index.json'))
+    patterns = ['*', 'rcp26', 'mon', 'tas']
+
+    index = discovery.DirectoryIndex(index_path)
+    assert discovery.find_dataset_paths(tree, patterns, index=index) == []
+    index.save()
+
+    new_dir = os.path.join(tree, 'HadGEM2-ES', 'rcp26', 'mon', 'tas')
+    os.makedirs(new_dir)
+
+    index = discovery.DirectoryIndex(index_path)
+    assert discovery.find_dataset_paths(tree, patterns, index=index) == [new_dir]
+
+
+def test_get_dataset_paths_by_facets(mini_archive):
+    ds_paths = scan.get_dataset_paths('cmip5', facets={'institute': 'MRI', 'version': 'latest'})
+    expected = sorted([ds_id for ds_id in mini_archive if '.MRI.' in ds_id])
+
+    assert list(ds_paths) == expected
+    assert ds_paths[expected[0]] == mini_archive[expected[0]]
+
+
+def test_exclude_prunes_subtrees(tree, monkeypatch):
+    listed = []
+    list_subdirs = discovery.DirectoryIndex.list_subdirs
+
+    def recording_list_subdirs(self, path):
+        listed.append(path)
+        return list_subdirs(self, path)
+
+    monkeypatch.setattr(discovery.DirectoryIndex, 'list_subdirs', recording_list_subdirs)
+    exclude = discovery.compile_exclude(['/rcp85/', 'HadGEM2-CC'])
+    paths = discovery.find_dataset_paths(tree, ['*', '*', '*', '*'], index=discovery.DirectoryIndex(),
+                                         exclude=exclude)
+
+    assert paths
+    assert not [_ for _ in paths if 'rcp85' in _ or 'HadGEM2-CC' in _]
+    assert not [_ for _ in listed if 'rcp85' in _ or 'HadGEM2-CC' in _]
+
+
+def test_get_dataset_paths_exclude(mini_archive):
+    ds_ids = list(mini_archive)
+
+    assert list(scan.get_dataset_paths('cmip5', ds_ids=ds_ids, exclude=['/pr/'])) == ds_ids[:2]
+    assert list(scan.get_dataset_paths('cmip5', facets={'version': 'latest'}, exclude=['/MRI/', 'nothing'])) == ds_ids[:1]
+
+    base_dir = os.path.dirname(mini_archive[ds_ids[0]].split('/cmip5/output1/')[0] + '/')
+    paths = [os.path.join(base_dir, 'cmip5/output1/MRI')]
+    assert list(scan.get_dataset_paths('cmip5', paths=paths, exclude=['/tas/'])) == ds_ids[2:]
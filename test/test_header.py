@@ -0,0 +1,179 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+import SETTINGS
+from conftest import write_cmip5_file
+from lib import header
+from lib.character import extract_character
+
+
+SECTIONS = ('variable', 'coordinates', 'global_attrs', 'data')
+
+
+def _assert_same_character(files, var_id):
+    expected = extract_character(files, 'ceda', var_id, mode='quick', engine='xarray')
+    character = extract_character(files, 'ceda', var_id, mode='quick', engine='header')
+
+    for section in SECTIONS:
+        assert character[section] == expected[section], section
+
+
+def test_header_engine_matches_xarray(mini_archive):
+    for ds_path in mini_archive.values():
+        files = glob.glob(f'{ds_path}/*.nc')
+
+        if files:
+            _assert_same_character(files, os.path.basename(ds_path))
+
+
+def test_header_engine_matches_xarray_with_aux_coords(tmpdir):
+    path = write_cmip5_file(str(tmpdir.join('tas.nc')), 'tas', 2006, 2)
+
+    with Dataset(path, 'a') as nc:
+        height = nc.createVariable('height', 'f8', ())
+        height.standard_name = 'height'
+        height.units = 'm'
+        height[...] = 2.
+        nc.variables['tas'].coordinates = 'height'
+
+    _assert_same_character([path], 'tas')
+
+
+def test_header_engine_matches_xarray_monotonic(tmpdir):
+    files = [write_cmip5_file(str(tmpdir.join(f'tas_{year}.nc')), 'tas', year, 1) for year in (2007, 2006)]
+
+    for path in files:
+        with Dataset(path, 'a') as nc:
+            nc.variables['lat'][:] = nc.variables['lat'][::-1]
+            nc.variables['lon'][:] = [0., 90., 45., 135., 180., 225., 270., 315.]
+
+    _assert_same_character(files, 'tas')
+
+    character = extract_character(files, 'ceda', 'tas', mode='quick', engine='header')
+    monotonic = {name: coord['monotonic'] for name, coord in character['coordinates'].items()}
+
+    assert monotonic == {'time': 'increasing', 'latitude': 'decreasing', 'longitude': 'unordered'}
+
+
+def test_file_facts_record_raw_time_range(tmpdir):
+    path = write_cmip5_file(str(tmpdir.join('tas.nc')), 'tas', 1850, 1)
+    facts = header.get_file_facts(path, 'tas')
+
+    assert facts['shape'] == [12, 4, 8]
+    assert facts['coords']['time']['min'] == 15.
+    assert facts['coords']['time']['calendar'] == '360_day'
+    assert 'units' not in facts['coords']['time']['attrs']
+
+
+def test_header_engine_full_mode_matches_xarray(mini_archive):
+    ds_path = mini_archive['cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.atmos.Amon.r1i1p1.latest.tas']
+    files = glob.glob(f'{ds_path}/*.nc')
+
+    expected = extract_character(files, 'ceda', 'tas', mode='full', engine='xarray')
+    character = extract_character(files, 'ceda', 'tas', mode='full', engine='header')
+
+    for section in SECTIONS:
+        assert character[section] == expected[section], section
+
+
+def test_header_engine_full_mode_masks_fill_values(tmpdir):
+    path = write_cmip5_file(str(tmpdir.join('tas.nc')), 'tas', 2006, 1)
+
+    with Dataset(path, 'a') as nc:
+        nc.variables['tas'][0, 0, 0] = 1.e20
+
+    facts = header.get_file_facts(path, 'tas', mode='full')
+    expected = extract_character([path], 'ceda', 'tas', mode='full', engine='xarray')
+
+    assert str(facts['max']) == str(expected['data']['max'])
+    # Fill values are counted as NaN, as they are by xarray
+    assert 'fill_count' not in facts['stats']
+    assert facts['stats']['nan_count'] == 1
+    assert facts['stats']['count'] == expected['data']['count'] == 12 * 4 * 8 - 1
+
+
+def _add_packed_variable(path, dtype, attrs, raw):
+    with Dataset(path, 'a') as nc:
+        var = nc.createVariable('ps', dtype, ('time', 'lat', 'lon'), fill_value=attrs.pop('_FillValue', None))
+        var.setncatts(attrs)
+        var.set_auto_maskandscale(False)
+        var[:] = raw.reshape(var.shape)
+
+
+@pytest.mark.parametrize('dtype, attrs', [
+    ('i2', {'scale_factor': np.float32(0.01), 'add_offset': np.float32(273.15), '_FillValue': np.int16(-32767)}),
+    ('i2', {'scale_factor': np.float64(0.01), 'add_offset': np.float64(273.15)}),
+    ('i2', {'scale_factor': np.float32(0.5), '_Unsigned': 'true', '_FillValue': np.int16(-1)}),
+    ('i1', {'_Unsigned': 'true', '_FillValue': np.int8(-1)}),
+    ('i4', {'scale_factor': np.float32(0.001), 'add_offset': np.float32(1000.)}),
+])
+def test_header_engine_decodes_packed_values_as_xarray(tmpdir, dtype, attrs):
+    path = write_cmip5_file(str(tmpdir.join('tas.nc')), 'tas', 2006, 1)
+    raw = np.random.RandomState(0).randint(-100, 100, size=12 * 4 * 8).astype(dtype)
+
+    # Negative values are the largest once _Unsigned is applied
+    if '_Unsigned' in attrs:
+        raw[:2] = [-2, np.iinfo(dtype).min + 1]
+
+    raw[2] = attrs.get('_FillValue', raw[2])
+    _add_packed_variable(path, dtype, dict(attrs), raw)
+
+    expected = extract_character([path], 'ceda', 'ps', mode='full', engine='xarray')
+    character = extract_character([path], 'ceda', 'ps', mode='full', engine='header')
+
+    # Fill values are masked as NaN, which propagates to the min and max
+    assert json.dumps(character['data'], sort_keys=True) == json.dumps(expected['data'], sort_keys=True)
+
+
+def test_header_engine_estimate_mode_samples_files(mini_archive, monkeypatch):
+    monkeypatch.setattr(SETTINGS, 'ESTIMATE_FILES', 1)
+    monkeypatch.setattr(SETTINGS, 'ESTIMATE_BLOCKS', 6)
+
+    ds_path = mini_archive['cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.atmos.Amon.r1i1p1.latest.tas']
+    files = glob.glob(f'{ds_path}/*.nc')
+
+    full = extract_character(files, 'ceda', 'tas', mode='full', engine='header')
+    character = extract_character(files, 'ceda', 'tas', mode='estimate', engine='header')
+
+    assert character['scan_metadata']['mode'] == 'estimate'
+    assert full['data']['min'] <= character['data']['min'] <= character['data']['max'] <= full['data']['max']
+
+    # 6 of the 60 time steps of one of the two files
+    assert character['data']['sample']['fraction_read'] == 6 / 120
+    assert character['data']['sample']['blocks_read'] == 6
+
+    for section in ('variable', 'coordinates', 'global_attrs'):
+        assert character[section] == full[section], section
+
+
+def test_full_mode_traces_extremes_to_files(tmpdir, monkeypatch):
+    paths = [write_cmip5_file(str(tmpdir.join(f'tas_{year}01-{year + 1}12.nc')), 'tas', year, 2,
+                              offset=(year - 2006) * 12 * 32)
+             for year in (2006, 2008, 2010)]
+
+    with Dataset(paths[1], 'a') as nc:
+        nc.variables['tas'][3, 1, 2] = 1.e6
+
+    monkeypatch.setattr(SETTINGS, 'FILE_WORKERS', 2)
+    characters = [extract_character(paths, 'ceda', 'tas', mode='full', engine=engine)
+                  for engine in ('header', 'xarray')]
+
+    # Files read one at a time give the same character
+    monkeypatch.setattr(SETTINGS, 'FILE_WORKERS', 1)
+    characters.append(extract_character(paths, 'ceda', 'tas', mode='full', engine='header'))
+
+    for character in characters:
+        files = character['data']['files']
+
+        assert [_['file'] for _ in files] == [os.path.basename(_) for _ in paths]
+        assert character['data']['max'] == 1.e6
+        assert [_['max'] == 1.e6 for _ in files] == [False, True, False]
+        assert min(_['min'] for _ in files) == character['data']['min']
+        assert sum(_['count'] for _ in files) == character['data']['count']
+
+    assert characters[2]['data'] == characters[0]['data']
@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import SETTINGS
+import scan
+from lib.lease import Leases
+
+
+DS_ID = 'cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.atmos.Amon.r1i1p1.latest.tas'
+
+
+@pytest.fixture
+def lease_path(tmpdir, monkeypatch):
+    monkeypatch.setattr(SETTINGS, 'LEASE_PATH', str(tmpdir.join('leases/{run}/{grouped_ds_id}')))
+
+
+def test_claim_is_exclusive(lease_path):
+    first, second = Leases('run'), Leases('run')
+
+    assert first.claim(DS_ID)
+    assert not second.claim(DS_ID)
+    assert first.holds(DS_ID) and not second.holds(DS_ID)
+
+    # Other runs are independent
+    assert Leases('other-run').claim(DS_ID)
+
+
+def test_done_is_never_claimed_again(lease_path):
+    first, second = Leases('run'), Leases('run')
+    first.claim(DS_ID)
+    first.release([DS_ID])
+
+    assert first.is_done(DS_ID)
+    assert not second.claim(DS_ID)
+
+
+def test_stopped_lease_can_be_claimed(lease_path):
+    first, second = Leases('run'), Leases('run')
+    first.claim(DS_ID)
+    first.stop()
+
+    assert not first.is_done(DS_ID)
+    assert second.claim(DS_ID)
+
+
+def test_expired_lease_is_reclaimed(lease_path):
+    first, second = Leases('run', lease_seconds=60), Leases('run', lease_seconds=60)
+    first.claim(DS_ID)
+
+    # Renewed leases do not expire
+    lease_file = first._lease_path(DS_ID, 0)
+    os.utime(lease_file, (time.time() - 120, time.time() - 120))
+    first.renew()
+    assert not second.claim(DS_ID)
+
+    os.utime(lease_file, (time.time() - 120, time.time() - 120))
+    assert second.claim(DS_ID)
+    assert second.holds(DS_ID)
+    assert not first.holds(DS_ID)
+    assert not Leases('run').claim(DS_ID)
+
+
+def test_reused_generation_is_not_held(lease_path):
+    first, second, third = (Leases('run', lease_seconds=60) for _ in range(3))
+    first.claim(DS_ID)
+
+    # The lease expires, is reclaimed and released, so the next claim reuses generation 0
+    os.utime(first._lease_path(DS_ID, 0), (time.time() - 120, time.time() - 120))
+    assert second.claim(DS_ID)
+    second.stop()
+    assert third.claim(DS_ID)
+
+    assert third.holds(DS_ID)
+    assert not first.holds(DS_ID)
+
+
+def _counting_extract(log_path, extract_dataset):
+    def extract(project, ds_id, *args, **kwargs):
+        with open(log_path, 'a') as writer:
+            writer.write(f'{ds_id}\n')
+
+        # Give the other scans time to try to claim the same datasets
+        time.sleep(0.2)
+        return extract_dataset(project, ds_id, *args, **kwargs)
+
+    return extract
+
+
+def _scan_coordinated(ds_ids):
+    return scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=ds_ids, coordinate='test-run')
+
+
+def test_coordinated_scans_scan_each_dataset_once(mini_archive, tmpdir, monkeypatch):
+    log_path = str(tmpdir.join('extracted.log'))
+    monkeypatch.setattr(scan, 'extract_dataset', _counting_extract(log_path, scan.extract_dataset))
+    ds_ids = sorted(mini_archive)
+
+    # Forked processes inherit the patched settings and extraction
+    context = multiprocessing.get_context('fork')
+
+    with ProcessPoolExecutor(max_workers=4, mp_context=context) as executor:
+        all_results = list(executor.map(_scan_coordinated, [ds_ids] * 4))
+
+    with open(log_path) as reader:
+        assert sorted(reader.read().split()) == ds_ids
+
+    success = sorted(ds_id for results in all_results for ds_id in results['success'])
+    failed = sorted(ds_id for results in all_results for ds_id in results['failed'])
+
+    # The pr dataset has no files
+    assert failed == [_ for _ in ds_ids if _.endswith('.pr')]
+    assert success == [_ for _ in ds_ids if _.endswith('.tas')]
+
+    leases = Leases('test-run')
+    assert all(leases.is_done(ds_id) for ds_id in ds_ids)
+
+    # A later scan of the same run has nothing left to do
+    assert _scan_coordinated(ds_ids) == {'success': [], 'failed': []}
@@ -0,0 +1,53 @@
+import pytest
+
+from lib import metrics
+
+
+def test_phases_accumulate():
+    scan_metrics = metrics.ScanMetrics()
+
+    for _ in range(2):
+        with scan_metrics.phase('open'):
+            with open(__file__, 'rb') as reader:
+                n_bytes = len(reader.read())
+
+    phases = scan_metrics.to_dict()
+    assert list(phases) == ['open']
+    assert phases['open']['seconds'] > 0
+
+    if metrics.read_bytes() is not None:
+        assert phases['open']['bytes_read'] >= 2 * n_bytes
+
+
+def test_phase_recorded_when_it_raises():
+    scan_metrics = metrics.ScanMetrics()
+
+    with pytest.raises(RuntimeError):
+        with scan_metrics.phase('extract'):
+            raise RuntimeError('boom')
+
+    assert 'extract' in scan_metrics.to_dict()
+
+
+def test_read_bytes_unavailable(monkeypatch):
+    monkeypatch.setattr(metrics, 'PROC_IO_PATH', '/no/such/file')
+    scan_metrics = metrics.ScanMetrics()
+
+    with scan_metrics.phase('open'):
+        pass
+
+    assert metrics.read_bytes() is None
+    assert scan_metrics.to_dict()['open']['bytes_read'] is None
+
+
+def test_summarise_phases():
+    all_phases = {f'ds{i}': {'open': {'seconds': float(i), 'bytes_read': 10}} for i in range(1, 101)}
+    all_phases['ds0'] = {'write': {'seconds': 0.5, 'bytes_read': None}}
+
+    summary = metrics.summarise_phases(all_phases)
+
+    assert summary['open']['count'] == 100
+    assert summary['open']['p50'] == 50.5
+    assert summary['open']['max'] == 100. and summary['open']['slowest'] == 'ds100'
+    assert summary['open']['bytes_read'] == 1000
+    assert summary['write']['bytes_read'] is None
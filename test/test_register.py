@@ -0,0 +1,135 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+import SETTINGS
+import analyse
+import scan
+from lib.register import JSONRegister, SQLiteRegister, get_register
+
+
+DS_IDS = ['cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.atmos.Amon.r1i1p1.latest.tas',
+          'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.tas',
+          'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.pr']
+
+
+def _character(mode='quick'):
+    return {'scan_metadata': {'mode': mode, 'last_scanned': '2020-01-01T00:00:00'},
+            'data': {'rank': 3, 'min': None, 'max': None}}
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def register(request, tmpdir, monkeypatch):
+    monkeypatch.setattr(SETTINGS, 'JSON_OUTPUT_PATH', str(tmpdir.join('register/{grouped_ds_id}.json')))
+
+    if request.param == 'json':
+        return JSONRegister('cmip5')
+
+    return SQLiteRegister('cmip5', db_path=str(tmpdir.join('register.sqlite')), batch_size=2)
+
+
+def test_put_get_delete(register):
+    assert register.get(DS_IDS[0]) is None
+
+    register.put(DS_IDS[0], _character())
+    register.flush()
+    assert register.get(DS_IDS[0]) == _character()
+
+    register.delete(DS_IDS[0])
+    assert register.get(DS_IDS[0]) is None
+
+
+def test_get_many_streams(register):
+    for ds_id in DS_IDS[:2]:
+        register.put(ds_id, _character())
+
+    register.flush()
+    records = register.get_many(iter(DS_IDS), batch_size=2)
+
+    assert list(records) == [(DS_IDS[0], _character()), (DS_IDS[1], _character()), (DS_IDS[2], None)]
+
+
+def test_select_by_facet_pattern(register):
+    for ds_id in DS_IDS:
+        register.put(ds_id, _character())
+
+    assert register.select({'institute': 'MRI'}) == DS_IDS[2:0:-1]
+    assert register.select({'model': 'Had*', 'variable': 'tas'}) == DS_IDS[:1]
+    assert register.select({}) == sorted(DS_IDS)
+
+
+def test_sqlite_writes_in_batches(tmpdir):
+    db_path = str(tmpdir.join('register.sqlite'))
+    register = SQLiteRegister('cmip5', db_path=db_path, batch_size=2)
+
+    def count_rows():
+        return sqlite3.connect(db_path).execute('SELECT COUNT(*) FROM cmip5').fetchone()[0]
+
+    register.put(DS_IDS[0], _character())
+    assert register.get(DS_IDS[2]) is None
+    assert count_rows() == 0
+
+    register.put(DS_IDS[1], _character())
+    assert count_rows() == 2
+
+    row = sqlite3.connect(db_path).execute('SELECT institute, mode FROM cmip5 WHERE ds_id = ?',
+                                           (DS_IDS[1],)).fetchone()
+    assert row == ('MRI', 'quick')
+
+
+def test_json_writes_in_batches(tmpdir, monkeypatch):
+    monkeypatch.setattr(SETTINGS, 'JSON_OUTPUT_PATH', str(tmpdir.join('register/{grouped_ds_id}.json')))
+    register = JSONRegister('cmip5', batch_size=2)
+
+    register.put(DS_IDS[0], _character())
+    assert register.get(DS_IDS[0]) == _character()
+    assert not os.path.exists(register.location(DS_IDS[0]))
+
+    register.put(DS_IDS[1], _character('full'))
+    assert [os.path.exists(register.location(_)) for _ in DS_IDS[:2]] == [True, True]
+
+    with open(register.location(DS_IDS[1])) as reader:
+        assert json.load(reader) == _character('full')
+
+
+def test_json_compact(tmpdir, monkeypatch):
+    monkeypatch.setattr(SETTINGS, 'JSON_OUTPUT_PATH', str(tmpdir.join('register/{grouped_ds_id}.json')))
+    monkeypatch.setattr(SETTINGS, 'COMPACT_JSON', True)
+    register = JSONRegister('cmip5', batch_size=1)
+    register.put(DS_IDS[0], _character())
+
+    with open(register.location(DS_IDS[0])) as reader:
+        text = reader.read()
+
+    assert '\n' not in text and ', ' not in text
+    assert json.loads(text) == _character()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_scan_and_analyse_with_sqlite_register(mini_archive, workers, capsys):
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=DS_IDS, workers=workers, backend='sqlite')
+    assert sorted(results['success']) == sorted(DS_IDS[:2])
+
+    register = get_register('cmip5', 'sqlite')
+    assert register.select({'variable': 'tas'}) == sorted(DS_IDS[:2])
+    assert json.dumps(register.get(DS_IDS[0])['data']['shape']) == '[120, 4, 8]'
+
+    # Re-scanning by facet pattern from the register skips what is already registered
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', facets={'variable': 'tas'},
+                                 backend='sqlite', from_register=True)
+    assert sorted(results['success']) == sorted(DS_IDS[:2])
+    assert 'Already ran for' in capsys.readouterr().out
+
+    analyse.analyse_datasets('cmip5', facets={'variable': 'tas'}, backend='sqlite')
+    assert "('data', 'rank') == 3:   2" in capsys.readouterr().out
+
+
+def test_full_scan_upgrades_quick_record(mini_archive):
+    scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=DS_IDS[:1])
+    scan.scan_datasets('cmip5', 'full', 'ceda', ds_ids=DS_IDS[:1])
+
+    record = get_register('cmip5').get(DS_IDS[0])
+    assert record['scan_metadata']['mode'] == 'full'
+    assert record['data']['min'] == 0.
@@ -0,0 +1,231 @@
+import io
+import os
+
+import pytest
+
+import scan
+
+
+TAS_IDS = ['cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.atmos.Amon.r1i1p1.latest.tas',
+           'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.tas']
+PR_ID = 'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.pr'
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_scan_datasets_counts_outcomes(mini_archive, workers):
+    """ Checks every dataset outcome is collected whether or not a worker pool is used"""
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS + [PR_ID], workers=workers)
+
+    assert sorted(results['success']) == sorted(TAS_IDS)
+    assert results['failed'] == [PR_ID]
+
+
+def test_scan_datasets_survives_crashing_dataset(mini_archive, monkeypatch):
+    """ Checks an unexpected exception in one dataset does not stop the others"""
+    extract_dataset = scan.extract_dataset
+
+    def crashing_extract_dataset(project, ds_id, ds_path, mode, location, **kwargs):
+        if 'MOHC' in ds_id:
+            raise RuntimeError('boom')
+        return extract_dataset(project, ds_id, ds_path, mode, location, **kwargs)
+
+    monkeypatch.setattr(scan, 'extract_dataset', crashing_extract_dataset)
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS, workers=2)
+
+    assert results['success'] == [TAS_IDS[1]]
+    assert results['failed'] == [TAS_IDS[0]]
+
+
+def test_scan_datasets_survives_dead_worker(mini_archive, monkeypatch):
+    """ Checks a worker process dying only fails the dataset that killed it"""
+    extract_dataset = scan.extract_dataset
+
+    def dying_extract_dataset(project, ds_id, ds_path, mode, location, **kwargs):
+        if 'MOHC' in ds_id:
+            os._exit(1)
+        return extract_dataset(project, ds_id, ds_path, mode, location, **kwargs)
+
+    monkeypatch.setattr(scan, 'extract_dataset', dying_extract_dataset)
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS, workers=2)
+
+    assert results['success'] == [TAS_IDS[1]]
+    assert results['failed'] == [TAS_IDS[0]]
+
+
+def test_scan_datasets_survives_unpicklable_outcome(mini_archive, monkeypatch):
+    """ Checks an outcome that cannot be sent back from a worker fails only its dataset"""
+    extract_dataset = scan.extract_dataset
+
+    def unpicklable_extract_dataset(project, ds_id, ds_path, mode, location, **kwargs):
+        outcome = extract_dataset(project, ds_id, ds_path, mode, location, **kwargs)
+
+        if 'MOHC' in ds_id:
+            outcome['error'] = lambda: None
+        return outcome
+
+    monkeypatch.setattr(scan, 'extract_dataset', unpicklable_extract_dataset)
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS, workers=2)
+
+    assert results['success'] == [TAS_IDS[1]]
+    assert results['failed'] == [TAS_IDS[0]]
+
+
+def test_scan_datasets_replaces_broken_pool(mini_archive, monkeypatch, capsys):
+    """ Checks datasets found after a worker died are extracted in a new pool, not in isolation"""
+    import time
+
+    extract_dataset = scan.extract_dataset
+
+    def dying_extract_dataset(project, ds_id, ds_path, mode, location, **kwargs):
+        if 'MOHC' in ds_id:
+            os._exit(1)
+        return extract_dataset(project, ds_id, ds_path, mode, location, **kwargs)
+
+    def iter_ds_ids():
+        yield TAS_IDS[0]
+
+        # Found once the pool has broken
+        time.sleep(1)
+        yield from [TAS_IDS[1], PR_ID]
+
+    monkeypatch.setattr(scan, 'extract_dataset', dying_extract_dataset)
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=iter_ds_ids(), workers=2)
+
+    assert results['success'] == [TAS_IDS[1]]
+    assert sorted(results['failed']) == sorted([TAS_IDS[0], PR_ID])
+
+    isolated = [line for line in capsys.readouterr().out.splitlines() if 're-running in isolation' in line]
+    assert len(isolated) == 1 and TAS_IDS[0] in isolated[0]
+
+
+def test_corrupt_record_is_deleted_when_written(mini_archive):
+    """ Checks extraction leaves a corrupt record in place for the writing stage to delete"""
+    from lib.register import get_register
+
+    register = get_register('cmip5', 'json')
+    json_path = register.location(PR_ID)
+    os.makedirs(os.path.dirname(json_path), exist_ok=True)
+
+    with open(json_path, 'w') as writer:
+        writer.write('{"test": }')
+
+    outcome = scan.extract_dataset('cmip5', PR_ID, mini_archive[PR_ID], 'quick', 'ceda', backend='json')
+    assert outcome['corrupt_record'] and os.path.exists(json_path)
+
+    assert not scan.write_outcome('cmip5', outcome, backend='json')
+    assert not os.path.exists(json_path)
+
+
+def test_full_scan_upgrades_estimate_records(mini_archive):
+    """ Checks estimate records are re-scanned in full mode but satisfy quick and estimate scans"""
+    from lib.register import get_register
+
+    scan.scan_datasets('cmip5', 'estimate', 'ceda', ds_ids=TAS_IDS)
+    register = get_register('cmip5')
+    assert register.get(TAS_IDS[0])['scan_metadata']['mode'] == 'estimate'
+
+    for mode in ('quick', 'estimate'):
+        assert scan.scan_datasets('cmip5', mode, 'ceda', ds_ids=TAS_IDS)['success'] == TAS_IDS
+        assert register.get(TAS_IDS[0])['scan_metadata']['mode'] == 'estimate'
+
+    scan.scan_datasets('cmip5', 'full', 'ceda', ds_ids=TAS_IDS)
+    record = register.get(TAS_IDS[0])
+
+    assert record['scan_metadata']['mode'] == 'full'
+    assert 'sample' not in record['data']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_scan_datasets_reports_phase_metrics(mini_archive, monkeypatch, capsys, workers):
+    """ Checks phase timings are recorded in the character, the metrics file and the report"""
+    import json
+
+    import SETTINGS
+    from lib.register import get_register
+
+    monkeypatch.setattr(SETTINGS, 'WRITE_METRICS', True)
+    monkeypatch.setitem(SETTINGS.ENGINES, 'full', 'header')
+    scan.scan_datasets('cmip5', 'full', 'ceda', ds_ids=TAS_IDS + [PR_ID], workers=workers)
+
+    phases = get_register('cmip5').get(TAS_IDS[0])['scan_metadata']['metrics']
+    assert {'discovery', 'extract', 'files', 'merge'} <= set(phases)
+    assert phases['extract']['seconds'] >= phases['files']['seconds']
+
+    with open(SETTINGS.METRICS_PATH.format(project='cmip5')) as reader:
+        lines = [json.loads(line) for line in reader]
+
+    assert sorted((line['ds_id'], line['status']) for line in lines) == sorted(
+        [(TAS_IDS[0], 'success'), (TAS_IDS[1], 'success'), (PR_ID, 'no_files_error')])
+    assert 'write' in lines[0]['phases'] or lines[0]['ds_id'] == PR_ID
+
+    report = capsys.readouterr().out
+    assert '[INFO] Phase timings (seconds) over 3 datasets:' in report
+    assert '[INFO]   extract: p50=' in report
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_scan_datasets_writes_while_discovering(mini_archive, monkeypatch, workers):
+    """ Checks the first dataset is written before discovery has finished"""
+    import time
+
+    from lib.register import get_register
+
+    def slow_discovery(project, **kwargs):
+        yield TAS_IDS[0], mini_archive[TAS_IDS[0]]
+
+        # Wait for the first dataset to be written before "finding" the next
+        deadline = time.time() + 30
+        while get_register(project).get(TAS_IDS[0]) is None:
+            assert time.time() < deadline, 'First dataset was not written during discovery'
+            time.sleep(0.01)
+
+        yield TAS_IDS[1], mini_archive[TAS_IDS[1]]
+
+    monkeypatch.setattr(scan, 'iter_selected_dataset_paths', slow_discovery)
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS, workers=workers)
+
+    assert results == {'success': TAS_IDS, 'failed': []}
+
+
+def test_scan_datasets_raises_discovery_error(mini_archive):
+    with pytest.raises(Exception, match='Invalid paths provided'):
+        scan.scan_datasets('cmip5', 'quick', 'ceda', paths=['/not/in/archive'])
+
+
+def test_dataset_ids_from_file_and_stdin(tmpdir, monkeypatch):
+    ds_ids_path = tmpdir.join('ds_ids.txt')
+    ds_ids_path.write(f'{TAS_IDS[0]}\n\n{TAS_IDS[1]},{PR_ID}\n')
+
+    assert list(scan._to_items([f'@{ds_ids_path}'])) == TAS_IDS + [PR_ID]
+    assert list(scan._to_items([','.join(TAS_IDS)])) == TAS_IDS
+
+    monkeypatch.setattr('sys.stdin', io.StringIO('\n'.join(TAS_IDS) + '\n'))
+    assert list(scan._to_items(['-'])) == TAS_IDS
+
+
+def test_scan_datasets_streams_dataset_ids(mini_archive):
+    """ Checks scanning starts before every DSID has been read"""
+    import time
+
+    from lib.register import get_register
+
+    def slow_ds_ids():
+        yield TAS_IDS[0]
+
+        deadline = time.time() + 30
+        while get_register('cmip5').get(TAS_IDS[0]) is None:
+            assert time.time() < deadline, 'First dataset was not written while reading DSIDs'
+            time.sleep(0.01)
+
+        yield TAS_IDS[1]
+
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=slow_ds_ids())
+    assert results == {'success': TAS_IDS, 'failed': []}
+
+
+def test_scan_dataset_writes_record(mini_archive):
+    """ Checks a single dataset scan leaves its record on disk, not buffered"""
+    from lib.register import JSONRegister
+
+    assert scan.scan_dataset('cmip5', TAS_IDS[0], mini_archive[TAS_IDS[0]], 'quick', 'ceda', backend='json')
+    assert os.path.exists(JSONRegister('cmip5').location(TAS_IDS[0]))
@@ -0,0 +1,180 @@
+import os
+
+import pytest
+
+import scan
+from lib import state
+from lib.register import get_register
+
+
+TAS_IDS = ['cmip5.output1.MOHC.HadGEM2-ES.rcp45.mon.atmos.Amon.r1i1p1.latest.tas',
+           'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.tas']
+PR_ID = 'cmip5.output1.MRI.MRI-CGCM3.rcp45.mon.atmos.Amon.r1i1p1.latest.pr'
+
+
+def test_latest_entry_wins(tmpdir):
+    manifest_path = str(tmpdir.join('state.jsonl'))
+    manifest = state.StateManifest(manifest_path)
+
+    manifest.record('a', 'quick', 'extract_error')
+    manifest.record('b', 'quick', 'success')
+    manifest.flush()
+    manifest.record('a', 'full', 'success')
+    manifest.record('b', 'full', 'crashed')
+    manifest.flush()
+
+    manifest = state.StateManifest(manifest_path)
+
+    assert manifest.get('a')['status'] == 'success'
+    assert manifest.is_complete('a', 'quick')
+    assert manifest.is_complete('a', 'full')
+    assert not manifest.is_complete('b', 'quick')
+    assert manifest.failed() == ['b']
+    assert manifest.get('c') is None
+
+
+def test_entries_are_written_on_flush(tmpdir):
+    manifest_path = tmpdir.join('state.jsonl')
+    manifest = state.StateManifest(str(manifest_path))
+
+    manifest.record('a', 'quick', 'success')
+    assert not manifest_path.exists()
+
+    manifest.flush()
+    assert len(manifest_path.readlines()) == 1
+
+
+def test_unknown_status(tmpdir):
+    with pytest.raises(ValueError):
+        state.StateManifest(str(tmpdir.join('state.jsonl'))).record('a', 'quick', 'broken')
+
+
+def test_truncated_line_is_ignored(tmpdir):
+    manifest_path = tmpdir.join('state.jsonl')
+    manifest = state.StateManifest(str(manifest_path))
+    manifest.record('a', 'quick', 'success')
+    manifest.flush()
+
+    with open(str(manifest_path), 'a') as writer:
+        writer.write('{"ds_id": "b", "mo')
+
+    assert state.StateManifest(str(manifest_path)).failed() == []
+
+
+def test_compact(tmpdir):
+    manifest_path = tmpdir.join('state.jsonl')
+    manifest = state.StateManifest(str(manifest_path))
+
+    for status in ('no_files_error', 'extract_error', 'success'):
+        manifest.record('a', 'quick', status)
+        manifest.flush()
+
+    # Appended by another process
+    other = state.StateManifest(str(manifest_path))
+    other.record('b', 'quick', 'error')
+    other.flush()
+
+    manifest.compact()
+
+    assert len(manifest_path.readlines()) == 2
+    assert state.StateManifest(str(manifest_path)).failed() == ['b']
+
+
+def test_compact_keeps_entries_appended_meanwhile(tmpdir, monkeypatch):
+    import threading
+
+    manifest_path = str(tmpdir.join('state.jsonl'))
+    manifest = state.StateManifest(manifest_path)
+
+    for status in ('no_files_error', 'extract_error', 'success'):
+        manifest.record('a', 'quick', status)
+        manifest.flush()
+
+    other = state.StateManifest(manifest_path)
+    other.record('b', 'quick', 'error')
+    appending = threading.Thread(target=other.flush)
+    load = manifest._load
+
+    def load_while_appending():
+        entries = load()
+        appending.start()
+
+        # Another scan appends while the manifest is being compacted
+        appending.join(0.2)
+        assert appending.is_alive()
+        return entries
+
+    monkeypatch.setattr(manifest, '_load', load_while_appending)
+    manifest.compact()
+    appending.join()
+
+    assert state.StateManifest(manifest_path).failed() == ['b']
+
+
+def test_skip_does_not_read_register(mini_archive, monkeypatch):
+    """ Checks datasets recorded as scanned are skipped from the manifest alone"""
+    scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS)
+
+    def fail(*args):
+        raise AssertionError('register was read')
+
+    monkeypatch.setattr(get_register('cmip5'), 'get', fail)
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS)
+
+    assert results['success'] == TAS_IDS
+
+
+def test_register_is_checked_without_manifest(mini_archive):
+    """ Checks datasets registered before the manifest existed are recorded, not re-scanned"""
+    scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS)
+    manifest_path = str(state.get_state('cmip5'))
+    state._manifests.clear()
+
+    os.remove(manifest_path)
+
+    scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS)
+    assert open(manifest_path).read().count('"success"') == 2
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_only_failed(mini_archive, workers):
+    scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS + [PR_ID], workers=workers)
+    state._manifests.clear()
+
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', only_failed=True, workers=workers)
+    assert results['failed'] == [PR_ID]
+    assert results['success'] == []
+
+    # Limited to the datasets given
+    results = scan.scan_datasets('cmip5', 'quick', 'ceda', ds_ids=TAS_IDS, only_failed=True)
+    assert results == {'success': [], 'failed': []}
+
+
+def test_only_changed_datasets_are_rescanned(mini_archive, monkeypatch):
+    scan.scan_datasets('cmip5', 'full', 'ceda', ds_ids=TAS_IDS)
+    fingerprint = get_register('cmip5').get(TAS_IDS[0])['scan_metadata']['fingerprint']
+    assert state.get_state('cmip5').get(TAS_IDS[0])['fingerprint'] == fingerprint
+
+    extracted = []
+    extract_character = scan.extract_character
+
+    def counting_extract_character(files, *args, **kwargs):
+        extracted.append(files)
+        return extract_character(files, *args, **kwargs)
+
+    monkeypatch.setattr(scan, 'extract_character', counting_extract_character)
+
+    # Unchanged datasets are skipped, even in full mode
+    assert scan.scan_datasets('cmip5', 'full', 'ceda', ds_ids=TAS_IDS)['success'] == TAS_IDS
+    assert extracted == []
+
+    # Retract a file of one dataset
+    ds_path = mini_archive[TAS_IDS[0]]
+    os.remove(os.path.join(ds_path, sorted(os.listdir(ds_path))[-1]))
+
+    assert scan.scan_datasets('cmip5', 'full', 'ceda', ds_ids=TAS_IDS)['success'] == TAS_IDS
+    assert len(extracted) == 1 and len(extracted[0]) == 1
+
+    record = get_register('cmip5').get(TAS_IDS[0])
+    assert record['scan_metadata']['fingerprint'] != fingerprint
+    assert record['data']['shape'][0] == 60
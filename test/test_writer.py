@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from lib import writer
+
+
+def test_write_atomic_replaces_file(tmpdir):
+    path = str(tmpdir.join('a', 'b', 'record.json'))
+
+    writer.write_atomic(path, 'first')
+    writer.write_atomic(path, 'second')
+
+    with open(path) as reader:
+        assert reader.read() == 'second'
+
+    assert os.listdir(os.path.dirname(path)) == ['record.json']
+
+
+def test_write_atomic_keeps_old_file_on_failure(tmpdir, monkeypatch):
+    path = str(tmpdir.join('record.json'))
+    writer.write_atomic(path, 'old')
+
+    def fail(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', fail)
+
+    with pytest.raises(OSError):
+        writer.write_atomic(path, 'new')
+
+    with open(path) as reader:
+        assert reader.read() == 'old'
+
+    assert os.listdir(str(tmpdir)) == ['record.json']
+
+
+def test_make_dirs_only_once(tmpdir, monkeypatch):
+    made = []
+    makedirs = os.makedirs
+
+    def counting_makedirs(dr, **kwargs):
+        made.append(dr)
+        makedirs(dr, **kwargs)
+
+    monkeypatch.setattr(os, 'makedirs', counting_makedirs)
+
+    for name in ('a.json', 'b.json', 'c.json'):
+        writer.make_dirs(str(tmpdir.join('out', name)))
+
+    assert made == [str(tmpdir.join('out'))]
+
+
+def test_write_atomic_remakes_removed_directory(tmpdir):
+    path = str(tmpdir.join('out', 'record.json'))
+    writer.write_atomic(path, 'first')
+
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+    writer.write_atomic(path, 'second')
+
+    with open(path) as reader:
+        assert reader.read() == 'second'
+
+
+def test_write_many(tmpdir):
+    texts = {str(tmpdir.join(f'{i % 3}', f'{i}.json')): str(i) for i in range(20)}
+    writer.write_many(texts, threads=4)
+
+    for path, text in texts.items():
+        with open(path) as reader:
+            assert reader.read() == text